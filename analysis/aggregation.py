@@ -0,0 +1,169 @@
+import numpy as np
+
+from analysis.instrumentation import METRICS
+from classes.Blockchain import Blockchain, Flow, FLOW_ROLES
+from classes.NodeRecord import NodeRecord
+from classes.dict_initial_values import providers_init, location_init, providers_init_flow, location_init_flow
+
+## Columnar aggregation ##
+class NodeTable:
+    """Columnar table of the per-node aggregation inputs. Groups get integer codes in first-seen order,
+    starting with the entries of the initial dicts, so the output keeps the key order of the dict path."""
+    def __init__(self, providers_initial: dict = providers_init, locations_initial: dict = location_init):
+        self.ips = [] #*packed IPs
+        self.asns = []
+        self.isValidator = []
+        self.stakes = []
+
+        #Group codes
+        self.providerCodes = {provider: code for code, provider in enumerate(providers_initial)} #*provider -> code
+        self.continentCodes = {continent: code for code, continent in enumerate(locations_initial)} #*continent -> code
+        self.countryCodes = {} #*(continent, country) -> code
+        for continent in locations_initial:
+            for country in locations_initial[continent]["Countries"]:
+                self.countryCodes[(continent, country)] = len(self.countryCodes)
+        self.providers = []
+        self.continents = []
+        self.countries = []
+
+    def __len__(self):
+        return len(self.ips)
+
+    def Append(self, record: NodeRecord, asn: str, provider_name: str, continent: str, country: str):
+        #Only validators carry stake, same as the dict path
+        is_validator = bool(record.isValidator)
+        stake = (0 if not record.stake else int(record.stake)) if is_validator else 0
+
+        self.isValidator.append(is_validator)
+        self.AppendNode(record.packedIp, asn, provider_name, continent, country, stake)
+
+    def AppendNode(self, packed_ip, asn: str, provider_name: str, continent: str, country: str, stake: int):
+        self.ips.append(packed_ip)
+        self.asns.append(asn)
+        self.stakes.append(stake)
+        self.providers.append(self.providerCodes.setdefault(provider_name, len(self.providerCodes)))
+        self.continents.append(self.continentCodes.setdefault(continent, len(self.continentCodes)))
+        self.countries.append(self.countryCodes.setdefault((continent, country), len(self.countryCodes)))
+
+class FlowNodeTable(NodeTable):
+    """Node table of a Flow analysis, with the role and active state of every node"""
+    def __init__(self):
+        super().__init__(providers_init_flow, location_init_flow)
+        self.roles = []
+        self.isActive = []
+
+    def Append(self, record: NodeRecord, asn: str, provider_name: str, continent: str, country: str):
+        self.roles.append(FLOW_ROLES.index(record.extraInfo["role"]))
+        self.isActive.append(bool(record.extraInfo["is_active"]))
+        self.AppendNode(record.packedIp, asn, provider_name, continent, country, 0 if not record.stake else int(float(record.stake)))
+
+def GroupTotals(codes: np.ndarray, groups: int, is_validator: np.ndarray, stakes: np.ndarray) -> dict:
+    """Node, validator, non-validator and stake totals per group code"""
+    nodes = np.bincount(codes, minlength=groups)
+    validators = np.bincount(codes[is_validator], minlength=groups)
+    stake = np.zeros(groups, dtype=stakes.dtype)
+    np.add.at(stake, codes, stakes)
+
+    return {
+        "Total Non-Validator Nodes": nodes - validators,
+        "Total Validators": validators,
+        "Total Nodes": nodes,
+        "Total Stake": stake
+    }
+
+def Percentages(values: np.ndarray, total: int) -> list:
+    """values * 100 / total for every group, equal to Python's int true division"""
+    if not total:
+        raise ZeroDivisionError("division by zero")
+
+    #Float64 division rounds the same as int true division while the operands fit in its 53 bit mantissa
+    if values.dtype != object and int(values.max(initial=0)) * 100 < 2**53 and total < 2**53:
+        return (values * 100 / total).tolist()
+    return [value * 100 / total for value in values.tolist()]
+
+@METRICS.Staged("percentages")
+def GroupPercentages(totals: dict, blockchain_obj: Blockchain) -> dict:
+    percentages = {"Percentage of Total Stake": Percentages(totals["Total Stake"], blockchain_obj.totalStake)}
+    if blockchain_obj.totalNonValidatorNodes:
+        percentages["Percentage of Non-Validator Nodes"] = Percentages(totals["Total Non-Validator Nodes"], blockchain_obj.totalNonValidatorNodes)
+    percentages["Percentage of Validators"] = Percentages(totals["Total Validators"], blockchain_obj.totalValidators)
+    percentages["Percentage of Total Nodes"] = Percentages(totals["Total Nodes"], blockchain_obj.totalNodes)
+    return percentages
+
+def GroupEntry(columns: dict, i: int) -> dict:
+    return {key: values[i] for key, values in columns.items()}
+
+def AggregateDistribution(table: NodeTable, blockchain_obj: Blockchain):
+    """Computes the totals, provider distribution and geographic distribution of blockchain_obj from the node table
+    with grouped reductions. Replaces the per-node dict updates and Blockchain.CalculatePercentages()."""
+    print("\n\tAggregating %d nodes." % len(table), flush=True)
+    is_validator = np.array(table.isValidator, dtype=bool)
+
+    #Stake sums stay exact, fall back to Python ints when they could overflow int64
+    total_stake = sum(table.stakes)
+    stakes = np.array(table.stakes, dtype=np.int64 if total_stake < 2**63 else object)
+
+    #Network totals
+    blockchain_obj.totalNodes = len(table)
+    blockchain_obj.totalValidators = int(is_validator.sum())
+    blockchain_obj.totalNonValidatorNodes = blockchain_obj.totalNodes - blockchain_obj.totalValidators
+    blockchain_obj.totalStake = total_stake
+
+    #Group totals and percentages as Python lists so they serialize as the dict path does
+    columns = {}
+    for name, codes, groups in [("providers", table.providers, table.providerCodes), ("continents", table.continents, table.continentCodes), ("countries", table.countries, table.countryCodes)]:
+        totals = GroupTotals(np.array(codes, dtype=np.intp), len(groups), is_validator, stakes)
+        percentages = GroupPercentages(totals, blockchain_obj)
+        columns[name] = ({key: values.tolist() for key, values in totals.items()}, percentages)
+
+    #Provider Distribution
+    totals, percentages = columns["providers"]
+    blockchain_obj.providersData = {provider: {**GroupEntry(totals, i), **GroupEntry(percentages, i)} for provider, i in table.providerCodes.items()}
+
+    #Geographic Distribution. Countries are nested under their continent before the continent percentages.
+    totals, percentages = columns["continents"]
+    blockchain_obj.continentData = {continent: {**GroupEntry(totals, i), "Countries": {}, **GroupEntry(percentages, i)} for continent, i in table.continentCodes.items()}
+    totals, percentages = columns["countries"]
+    for (continent, country), i in table.countryCodes.items():
+        blockchain_obj.continentData[continent]["Countries"][country] = {**GroupEntry(totals, i), **GroupEntry(percentages, i)}
+
+    print("\tDone.", flush=True)
+
+def RoleTotals(codes: np.ndarray, groups: int, roles: np.ndarray, is_active: np.ndarray, stakes: np.ndarray) -> np.ndarray:
+    """group x role x (active, total) x (count, stake) tensor, see Flow.RoleTensor()"""
+    tensor = np.zeros((groups, len(FLOW_ROLES), 2, 2), dtype=stakes.dtype)
+    np.add.at(tensor, (codes, roles, 1, 0), 1)
+    np.add.at(tensor, (codes, roles, 1, 1), stakes)
+    np.add.at(tensor, (codes[is_active], roles[is_active], 0, 0), 1)
+    np.add.at(tensor, (codes[is_active], roles[is_active], 0, 1), stakes[is_active])
+    return tensor
+
+def AggregateFlowDistribution(table: FlowNodeTable, blockchain_obj: Flow):
+    """Computes the role totals, provider distribution and geographic distribution of a Flow object from the node table
+    as role tensors. Replaces the per-node dict updates."""
+    print("\n\tAggregating %d nodes." % len(table), flush=True)
+    roles = np.array(table.roles, dtype=np.intp)
+    is_active = np.array(table.isActive, dtype=bool)
+    stakes = np.array(table.stakes, dtype=np.int64 if sum(table.stakes) < 2**63 else object)
+
+    tensors = [RoleTotals(np.array(codes, dtype=np.intp), len(groups), roles, is_active, stakes) for codes, groups in [(table.providers, table.providerCodes), (table.continents, table.continentCodes), (table.countries, table.countryCodes)]]
+    providers, continents, countries = [tensor.tolist() for tensor in tensors]
+
+    #Network totals. Every node is counted under exactly one provider.
+    network = tensors[0].sum(axis=0).tolist()
+    for r, role in enumerate(FLOW_ROLES):
+        quantities = blockchain_obj.ReturnNodeTypeQuantities(role)
+        quantities["active"], quantities["total"] = network[r][0][0], network[r][1][0]
+        blockchain_obj.totalStake[role] = {"active": network[r][0][1], "total": network[r][1][1]}
+    blockchain_obj.totalNodes = len(table)
+    blockchain_obj.totalInactiveNodes = len(table) - int(is_active.sum())
+
+    #Provider and Geographic Distribution entries, countries nested under their continent
+    blockchain_obj.providersData = {provider: Flow.RoleEntry(providers[i]) for provider, i in table.providerCodes.items()}
+    blockchain_obj.continentData = {continent: {**Flow.RoleEntry(continents[i]), "Countries": {}} for continent, i in table.continentCodes.items()}
+    for (continent, country), i in table.countryCodes.items():
+        blockchain_obj.continentData[continent]["Countries"][country] = Flow.RoleEntry(countries[i])
+
+    #Percentages from the same tensors, reordered as Flow.Entities() with the countries grouped by continent
+    country_order = [table.countryCodes[(continent, country)] for continent in blockchain_obj.continentData for country in blockchain_obj.continentData[continent]["Countries"]]
+    blockchain_obj.CalculatePercentages(np.concatenate([tensors[0], tensors[1], tensors[2][country_order]]))
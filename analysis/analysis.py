@@ -1,159 +1,221 @@
-import json
-import ipinfo #type: ignore
+from itertools import islice
 
 
 import config.globals
-from analysis.utils import IpAsnLookup, IpGeoLookup, ProviderAnalysis, CountryAnalysis, FlowProviderAnalysis, FlowCountryAnalysis, IsValidIp
+from analysis.aggregation import NodeTable, FlowNodeTable, AggregateDistribution, AggregateFlowDistribution
+from analysis.backends import MakeLookupBackend
+from analysis.cache import IpCache
+from analysis.enrichment import EnrichIps
+from analysis.instrumentation import METRICS
+from analysis.ipranges import ArePublicIps
+from analysis.reader import NodeFileReader
+from analysis.delta import DeltaAggregator
+from analysis.utils import ProviderAnalysis, CountryAnalysis, FlowProviderAnalysis, FlowCountryAnalysis, NodeState, AddNode, AddFlowNode, AddShares, AddFlowShares, DatacenterKey
 from classes.Blockchain import Blockchain, Flow
+from classes.NodeRecord import NodeRecord
 
 
 ## Holds analysis functions ##
-def GetNetworkProviderDistribution(providers_to_track: dict, countries_to_track: dict, providers_short_to_object_map: dict, countries_short_to_object_map: dict, blockchain_obj) -> Blockchain:
-    #Get IP address JSON file
-    path = f"{config.globals.BASE_DIR}/json/{blockchain_obj.target}.json"
-    with open(path, "r") as f:
-        json_analysis = json.load(f)
-        f.close()
+def GetNodeFileReader(target: str) -> NodeFileReader:
+    """Returns a streaming reader for the IP address JSON file of the target blockchain in the `json/` folder"""
+    return NodeFileReader(f"{config.globals.BASE_DIR}/json/{target}.json")
+
+def OpenLookup(workers: int = 1, backend_name: str = "remote") -> tuple:
+    """Builds the lookup backend and opens the persistent enrichment cache for remote lookups"""
+    backend = MakeLookupBackend(backend_name, workers)
+    ip_cache = None
+    if backend.isRemote:
+        ip_cache = IpCache(config.globals.CACHE_PATH, config.globals.CACHE_TTL, config.globals.CACHE_MAX_ENTRIES)
+    return backend, ip_cache
+
+def CloseLookup(ip_cache: IpCache = None):
+    if ip_cache:
+        print("\tIP cache: %d hits, %d misses." % (ip_cache.hits, ip_cache.misses), flush=True)
+        METRICS.Count("ip_cache_hits", ip_cache.hits)
+        METRICS.Count("ip_cache_misses", ip_cache.misses)
+        ip_cache.Close()
+
+def ResolveBlockchainsIps(targets: list, workers: int = 1, backend_name: str = "remote") -> dict:
+    """Resolves the union of the IPs of all target blockchains in a single enrichment pass.
+    IPs shared by several blockchains are looked up once."""
+    target_ips = {}
+    for target in targets:
+        target_ips.update(dict.fromkeys(ip for ip, _ in METRICS.Timed("load", GetNodeFileReader(target).Nodes())))
+
+    print("\n\nEnriching %d unique IPs across %d blockchains. This may take a few minutes..." % (len(target_ips), len(targets)), flush=True)
+    backend, ip_cache = OpenLookup(workers, backend_name)
+    enriched = EnrichIps(list(target_ips), "all", backend, ip_cache, workers)
+    CloseLookup(ip_cache)
+    print("Done.", flush=True)
+    return enriched
+
+def EnrichNodes(nodes, target: str, workers: int = 1, backend_name: str = "remote", enriched: dict = None, known: dict = None):
+    """Generator pipeline over the streamed (ip, node_info) pairs. Yields (ip, node_info, (asn, provider_name, geo)),
+    resolving the nodes in chunks of ENRICHMENT_CHUNK_SIZE unless a multi-blockchain run already resolved them in enriched.
+    IPs in known reuse the enrichment of an earlier run. The enrichment is None for invalid IPs, which are filtered out
+    of each chunk in bulk before any lookup is scheduled."""
+    known = known or {}
+    backend, ip_cache = OpenLookup(workers, backend_name) if enriched is None else (None, None)
+    try:
+        while True:
+            chunk = list(islice(nodes, config.globals.ENRICHMENT_CHUNK_SIZE))
+            if not chunk:
+                break
+            valid = ArePublicIps([ip for ip, _ in chunk])
+
+            #Resolve ASN and geo data for the valid IPs of the chunk concurrently
+            if enriched is None:
+                chunk_enriched = EnrichIps([ip for (ip, _), is_valid in zip(chunk, valid) if is_valid and ip not in known], target, backend, ip_cache, workers, validated=True)
+            else:
+                chunk_enriched = enriched
+            for (ip, node_info), is_valid in zip(chunk, valid):
+                if not is_valid:
+                    yield ip, node_info, None
+                else:
+                    yield ip, node_info, known[ip] if ip in known else chunk_enriched.get(ip)
+    finally:
+        CloseLookup(ip_cache)
+
+def GetNetworkProviderDistribution(providers_to_track: dict, countries_to_track: dict, providers_short_to_object_map: dict, countries_short_to_object_map: dict, blockchain_obj, workers: int = 1, backend_name: str = "remote", enriched: dict = None, incremental: bool = False) -> Blockchain:
+    #Read the top-level keys of the IP address JSON file, the nodes are streamed
+    reader = GetNodeFileReader(blockchain_obj.target)
+    with METRICS.Stage("load"):
+        header = reader.Header()
 
     # Update blockchain object analysisDate and info
-    analysisDate = json_analysis["timestamp"] #This is purely for human-readability, no need to be date type.
+    analysisDate = header["timestamp"] #This is purely for human-readability, no need to be date type.
     blockchain_obj.analysisDate = analysisDate
-    target_ips = json_analysis["nodes"]
     blockchain_obj.info = {
-        "Collection Method": json_analysis["collection_method"],
-        "Context": json_analysis["chain_data"]
+        "Collection Method": header["collection_method"],
+        "Context": header["chain_data"]
     }
 
-    print("\n\nAnalyzing %d Nodes. This may take a few minutes..." % len(target_ips), flush=True)
+    print("\n\nAnalyzing the %s nodes. This may take a few minutes..." % blockchain_obj.target, flush=True)
 
-    #Delegate the flow runs to appropriate object and overwrite the object
-    if blockchain_obj.target == "flow":
-        blockchain_obj = GetFlowNetworkProviderDistribution(providers_to_track, countries_to_track, providers_short_to_object_map, countries_short_to_object_map, target_ips, analysisDate)
-    else:
-        GetGeneralNetworkProviderDistribution(providers_to_track, countries_to_track, providers_short_to_object_map, countries_short_to_object_map, target_ips, analysisDate, blockchain_obj)
+    #Incremental runs only aggregate the changes since the last snapshot and reuse its lookups
+    delta = DeltaAggregator(blockchain_obj.objectPath) if incremental else None
+    known = delta.Known() if delta else None
 
-    print("Done.", flush=True)
+    #Classify the providers with one lookup per node, tracked providers map to their objects
+    provider_table = config.globals.PROVIDER_REGISTRY.Table(providers_short_to_object_map)
+
+    #Stream the nodes through the enrichment into the aggregation
+    nodes = EnrichNodes(METRICS.Timed("load", reader.Nodes()), blockchain_obj.target, workers, backend_name, enriched, known)
+
+    #Delegate the flow runs to appropriate object and overwrite the object. Loading and enrichment of the streamed
+    #nodes and the percentages are timed as their own stages.
+    with METRICS.Stage("aggregation"):
+        if blockchain_obj.target == "flow":
+            blockchain_obj = GetFlowNetworkProviderDistribution(provider_table, countries_to_track, countries_short_to_object_map, nodes, analysisDate, delta)
+        else:
+            GetGeneralNetworkProviderDistribution(provider_table, countries_to_track, countries_short_to_object_map, nodes, analysisDate, blockchain_obj, delta)
+
+    #Save the snapshot for the next incremental run
+    if delta:
+        delta.Save(blockchain_obj)
+
+    print("Done. Analyzed %d Nodes." % blockchain_obj.totalNodes, flush=True)
     return blockchain_obj
 
-def GetFlowNetworkProviderDistribution(providers_to_track: dict, countries_to_track: dict, providers_short_to_object_map: dict, countries_short_to_object_map: dict, target_ips: dict, analysisDate: str) -> Blockchain:
-    #Overwrite blockchain_obj variable to Flow() class and set IP handler.
+def GetFlowNetworkProviderDistribution(provider_table: dict, countries_to_track: dict, countries_short_to_object_map: dict, nodes, analysisDate: str, delta: DeltaAggregator = None) -> Blockchain:
+    #Overwrite blockchain_obj variable to Flow() class.
     blockchain_obj = Flow("flow", analysisDate)
-    ip_handler = ipinfo.getHandler(config.globals.IPINFO_TOKEN)
+
+    #Incremental runs start from the previous aggregates. Otherwise the columnar engine collects the aggregation inputs
+    #and reduces them to role tensors after the loop.
+    if delta is not None:
+        delta.Start(blockchain_obj)
+    table = FlowNodeTable() if config.globals.AGGREGATION_ENGINE == "columnar" else None
     
-    #Iterate over all IP addresses
-    for ip, node_info in target_ips.items():
-        #Mark invalid IPs
-        if not IsValidIp(ip):
+    #Iterate over all streamed IP addresses
+    for ip, node_info, enrichment in nodes:
+        #One compact record per node, referenced by the analysis objects
+        record = NodeRecord(ip, node_info)
+
+        #Mark invalid IPs, classified in bulk by EnrichNodes
+        if enrichment is None:
             asn, provider_name = None, "Invalid"
             country, country_code, city, region, latitude, longitude, continent = ["Invalid", "Invalid", "Invalid", "Invalid", 0, 0, "Invalid"]
         else:
-            #IP ASN Lookup
-            asn, provider_name = IpAsnLookup(ip, target_ips, blockchain_obj)
-            #IP Geolookup
-            country, country_code, city, region, latitude, longitude, continent = [i for i in IpGeoLookup(ip, target_ips, blockchain_obj, ip_handler)]
-
-        #Identify role parameter, stake, and key name
-        role = node_info["extra_info"]["role"]
-        role_param = blockchain_obj.ReturnNodeTypeQuantities(role)
-        stake = 0 if not node_info["stake"] else int(float(node_info["stake"]))
-        key_name = f"{role.capitalize()} Nodes"
+            #ASN and geo data resolved up front
+            asn, provider_name, geo = enrichment
+            country, country_code, city, region, latitude, longitude, continent = geo
 
-        #Perform Analysis
-        provider_name = FlowProviderAnalysis(providers_to_track, asn, ip, node_info, providers_short_to_object_map, country, country_code, city, region, latitude, longitude, provider_name, analysisDate, blockchain_obj, role)
-        FlowCountryAnalysis(countries_to_track, continent, country, country_code, city, ip, node_info, countries_short_to_object_map, analysisDate, blockchain_obj, role)
-
-        #Check if it meets requirements and add to general and provider stake
-        if node_info["extra_info"]["is_active"]:
-            role_param["active"] += 1
-
-            #Total stake
-            blockchain_obj.totalStake[role]["active"] += stake
-            blockchain_obj.providersData[provider_name]["Total Stake"][role]["active"] += stake
-            blockchain_obj.continentData[continent]['Total Stake'][role]["active"] += stake
-            blockchain_obj.continentData[continent]["Countries"][country]['Total Stake'][role]["active"] += stake
+            #Capture the IPs that couldn't be resolved
+            if provider_name == "Unidentified": blockchain_obj.unidentifiedASNs[record.packedIp] = record
+            if continent == "Unidentified": blockchain_obj.unidentifiedLocations[record.packedIp] = record
 
-            #Provider and country data
-            blockchain_obj.providersData[provider_name][key_name]["active"] += 1
-            blockchain_obj.continentData[continent][key_name]["active"] += 1
-            blockchain_obj.continentData[continent]["Countries"][country][key_name]["active"] += 1
+        #Identify role
+        role = record.extraInfo["role"]
 
-
-        #Else sum inactive nodes to provider dict and blockchain object
+        #Perform Analysis
+        provider_name = FlowProviderAnalysis(provider_table, asn, record, country, country_code, city, region, latitude, longitude, provider_name, analysisDate, blockchain_obj, role)
+        FlowCountryAnalysis(countries_to_track, continent, country, country_code, city, record, countries_short_to_object_map, analysisDate, blockchain_obj, role)
+
+        #Add the node to the network, provider, continent and country totals
+        state = NodeState(record, flow=True)
+        AddFlowShares(blockchain_obj, asn, DatacenterKey(asn, country_code, city), state)
+        if delta is not None:
+            delta.Apply(ip, enrichment, provider_name, continent, country, state)
+        elif table is not None:
+            table.Append(record, asn, provider_name, continent, country)
         else:
-            blockchain_obj.providersData[provider_name]['Total Inactive Nodes'] += 1
-            blockchain_obj.continentData[continent]['Total Inactive Nodes'] += 1
-            blockchain_obj.continentData[continent]["Countries"][country]['Total Inactive Nodes'] += 1
-            blockchain_obj.totalInactiveNodes += 1
-
-        #Add to general and provider/country totals
-        role_param["total"] += 1
-        blockchain_obj.totalStake[role]["total"] += stake
-        blockchain_obj.continentData[continent]['Total Nodes'] += 1
-        blockchain_obj.continentData[continent]["Countries"][country]['Total Nodes'] += 1
-        blockchain_obj.totalNodes += 1
-
-        #Provider data
-        blockchain_obj.providersData[provider_name][key_name]["total"] += 1
-        blockchain_obj.providersData[provider_name]["Total Stake"][role]["total"] += stake
-        blockchain_obj.providersData[provider_name]["Total Nodes"] += 1
-
-        #Country data
-        blockchain_obj.continentData[continent]['Total Nodes'] += 1
-        blockchain_obj.continentData[continent]["Countries"][country]['Total Nodes'] += 1
-        blockchain_obj.continentData[continent]["Total Stake"][role]["total"] += stake
-        blockchain_obj.continentData[continent]["Countries"][country]["Total Stake"][role]["total"] += stake
-        blockchain_obj.continentData[continent][key_name]["total"] += 1
-        blockchain_obj.continentData[continent]["Countries"][country][key_name]["total"] += 1
-
-    #Calculate the percentages after a full analysis
-    blockchain_obj.CalculatePercentages()
+            AddFlowNode(blockchain_obj, provider_name, continent, country, state)
+
+    #Calculate the totals and percentages after a full analysis
+    if delta is not None:
+        delta.Finish(blockchain_obj)
+        blockchain_obj.CalculatePercentages()
+    elif table is not None:
+        AggregateFlowDistribution(table, blockchain_obj)
+    else:
+        blockchain_obj.CalculatePercentages()
     return blockchain_obj
 
-def GetGeneralNetworkProviderDistribution(providers_to_track: dict, countries_to_track: dict, providers_short_to_object_map: dict, countries_short_to_object_map: dict, target_ips: dict, analysisDate: str, blockchain_obj: Blockchain):
-    #Set Ipinfo handler
-    ip_handler = ipinfo.getHandler(config.globals.IPINFO_TOKEN)
-    
-    #Iterate over all IP addresses
-    for ip, node_info in target_ips.items():
-        #Set invalid if IP is private, loopback, or invalid
-        if not IsValidIp(ip):
+def GetGeneralNetworkProviderDistribution(provider_table: dict, countries_to_track: dict, countries_short_to_object_map: dict, nodes, analysisDate: str, blockchain_obj: Blockchain, delta: DeltaAggregator = None):
+    #Incremental runs start from the previous aggregates. Otherwise the columnar engine collects the aggregation inputs
+    #and reduces them after the loop.
+    if delta is not None:
+        delta.Start(blockchain_obj)
+    table = NodeTable() if config.globals.AGGREGATION_ENGINE == "columnar" else None
+
+    #Iterate over all streamed IP addresses
+    for ip, node_info, enrichment in nodes:
+        #One compact record per node, referenced by the analysis objects
+        record = NodeRecord(ip, node_info)
+
+        #Set invalid if IP is private, loopback, reserved or not an IP address, classified in bulk by EnrichNodes
+        if enrichment is None:
             asn, provider_name = None, "Invalid"
             country, country_code, city, region, latitude, longitude, continent = ["Invalid", "Invalid", "Invalid", "Invalid", 0, 0, "Invalid"]
         else:
-            #IP ASN Lookup
-            asn, provider_name = IpAsnLookup(ip, target_ips, blockchain_obj)
-            #IP Geolookup
-            country, country_code, city, region, latitude, longitude, continent = [i for i in IpGeoLookup(ip, target_ips, blockchain_obj, ip_handler)]
+            #ASN and geo data resolved up front
+            asn, provider_name, geo = enrichment
+            country, country_code, city, region, latitude, longitude, continent = geo
+
+            #Capture the IPs that couldn't be resolved
+            if provider_name == "Unidentified": blockchain_obj.unidentifiedASNs[record.packedIp] = record
+            if continent == "Unidentified": blockchain_obj.unidentifiedLocations[record.packedIp] = record
 
         #Perform Analysis
-        provider_name = ProviderAnalysis(providers_to_track, asn, ip, node_info, providers_short_to_object_map, country, country_code, city, region, latitude, longitude, provider_name, analysisDate, blockchain_obj)
-        CountryAnalysis(countries_to_track, continent, country, country_code, city, ip, node_info, countries_short_to_object_map, analysisDate, blockchain_obj)
-
-        #If it is validator (even if unidentified), sum validator and stake to provider dict and blockchain object.
-        if node_info["is_validator"]:
-            stake = 0 if not node_info["stake"] else int(node_info["stake"])
-            blockchain_obj.providersData[provider_name]['Total Validators'] += 1
-            blockchain_obj.providersData[provider_name]['Total Stake'] += stake
-            blockchain_obj.continentData[continent]['Total Validators'] += 1
-            blockchain_obj.continentData[continent]['Total Stake'] += stake
-            blockchain_obj.continentData[continent]["Countries"][country]['Total Validators'] += 1
-            blockchain_obj.continentData[continent]["Countries"][country]['Total Stake'] += stake
-
-            blockchain_obj.totalStake += stake
-            blockchain_obj.totalValidators += 1
-        
-        #Else just sum RPC to provider dict and blockchain object
+        provider_name = ProviderAnalysis(provider_table, asn, record, country, country_code, city, region, latitude, longitude, provider_name, analysisDate, blockchain_obj)
+        CountryAnalysis(countries_to_track, continent, country, country_code, city, record, countries_short_to_object_map, analysisDate, blockchain_obj)
+
+        #Add the node to the network, provider, continent and country totals
+        state = NodeState(record)
+        AddShares(blockchain_obj, asn, DatacenterKey(asn, country_code, city), state)
+        if delta is not None:
+            delta.Apply(ip, enrichment, provider_name, continent, country, state)
+        elif table is not None:
+            table.Append(record, asn, provider_name, continent, country)
         else:
-            blockchain_obj.providersData[provider_name]['Total Non-Validator Nodes'] += 1
-            blockchain_obj.continentData[continent]['Total Non-Validator Nodes'] += 1
-            blockchain_obj.continentData[continent]["Countries"][country]['Total Non-Validator Nodes'] += 1
-            blockchain_obj.totalNonValidatorNodes += 1
-
-        #Add another node to the network and to the provider
-        blockchain_obj.totalNodes += 1
-        blockchain_obj.providersData[provider_name]['Total Nodes'] += 1
-        blockchain_obj.continentData[continent]['Total Nodes'] += 1
-        blockchain_obj.continentData[continent]["Countries"][country]['Total Nodes'] += 1
-
-    #Calculate the percentages after a full analysis
-    blockchain_obj.CalculatePercentages()
+            AddNode(blockchain_obj, provider_name, continent, country, state)
+
+    #Calculate the totals and percentages after a full analysis
+    if delta is not None:
+        delta.Finish(blockchain_obj)
+        blockchain_obj.CalculatePercentages()
+    elif table is not None:
+        AggregateDistribution(table, blockchain_obj)
+    else:
+        blockchain_obj.CalculatePercentages()
@@ -0,0 +1,209 @@
+import os, threading, time, zlib
+from bisect import bisect_right
+from itertools import accumulate
+
+from ipwhois.net import Net
+from ipwhois.asn import IPASN
+import ipinfo #type: ignore
+from ipinfo import handler_utils #type: ignore
+import maxminddb #type: ignore
+import requests
+from requests.adapters import HTTPAdapter
+
+import config.globals
+from analysis.prefixes import AsnIntervalIndex
+
+## Rate limiting ##
+class RateLimiter:
+    """Token bucket shared by every worker hitting the same lookup provider."""
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate #*tokens per second
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def Acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+## Lookup backends ##
+#NOTE: Every backend exposes LookupAsn(ip) -> asn and LookupGeo(ip) -> dict with ipinfo's keys
+#NOTE: ("country", "city", "region", "latitude", "longitude", "continent": {"name"}) and raises on failure.
+class RemoteBackend:
+    """Looks up ASNs through ipwhois and locations through the ipinfo API."""
+    name = "remote"
+    isRemote = True
+
+    def __init__(self, token: str, pool_size: int = 10):
+        #Each lookup provider is rate limited on its own, only requests that go over the network wait
+        self.asnLimiter = RateLimiter(config.globals.RATE_LIMITS["asn"], pool_size)
+        self.geoLimiter = RateLimiter(config.globals.RATE_LIMITS["geo"], pool_size)
+
+        #The ipinfo handler is only kept for its country and continent tables, requests go through the pooled session
+        self.ipHandler = ipinfo.getHandler(token)
+        self.prefetched = {} #*ip -> formatted ipinfo details from batch requests
+        self.asnIndex = AsnIntervalIndex() #*announced prefixes seen in whois answers -> ASN
+
+        #Pooled session reused by every geo request
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.session.headers.update(handler_utils.get_headers(token))
+
+    def LookupAsn(self, ip: str) -> str:
+        #Answer from an already resolved prefix if one contains the IP
+        asn = self.asnIndex.Lookup(ip)
+        if asn is not None:
+            return asn
+
+        self.asnLimiter.Acquire()
+        results = IPASN(Net(ip)).lookup()
+
+        #Index the announced prefix so every other IP in it reuses this answer
+        try:
+            if results['asn'] is not None:
+                self.asnIndex.Insert(results['asn_cidr'], results['asn'])
+        except (KeyError, TypeError, ValueError):
+            pass
+        return results['asn']
+
+    def LookupGeo(self, ip: str) -> dict:
+        #Use the batch result if the IP was prefetched, else fall back to a single request
+        if ip in self.prefetched:
+            return self.prefetched.pop(ip)
+
+        self.geoLimiter.Acquire()
+        response = self.session.get(f"{config.globals.IPINFO_API_URL}/{ip}", timeout=config.globals.GEO_BATCH_TIMEOUT)
+        response.raise_for_status()
+        return self.FormatDetails(response.json())
+
+    def LookupGeoBatch(self, ips: list) -> dict:
+        """Resolves a chunk of IPs with one request to the ipinfo batch endpoint and stores the results for LookupGeo."""
+        self.geoLimiter.Acquire()
+        response = self.session.post(f"{config.globals.IPINFO_API_URL}/batch", json=ips, timeout=config.globals.GEO_BATCH_TIMEOUT)
+        response.raise_for_status()
+
+        #Skip error entries, those IPs fall back to single lookups
+        results = {ip: self.FormatDetails(details) for ip, details in response.json().items() if isinstance(details, dict)}
+        self.prefetched.update(results)
+        return results
+
+    def FormatDetails(self, details: dict) -> dict:
+        """Adds the country, continent and coordinate fields the same way the ipinfo handler does."""
+        handler_utils.format_details(details, self.ipHandler.countries, self.ipHandler.eu_countries, self.ipHandler.countries_flags, self.ipHandler.countries_currencies, self.ipHandler.continents)
+        return details
+
+class LocalBackend:
+    """Looks up ASNs and locations in local MaxMind-format (MMDB) databases, memory-mapped so no network is needed."""
+    name = "local"
+    isRemote = False
+
+    def __init__(self, asn_db_path: str, city_db_path: str):
+        for path in [asn_db_path, city_db_path]:
+            if not os.path.isfile(path):
+                print("ERROR: Missing local lookup database %s." % path)
+                print("\tPlace the ASN and City MMDB files at the paths set in config/globals.py or use --backend=remote.")
+                exit(1)
+
+        self.asnReader = maxminddb.open_database(asn_db_path, maxminddb.MODE_MMAP)
+        self.cityReader = maxminddb.open_database(city_db_path, maxminddb.MODE_MMAP)
+
+    def LookupAsn(self, ip: str) -> str:
+        record = self.asnReader.get(ip)
+        if not record or "autonomous_system_number" not in record:
+            raise LookupError("IP not found in the local ASN database")
+
+        #Match the string ASNs returned by ipwhois and used as keys in ProviderConfig.json
+        return str(record["autonomous_system_number"])
+
+    def LookupGeo(self, ip: str) -> dict:
+        record = self.cityReader.get(ip)
+        if not record or "country" not in record:
+            raise LookupError("IP not found in the local City database")
+
+        #Anycast and country-only records have no city or location, default them like a failed remote lookup
+        subdivisions = record.get("subdivisions") or [{}]
+        location = record.get("location") or {}
+        return {
+            "country": record["country"]["iso_code"],
+            "city": (record.get("city") or {}).get("names", {}).get("en") or "Unidentified",
+            "region": subdivisions[0].get("names", {}).get("en") or "Unidentified",
+            "latitude": location.get("latitude") if location.get("latitude") is not None else 0,
+            "longitude": location.get("longitude") if location.get("longitude") is not None else 0,
+            "continent": {"name": record["continent"]["names"]["en"]}
+        }
+
+#Datacenter locations of the synthetic backend, with their relative weight
+SYNTHETIC_LOCATIONS = [
+    (30, "US", "Ashburn", "Virginia", 39.0437, -77.4875, "North America"),
+    (14, "DE", "Falkenstein", "Saxony", 50.4779, 12.3713, "Europe"),
+    (12, "DE", "Frankfurt am Main", "Hesse", 50.1155, 8.6842, "Europe"),
+    (9, "FR", "Roubaix", "Hauts-de-France", 50.6942, 3.1746, "Europe"),
+    (8, "US", "Portland", "Oregon", 45.5234, -122.6762, "North America"),
+    (6, "NL", "Amsterdam", "North Holland", 52.3740, 4.8897, "Europe"),
+    (5, "GB", "London", "England", 51.5085, -0.1257, "Europe"),
+    (4, "JP", "Tokyo", "Tokyo", 35.6895, 139.6917, "Asia"),
+    (4, "SG", "Singapore", "Singapore", 1.2897, 103.8501, "Asia"),
+    (3, "FI", "Helsinki", "Uusimaa", 60.1695, 24.9354, "Europe"),
+    (2, "CA", "Montreal", "Quebec", 45.5088, -73.5878, "North America"),
+    (1, "BR", "Sao Paulo", "Sao Paulo", -23.5475, -46.6361, "South America"),
+    (1, "AU", "Sydney", "New South Wales", -33.8678, 151.2073, "Oceania"),
+    (1, "ZA", "Johannesburg", "Gauteng", -26.2023, 28.0436, "Africa")
+]
+
+class SyntheticBackend:
+    """Deterministic in-process stand-in for the lookup providers, used by the benchmarks. The ASN and location of an IP
+    are derived from a hash of its /24 (IPv4) or /48 (IPv6) block, skewed towards the first providers of ProviderConfig.json
+    and the heaviest SYNTHETIC_LOCATIONS. Every lookup sleeps for latency seconds and a small share of them fail."""
+    name = "synthetic"
+    isRemote = False
+
+    def __init__(self, latency: float = 0.0, failure_rate: float = 0.01):
+        self.latency = latency
+        self.failureRate = failure_rate
+
+        #Zipf-like weights over the configured providers, plus untracked ASNs that make up the "Other" provider
+        asns = [asn for asn in config.globals.PROVIDER_ASN_LOOKUP if " " not in asn]
+        self.asns = asns + [str(64512 + i) for i in range(100)]
+        self.asnWeights = list(accumulate([1 / (rank + 1) ** 1.2 for rank in range(len(asns))] + [0.005] * 100))
+        self.locationWeights = list(accumulate(location[0] for location in SYNTHETIC_LOCATIONS))
+
+    @staticmethod
+    def Block(ip: str) -> bytes:
+        return (":".join(ip.split(":")[:3]) if ":" in ip else ip.rsplit(".", 1)[0]).encode()
+
+    def Pick(self, key: bytes, cumulative: list) -> int:
+        return bisect_right(cumulative, zlib.crc32(key) / 2**32 * cumulative[-1])
+
+    def LookupAsn(self, ip: str) -> str:
+        if self.latency:
+            time.sleep(self.latency)
+        block = self.Block(ip)
+        if zlib.crc32(b"failure" + block) / 2**32 < self.failureRate:
+            raise LookupError("Synthetic ASN lookup failure")
+        return self.asns[self.Pick(block, self.asnWeights)]
+
+    def LookupGeo(self, ip: str) -> dict:
+        if self.latency:
+            time.sleep(self.latency)
+        if zlib.crc32(b"failure" + ip.encode()) / 2**32 < self.failureRate:
+            raise LookupError("Synthetic geo lookup failure")
+        _, country, city, region, latitude, longitude, continent = SYNTHETIC_LOCATIONS[self.Pick(b"geo" + self.Block(ip), self.locationWeights)]
+        return {"country": country, "city": city, "region": region, "latitude": latitude, "longitude": longitude, "continent": {"name": continent}}
+
+def MakeLookupBackend(name: str, workers: int = 1):
+    """Builds the lookup backend selected with --backend"""
+    if name == "local":
+        return LocalBackend(config.globals.LOCAL_ASN_DB, config.globals.LOCAL_CITY_DB)
+    if name == "synthetic":
+        return SyntheticBackend(config.globals.SYNTHETIC_LATENCY)
+    return RemoteBackend(config.globals.IPINFO_TOKEN, workers)
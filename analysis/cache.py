@@ -0,0 +1,73 @@
+import json, os, sqlite3, threading, time
+
+## Persistent IP enrichment cache ##
+class IpCache:
+    """SQLite-backed cache of enrichment results keyed by (ip, field), with a TTL per field and LRU eviction."""
+    def __init__(self, path: str, ttl: dict, max_entries: int):
+        self.path = path
+        self.ttl = ttl #*field -> seconds a cached value stays fresh
+        self.maxEntries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.pendingWrites = 0
+        self.accessed = {} #*(ip, field) -> last access time, flushed on Commit()
+
+        #SQLite connections are shared across the enrichment workers, guard them with a lock
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS ip_cache (ip TEXT NOT NULL, field TEXT NOT NULL, value TEXT NOT NULL, updated REAL NOT NULL, accessed REAL NOT NULL, PRIMARY KEY (ip, field))")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS ip_cache_accessed ON ip_cache (accessed)")
+        self.conn.commit()
+
+    def Get(self, ip: str, field: str):
+        """Returns the cached value for the ip and field, or None if missing or expired."""
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT value, updated FROM ip_cache WHERE ip = ? AND field = ?", (ip, field)).fetchone()
+
+            #Treat expired entries as misses, they get overwritten on the next Set()
+            if row is None or now - row[1] > self.ttl.get(field, 0):
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.accessed[(ip, field)] = now
+        return json.loads(row[0])
+
+    def Has(self, ip: str, field: str) -> bool:
+        """Returns True if there is a fresh value for the ip and field, without counting a hit or a miss."""
+        with self.lock:
+            row = self.conn.execute("SELECT updated FROM ip_cache WHERE ip = ? AND field = ?", (ip, field)).fetchone()
+        return row is not None and time.time() - row[0] <= self.ttl.get(field, 0)
+
+    def Set(self, ip: str, field: str, value):
+        now = time.time()
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO ip_cache (ip, field, value, updated, accessed) VALUES (?, ?, ?, ?, ?)", (ip, field, json.dumps(value), now, now))
+            self.pendingWrites += 1
+
+            #Commit in batches to avoid a disk sync per lookup
+            if self.pendingWrites >= 500:
+                self.conn.commit()
+                self.pendingWrites = 0
+
+    def Commit(self):
+        """Flushes access times, evicts the least recently used entries above the size cap, and commits."""
+        with self.lock:
+            self.conn.executemany("UPDATE ip_cache SET accessed = ? WHERE ip = ? AND field = ?", [(t, ip, field) for (ip, field), t in self.accessed.items()])
+            self.accessed = {}
+
+            #LRU eviction
+            count = self.conn.execute("SELECT COUNT(*) FROM ip_cache").fetchone()[0]
+            if count > self.maxEntries:
+                self.conn.execute("DELETE FROM ip_cache WHERE rowid IN (SELECT rowid FROM ip_cache ORDER BY accessed ASC LIMIT ?)", (count - self.maxEntries,))
+
+            self.conn.commit()
+            self.pendingWrites = 0
+
+    def Close(self):
+        self.Commit()
+        self.conn.close()
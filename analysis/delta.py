@@ -0,0 +1,116 @@
+import os, pickle, time
+
+import config.globals
+from analysis.utils import AddNode, AddFlowNode
+from classes.Blockchain import Blockchain, Flow
+from classes.dict_initial_values import providers_init, location_init, providers_init_flow, location_init_flow
+
+#Blockchain attributes that belong to a single run and are not carried over between snapshots. The ASN and datacenter
+#shares are rebuilt from every streamed node.
+RUN_ATTRIBUTES = {"target", "objectPath", "unidentifiedASNs", "unidentifiedLocations", "info", "objectCreationDate", "analysisDate", "asnShares", "datacenterShares"}
+SNAPSHOT_VERSION = 2
+
+## Incremental analysis ##
+class DeltaAggregator:
+    """Applies the difference between two snapshots of a blockchain's nodes to the previous run's aggregates.
+    The per-IP records and the aggregates of the last run are pickled at Blockchain.objectPath. Nodes whose record is
+    unchanged are skipped, changed and removed nodes are subtracted, and added and changed nodes are added, so the
+    aggregation work is proportional to the churn. The first run, or one without a usable snapshot, adds every node.
+    The enrichment of a record is reused until it is older than the shortest CACHE_TTL, like a cached lookup."""
+    def __init__(self, path: str):
+        self.path = path
+        self.previous = {} #*ip -> (enrichment, (provider_name, continent, country, state), resolved timestamp) of the last run
+        self.resolved = {} #*ip -> resolved timestamp of the enrichments reused from the last run
+        self.records = {} #*same for this run, saved by Save()
+        self.aggregates = None #*non run-specific attributes of the last run's blockchain object
+        self.counts = {"added": 0, "removed": 0, "changed": 0, "unchanged": 0}
+
+        if os.path.isfile(path):
+            try:
+                with open(path, "rb") as f:
+                    snapshot = pickle.load(f)
+                    f.close()
+                if snapshot.get("version") == SNAPSHOT_VERSION:
+                    self.previous, self.aggregates = snapshot["records"], snapshot["aggregates"]
+            except (OSError, pickle.UnpicklingError, EOFError, AttributeError) as e:
+                print("\t[WARN] Ignoring unreadable snapshot %s: %s" % (path, e), flush=True)
+
+    def Known(self) -> dict:
+        """Returns the enrichment of the previously seen IPs that were fully resolved and are still fresh, so they aren't
+        looked up again. Expired ones go through the lookup and the IP cache again."""
+        oldest = time.time() - min(config.globals.CACHE_TTL.values())
+        known = {}
+        for ip, (enrichment, _, resolved) in self.previous.items():
+            if enrichment is not None and enrichment[1] != "Unidentified" and enrichment[2][-1] != "Unidentified" and resolved >= oldest:
+                known[ip] = enrichment
+                self.resolved[ip] = resolved
+        return known
+
+    def Start(self, blockchain_obj: Blockchain):
+        """Loads the previous aggregates into blockchain_obj, without their percentages"""
+        self.blockchain_obj = blockchain_obj
+        if self.aggregates is None:
+            return
+        print("\tApplying changes since the last snapshot of %d nodes." % len(self.previous), flush=True)
+        for attribute, value in self.aggregates.items():
+            setattr(blockchain_obj, attribute, value)
+
+        for entry in blockchain_obj.Entities():
+            for key in [key for key in entry if key.startswith("Percentage of")]:
+                del entry[key]
+
+    def Apply(self, ip: str, enrichment: tuple, provider_name: str, continent: str, country: str, state: tuple):
+        record = (provider_name, continent, country, state)
+        self.records[ip] = (enrichment, record, self.resolved.get(ip, time.time()))
+
+        #Subtract the old contribution if it changed, then add the new one
+        previous = self.previous.pop(ip, None)
+        if previous is not None and previous[1] == record:
+            self.counts["unchanged"] += 1
+            return
+        elif previous is not None:
+            self.counts["changed"] += 1
+            self.AddRecord(previous[1], -1)
+        else:
+            self.counts["added"] += 1
+        self.AddRecord(record, 1)
+
+    def Finish(self, blockchain_obj: Blockchain):
+        """Subtracts the nodes that are gone since the last snapshot and drops the entries left without nodes"""
+        for _, record, _ in self.previous.values():
+            self.counts["removed"] += 1
+            self.AddRecord(record, -1)
+        self.previous = {}
+
+        #Keep the entries of the initial dicts, like a full run does
+        providers_initial, locations_initial = (providers_init_flow, location_init_flow) if isinstance(blockchain_obj, Flow) else (providers_init, location_init)
+        for provider in [p for p, entry in blockchain_obj.providersData.items() if not entry["Total Nodes"] and p not in providers_initial]:
+            del blockchain_obj.providersData[provider]
+        for continent, entry in list(blockchain_obj.continentData.items()):
+            initial_countries = locations_initial.get(continent, {}).get("Countries", {})
+            for country in [c for c, country_entry in entry["Countries"].items() if not country_entry["Total Nodes"] and c not in initial_countries]:
+                del entry["Countries"][country]
+            if not entry["Total Nodes"] and continent not in locations_initial:
+                del blockchain_obj.continentData[continent]
+
+        print("\tDelta: %d added, %d removed, %d changed and %d unchanged nodes." % (self.counts["added"], self.counts["removed"], self.counts["changed"], self.counts["unchanged"]), flush=True)
+
+    def AddRecord(self, record: tuple, sign: int):
+        provider_name, continent, country, state = record
+        if isinstance(self.blockchain_obj, Flow):
+            AddFlowNode(self.blockchain_obj, provider_name, continent, country, state, sign)
+        else:
+            AddNode(self.blockchain_obj, provider_name, continent, country, state, sign)
+
+    def Save(self, blockchain_obj: Blockchain):
+        """Pickles this run's records and aggregates for the next incremental run"""
+        snapshot = {
+            "version": SNAPSHOT_VERSION,
+            "records": self.records,
+            "aggregates": {attribute: value for attribute, value in vars(blockchain_obj).items() if attribute not in RUN_ATTRIBUTES}
+        }
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + ".tmp", "wb") as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.close()
+        os.replace(self.path + ".tmp", self.path)
@@ -0,0 +1,91 @@
+import ipaddress
+from concurrent.futures import ThreadPoolExecutor
+
+import config.globals
+from analysis.cache import IpCache
+from analysis.instrumentation import METRICS, Log
+from analysis.ipranges import ArePublicIps
+from analysis.utils import IpAsnLookup, IpGeoLookup
+
+## Enrichment ##
+def EnrichIps(target_ips, target: str, backend, ip_cache: IpCache = None, workers: int = 1, validated: bool = False) -> dict:
+    """Resolves ASN and geo data for every valid IP in target_ips using a bounded thread pool.
+    target only labels the log lines, so the IPs of several blockchains can be resolved in one pass.
+    validated skips the classification when the caller already filtered out the invalid IPs.
+    Returns {ip: (asn, provider_name, [country, country_code, city, region, latitude, longitude, continent])}"""
+    def Enrich(ip):
+        asn, provider_name = IpAsnLookup(ip, target, backend, ip_cache)
+        geo = IpGeoLookup(ip, target, backend, ip_cache)
+        return ip, (asn, provider_name, geo)
+
+    with METRICS.Stage("enrichment"):
+        valid_ips = list(dict.fromkeys(target_ips))
+        if not validated:
+            valid_ips = [ip for ip, is_valid in zip(valid_ips, ArePublicIps(valid_ips)) if is_valid]
+        Log("info", "\tEnriching %d valid IPs with %d workers." % (len(valid_ips), workers))
+        METRICS.Count("enriched_ips", len(valid_ips))
+
+        #Bulk resolve the remote lookups so the per-IP loop mostly reads them from memory
+        if backend.isRemote:
+            PrefetchAsn(valid_ips, backend, ip_cache, workers)
+            PrefetchGeo(valid_ips, backend, ip_cache, workers)
+
+        #Results are keyed by IP so the aggregation order stays the same as the serial path
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return dict(executor.map(Enrich, valid_ips))
+
+def PrefetchGeo(ips: list, backend, ip_cache: IpCache = None, workers: int = 1):
+    """Resolves the locations of all uncached IPs through the batch endpoint in chunks of GEO_BATCH_SIZE."""
+    pending = list(dict.fromkeys(ip for ip in ips if not ip_cache or not ip_cache.Has(ip, "geo")))
+    size = config.globals.GEO_BATCH_SIZE
+    chunks = [pending[i:i + size] for i in range(0, len(pending), size)]
+
+    def Fetch(chunk):
+        #Failed chunks fall back to single lookups in IpGeoLookup
+        try:
+            with METRICS.Latency(f"{backend.name}.geo_batch"):
+                return len(backend.LookupGeoBatch(chunk))
+        except Exception as e:
+            Log("warn", "\t[WARN] Error performing batch geo lookup for %d IPs: %s" % (len(chunk), e))
+            METRICS.Count("geo_batch_failures")
+            return 0
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        resolved = sum(executor.map(Fetch, chunks))
+    Log("info", "\tBatch resolved %d of %d uncached locations in %d requests." % (resolved, len(pending), len(chunks)))
+
+def PrefetchAsn(ips: list, backend, ip_cache: IpCache = None, workers: int = 1):
+    """Resolves the ASNs of all uncached IPs coarse to fine. One IP per /16 (IPv4) or /32 (IPv6) block is resolved
+    first, then one IP per /24 or /48 block not yet covered, so the rest are answered from the backend's prefix index."""
+    addresses = {}
+    for ip in ips:
+        if ip_cache and ip_cache.Has(ip, "asn"):
+            continue
+        #Hostnames are left to the per-IP lookup
+        try:
+            addresses[ip] = ipaddress.ip_address(ip)
+        except ValueError:
+            continue
+    pending = sorted(addresses, key=lambda ip: (addresses[ip].version, int(addresses[ip])))
+
+    failed = set()
+    def Resolve(ip):
+        #Failed IPs are retried once and recorded by IpAsnLookup
+        try:
+            with METRICS.Latency(f"{backend.name}.asn"):
+                backend.LookupAsn(ip)
+        except Exception:
+            failed.add(ip)
+
+    for v4_prefix, v6_prefix in [(16, 32), (24, 48)]:
+        #Pick the first IP of every block that the prefix index doesn't cover yet
+        blocks = {}
+        for ip in pending:
+            block = ipaddress.ip_network(f"{ip}/{v4_prefix if addresses[ip].version == 4 else v6_prefix}", strict=False)
+            if block not in blocks and ip not in failed and backend.asnIndex.Lookup(ip) is None:
+                blocks[block] = ip
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(Resolve, blocks.values()))
+
+    Log("info", "\tResolved %d uncached IPs into %d announced prefixes." % (len(pending), len(backend.asnIndex)))
@@ -0,0 +1,60 @@
+import json, os, sqlite3
+from datetime import date
+
+import config.globals
+
+## Historical distribution store ##
+class HistoryStore:
+    """SQLite time series of the distributions written by every run, one row per (chain, date, dimension, key).
+    Runs append the entries of their date, a second run on the same date replaces them. Series() reads the history
+    of one provider or country from the (chain, dimension, key, date) index without touching the output JSON files."""
+    def __init__(self, path: str = None):
+        self.path = path or config.globals.HISTORY_PATH
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS history (chain TEXT NOT NULL, date TEXT NOT NULL, dimension TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (chain, date, dimension, key))")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS history_series ON history (chain, dimension, key, date)")
+        self.conn.commit()
+
+    def Append(self, chain: str, dimension: str, entries: dict, day: str = None):
+        """Stores {key: JSON serializable entry} of a dimension for the ISO date day, today by default"""
+        day = day or date.today().isoformat()
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO history (chain, date, dimension, key, value) VALUES (?, ?, ?, ?, ?)", [(chain, day, dimension, str(key), json.dumps(entry, default=str)) for key, entry in entries.items()])
+
+    def Series(self, chain: str, dimension: str, key: str, months: int = 12, field: str = None) -> list:
+        """Returns [(ISO date, entry)] of the key over the last months, oldest first. field selects a single value of the entries."""
+        rows = self.conn.execute("SELECT date, value FROM history WHERE chain = ? AND dimension = ? AND key = ? AND date >= ? ORDER BY date", (chain, dimension, key, MonthsAgo(months))).fetchall()
+        series = [(day, json.loads(value)) for day, value in rows]
+        if field is not None:
+            series = [(day, entry.get(field)) for day, entry in series]
+        return series
+
+    def Keys(self, chain: str, dimension: str) -> list:
+        """Returns the keys with history in a dimension of the chain"""
+        return [row[0] for row in self.conn.execute("SELECT DISTINCT key FROM history WHERE chain = ? AND dimension = ? ORDER BY key", (chain, dimension))]
+
+    def Close(self):
+        self.conn.close()
+
+def MonthsAgo(months: int, today: date = None) -> str:
+    """ISO date of the same day months calendar months before today, clamped to the end of shorter months"""
+    today = today or date.today()
+    year, month = divmod(today.year * 12 + today.month - 1 - months, 12)
+    month += 1
+    for day in range(today.day, 27, -1):
+        try:
+            return date(year, month, day).isoformat()
+        except ValueError:
+            continue
+    return date(year, month, min(today.day, 28)).isoformat()
+
+def RecordHistory(chain: str, dimensions: dict):
+    """Appends today's {dimension: {key: entry}} of a chain to the history store"""
+    store = HistoryStore()
+    try:
+        for dimension, entries in dimensions.items():
+            store.Append(chain, dimension, entries)
+    finally:
+        store.Close()
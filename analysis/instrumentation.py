@@ -0,0 +1,186 @@
+import functools, json, os, resource, threading, time
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime
+
+import config.globals
+
+LOG_LEVELS = {"debug": 10, "info": 20, "warn": 30, "error": 40}
+STAGES = ["load", "enrichment", "aggregation", "percentages", "output"]
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10] #*seconds, upper bounds of the histogram buckets
+
+## Logging ##
+def Log(level: str, message: str):
+    """Prints message if level is at or above config.globals.LOG_LEVEL, set with --log-level"""
+    if LOG_LEVELS[level] >= LOG_LEVELS[config.globals.LOG_LEVEL]:
+        print(message, flush=True)
+
+def PeakRss() -> float:
+    """Peak resident set size of the process in MB"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+## Run metrics ##
+class Instrumentation:
+    """Stage timers, counters and latency histograms of a run. Stage times are exclusive: the time of a stage nested in
+    another, like the enrichment of a chunk inside the aggregation loop, is only counted for the inner stage.
+    Stages are timed on the main thread, counters and histograms can be updated from the enrichment workers."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.Reset()
+
+    def Reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.startedClock = time.perf_counter()
+            self.stages = {stage: {"seconds": 0.0, "calls": 0, "peak_rss_mb": 0.0} for stage in STAGES}
+            self.stack = [] #*[stage, start] of the open stages, innermost last
+            self.counters = {}
+            self.histograms = {} #*name -> {"buckets": [count per bucket + overflow], "count", "sum"}
+            self.extra = {}
+
+    def Enter(self, stage: str):
+        now = time.perf_counter()
+        if self.stack:
+            self.stages[self.stack[-1][0]]["seconds"] += now - self.stack[-1][1]
+        self.stack.append([stage, now])
+
+    def Exit(self, rss: bool = True):
+        now = time.perf_counter()
+        stage, start = self.stack.pop()
+        entry = self.stages.setdefault(stage, {"seconds": 0.0, "calls": 0, "peak_rss_mb": 0.0})
+        entry["seconds"] += now - start
+        entry["calls"] += 1
+        if rss:
+            entry["peak_rss_mb"] = max(entry["peak_rss_mb"], PeakRss())
+        if self.stack:
+            self.stack[-1][1] = now
+
+    @contextmanager
+    def Stage(self, stage: str):
+        self.Enter(stage)
+        try:
+            yield
+        finally:
+            self.Exit()
+
+    def Staged(self, stage: str):
+        """Decorator that times every call of a function as stage"""
+        def Decorator(function):
+            @functools.wraps(function)
+            def Wrapper(*args, **kwargs):
+                with self.Stage(stage):
+                    return function(*args, **kwargs)
+            return Wrapper
+        return Decorator
+
+    def Timed(self, stage: str, items):
+        """Yields the items of an iterator, timing each step as stage"""
+        items = iter(items)
+        while True:
+            self.Enter(stage)
+            try:
+                item = next(items)
+            except StopIteration:
+                self.Exit()
+                return
+            except BaseException:
+                self.Exit()
+                raise
+            self.Exit(rss=False)
+            yield item
+
+    def Count(self, name: str, value: int = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def Observe(self, name: str, seconds: float):
+        """Adds a latency to the histogram of name"""
+        with self.lock:
+            histogram = self.histograms.setdefault(name, {"buckets": [0] * (len(LATENCY_BUCKETS) + 1), "count": 0, "sum": 0.0})
+            histogram["buckets"][bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            histogram["count"] += 1
+            histogram["sum"] += seconds
+
+    @contextmanager
+    def Latency(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.Observe(name, time.perf_counter() - start)
+
+    def Report(self) -> dict:
+        """The run report, with cumulative histogram buckets like Prometheus"""
+        with self.lock:
+            histograms = {}
+            for name, histogram in self.histograms.items():
+                cumulative, buckets = 0, {}
+                for bound, count in zip(LATENCY_BUCKETS + ["+Inf"], histogram["buckets"]):
+                    cumulative += count
+                    buckets[str(bound)] = cumulative
+                histograms[name] = {"count": histogram["count"], "sum": histogram["sum"], "buckets": buckets}
+            return {
+                "Started": datetime.fromtimestamp(self.started).strftime("%m-%d-%Y %H:%M:%S"),
+                "Total Seconds": time.perf_counter() - self.startedClock,
+                "Peak RSS MB": PeakRss(),
+                "Stages": {stage: dict(entry) for stage, entry in self.stages.items()},
+                "Counters": dict(self.counters),
+                "Latency Histograms": histograms,
+                **self.extra
+            }
+
+    def Prometheus(self) -> str:
+        """The run report in the Prometheus text exposition format"""
+        report = self.Report()
+        lines = ["# TYPE infra_run_seconds gauge", "infra_run_seconds %f" % report["Total Seconds"], "# TYPE infra_peak_rss_megabytes gauge", "infra_peak_rss_megabytes %f" % report["Peak RSS MB"]]
+        lines += ["# TYPE infra_stage_seconds gauge"] + ['infra_stage_seconds{stage="%s"} %f' % (stage, entry["seconds"]) for stage, entry in report["Stages"].items()]
+        lines += ["# TYPE infra_stage_calls counter"] + ['infra_stage_calls{stage="%s"} %d' % (stage, entry["calls"]) for stage, entry in report["Stages"].items()]
+        lines += ["# TYPE infra_events counter"] + ['infra_events{name="%s"} %d' % (name, value) for name, value in report["Counters"].items()]
+        lines.append("# TYPE infra_lookup_seconds histogram")
+        for name, histogram in report["Latency Histograms"].items():
+            lines += ['infra_lookup_seconds_bucket{lookup="%s",le="%s"} %d' % (name, bound, count) for bound, count in histogram["buckets"].items()]
+            lines += ['infra_lookup_seconds_sum{lookup="%s"} %f' % (name, histogram["sum"]), 'infra_lookup_seconds_count{lookup="%s"} %d' % (name, histogram["count"])]
+        return "\n".join(lines) + "\n"
+
+    def SaveReport(self, prometheus: bool = False) -> str:
+        """Writes the JSON run report, and the Prometheus one if asked, to the reports folder. Returns the JSON path."""
+        path = "{base}/{output}/reports/RunReport_{time}.json".format(base=config.globals.BASE_DIR, output=config.globals.OUTPUT_FOLDER, time=datetime.fromtimestamp(self.started).strftime("%m-%d-%Y_%H-%M-%S"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.Report(), f, indent=4, default=str)
+            f.close()
+        if prometheus:
+            with open(os.path.splitext(path)[0] + ".prom", "w") as f:
+                f.write(self.Prometheus())
+                f.close()
+        return path
+
+#Metrics of the current run, shared by the whole pipeline
+METRICS = Instrumentation()
+
+## Profiling ##
+def Profile(function, *args):
+    """Runs function under cProfile and tracemalloc. The cProfile stats are saved next to the run report, the top
+    functions and allocation sites are logged and added to the report."""
+    import cProfile, io, pstats, tracemalloc
+    tracemalloc.start()
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function, *args)
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        path = "{base}/{output}/reports/Profile_{time}.prof".format(base=config.globals.BASE_DIR, output=config.globals.OUTPUT_FOLDER, time=datetime.fromtimestamp(METRICS.started).strftime("%m-%d-%Y_%H-%M-%S"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        profiler.dump_stats(path)
+
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(25)
+        Log("info", "\n-----PROFILE-----\n%s" % stream.getvalue())
+        METRICS.extra["Profile"] = {
+            "cProfile Stats": path,
+            "Traced Memory MB": {"current": current / 2**20, "peak": peak / 2**20},
+            "Top Allocations": [{"Location": str(stat.traceback), "MB": stat.size / 2**20, "Blocks": stat.count} for stat in snapshot.statistics("lineno")[:15]]
+        }
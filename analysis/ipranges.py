@@ -0,0 +1,106 @@
+import ipaddress, socket
+from bisect import bisect_right
+
+import numpy as np
+
+#Reserved and bogon ranges that can't belong to a reachable node, by label
+BOGONS_V4 = {
+    "unspecified": ["0.0.0.0/8"],
+    "private": ["10.0.0.0/8", "172.16.0.0/12", "192.168.0.0/16"],
+    "shared": ["100.64.0.0/10"], #*CGNAT
+    "loopback": ["127.0.0.0/8"],
+    "link-local": ["169.254.0.0/16"],
+    "reserved": ["192.0.0.0/24", "198.18.0.0/15", "240.0.0.0/4"], #*IETF protocol assignments, benchmarking, future use and broadcast
+    "documentation": ["192.0.2.0/24", "198.51.100.0/24", "203.0.113.0/24"],
+    "multicast": ["224.0.0.0/4"],
+    "excluded": ["1.1.1.1/32"] #*Public resolver address, not a node
+}
+BOGONS_V6 = {
+    "unspecified": ["::/128"],
+    "loopback": ["::1/128"],
+    "reserved": ["::/8", "100::/64", "2001::/23", "fec0::/10"], #*IPv4-compatible, discard-only, IETF protocol assignments and site-local
+    "documentation": ["2001:db8::/32", "3fff::/20"],
+    "private": ["fc00::/7"],
+    "link-local": ["fe80::/10"],
+    "multicast": ["ff00::/8"]
+}
+IPV4_MAPPED = ipaddress.ip_network("::ffff:0:0/96")
+
+def CompileRanges(bogons: dict) -> tuple:
+    """Returns the (starts, ends, labels) of the ranges sorted by start. Nested ranges keep the most specific label."""
+    ranges = sorted(((int(network.network_address), int(network.broadcast_address), label) for label, networks in bogons.items() for network in map(ipaddress.ip_network, networks)), key=lambda r: (r[0], -r[1]))
+
+    #Split the ranges at their boundaries so they don't overlap and bisect finds the innermost one
+    starts, ends, labels = [], [], []
+    stack = []
+    def Emit(start, end, label):
+        if start <= end:
+            starts.append(start); ends.append(end); labels.append(label)
+    position = None
+    for start, end, label in ranges + [(None, None, None)]:
+        while stack and (start is None or start > stack[-1][1]):
+            outer_end, outer_label = stack[-1][1], stack[-1][2]
+            Emit(position, outer_end, outer_label)
+            position = outer_end + 1
+            stack.pop()
+        if start is None:
+            break
+        if stack:
+            Emit(position, start - 1, stack[-1][2])
+        stack.append((start, end, label))
+        position = start
+    return starts, ends, labels
+
+V4_STARTS, V4_ENDS, V4_LABELS = CompileRanges(BOGONS_V4)
+V6_STARTS, V6_ENDS, V6_LABELS = CompileRanges(BOGONS_V6)
+V4_STARTS_ARRAY, V4_ENDS_ARRAY = np.array(V4_STARTS, dtype=np.int64), np.array(V4_ENDS, dtype=np.int64)
+
+## IP classification ##
+def ParseIp(ip: str) -> tuple:
+    """Returns (version, address as int), or None if ip isn't an IPv4 dotted quad or an IPv6 address"""
+    try:
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, ip), "big")
+    except (OSError, TypeError):
+        pass
+    try:
+        return 6, int.from_bytes(socket.inet_pton(socket.AF_INET6, ip), "big")
+    except (OSError, TypeError):
+        return None
+
+def Lookup(value: int, starts: list, ends: list, labels: list) -> str:
+    i = bisect_right(starts, value) - 1
+    return labels[i] if i >= 0 and value <= ends[i] else "public"
+
+def ClassifyParsed(parsed: tuple) -> str:
+    if parsed is None:
+        return "invalid"
+    version, value = parsed
+    if version == 4:
+        return Lookup(value, V4_STARTS, V4_ENDS, V4_LABELS)
+
+    #IPv4-mapped addresses are classified by the embedded IPv4 address
+    if int(IPV4_MAPPED.network_address) <= value <= int(IPV4_MAPPED.broadcast_address):
+        return Lookup(value & 0xFFFFFFFF, V4_STARTS, V4_ENDS, V4_LABELS)
+    return Lookup(value, V6_STARTS, V6_ENDS, V6_LABELS)
+
+def ClassifyIp(ip: str) -> str:
+    """Returns "public" for routable addresses, otherwise "invalid" or the label of the bogon range ip is in"""
+    return ClassifyParsed(ParseIp(ip))
+
+def IsPublicIp(ip: str) -> bool:
+    return ClassifyIp(ip) == "public"
+
+def ArePublicIps(ips: list) -> np.ndarray:
+    """Vectorized IsPublicIp. Every address is parsed once, the IPv4 addresses are checked against the range table
+    in one searchsorted call and the rest one by one."""
+    parsed = [ParseIp(ip) for ip in ips]
+    public = np.zeros(len(ips), dtype=bool)
+
+    v4 = np.array([p is not None and p[0] == 4 for p in parsed], dtype=bool)
+    values = np.array([p[1] for p in parsed if p is not None and p[0] == 4], dtype=np.int64)
+    i = np.searchsorted(V4_STARTS_ARRAY, values, side="right") - 1
+    public[v4] = ~((i >= 0) & (values <= V4_ENDS_ARRAY[np.maximum(i, 0)]))
+
+    for j in np.flatnonzero(~v4):
+        public[j] = ClassifyParsed(parsed[j]) == "public"
+    return public
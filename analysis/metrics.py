@@ -0,0 +1,50 @@
+import numpy as np
+
+NAKAMOTO_THRESHOLDS = [33, 50] #*percent of a series a coalition of entities has to exceed
+UNATTRIBUTED = {"Other", "Unidentified", "Invalid"} #*buckets that group nodes of many or unknown entities
+
+## Decentralization metrics ##
+def ConcentrationMetrics(values, series: list) -> dict:
+    """Nakamoto coefficients, Herfindahl-Hirschman index, Gini coefficient and Shannon entropy of every column of
+    the entities x series matrix values, all columns in one pass. Entities with nothing in a series don't count for it.
+    Returns {series name: metrics}, with None metrics for empty series."""
+    values = np.clip(np.asarray(values, dtype=np.float64).reshape(-1, len(series)), 0, None)
+    entities = (values > 0).sum(axis=0)
+    total = values.sum(axis=0)
+    shares = np.divide(values, total, out=np.zeros_like(values), where=total > 0)
+
+    #Smallest number of entities, largest first, whose combined share exceeds each threshold
+    cumulative = np.cumsum(-np.sort(-shares, axis=0), axis=0)
+    nakamoto = {threshold: (cumulative <= threshold / 100).sum(axis=0) + 1 for threshold in NAKAMOTO_THRESHOLDS}
+
+    #HHI on the 0-10000 scale and entropy in bits
+    hhi = (shares ** 2).sum(axis=0) * 10000
+    entropy = -np.where(shares > 0, shares * np.log2(np.where(shares > 0, shares, 1)), 0).sum(axis=0)
+
+    #Gini over the ascending values, the leading zeros of entities without a share are skipped in the ranks
+    ranks = np.arange(1, len(values) + 1)[:, None]
+    zeros = len(values) - entities
+    weighted = (ranks * np.sort(values, axis=0)).sum(axis=0) - zeros * total
+    gini = np.divide(2 * weighted, entities * total, out=np.zeros_like(total), where=total > 0) - np.divide(entities + 1, entities, out=np.zeros_like(total), where=entities > 0)
+
+    metrics = {}
+    for i, name in enumerate(series):
+        if not total[i]:
+            metrics[name] = {"Entities": 0, **{f"Nakamoto Coefficient {threshold}%": None for threshold in NAKAMOTO_THRESHOLDS}, "HHI": None, "Gini": None, "Shannon Entropy": None}
+            continue
+        metrics[name] = {
+            "Entities": int(entities[i]),
+            **{f"Nakamoto Coefficient {threshold}%": int(nakamoto[threshold][i]) for threshold in NAKAMOTO_THRESHOLDS},
+            "HHI": float(hhi[i]),
+            "Gini": max(float(gini[i]), 0.0),
+            "Shannon Entropy": float(entropy[i])
+        }
+    return metrics
+
+def DistributionMetrics(distributions: dict, series: list) -> dict:
+    """Returns {dimension: {series name: metrics}} for {dimension: entities x series matrix}"""
+    return {dimension: ConcentrationMetrics(values, series) for dimension, values in distributions.items()}
+
+def AttributedEntries(data: dict) -> list:
+    """The entries of a provider, continent or country dict that belong to a single entity"""
+    return [entry for name, entry in data.items() if name not in UNATTRIBUTED]
@@ -0,0 +1,55 @@
+import bisect, ipaddress, threading
+
+## Prefix index ##
+class AsnIntervalIndex:
+    """Announced prefixes stored as sorted integer ranges, so an IP's ASN is found with a binary search."""
+    def __init__(self):
+        #One set of parallel sorted arrays per IP version
+        self.starts = {4: [], 6: []}
+        self.ends = {4: [], 6: []}
+        self.asns = {4: [], 6: []}
+        self.maxEnds = {4: [], 6: []} #*running max of ends, bounds the backwards walk over nested prefixes
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.starts[4]) + len(self.starts[6])
+
+    def Insert(self, cidr: str, asn: str):
+        network = ipaddress.ip_network(cidr, strict=False)
+        start, end, version = int(network.network_address), int(network.broadcast_address), network.version
+
+        with self.lock:
+            starts, ends = self.starts[version], self.ends[version]
+            i = bisect.bisect_left(starts, start)
+
+            #Skip prefixes that are already indexed. Equal starts are ordered widest first.
+            while i < len(starts) and starts[i] == start and ends[i] >= end:
+                if ends[i] == end:
+                    return
+                i += 1
+
+            starts.insert(i, start)
+            ends.insert(i, end)
+            self.asns[version].insert(i, asn)
+
+            #Rebuild the running max from the insertion point
+            max_ends = self.maxEnds[version]
+            max_ends.insert(i, end)
+            for j in range(i, len(ends)):
+                max_ends[j] = max(ends[j], max_ends[j - 1]) if j else ends[j]
+
+    def Lookup(self, ip: str):
+        """Returns the ASN of the most specific indexed prefix containing ip, or None."""
+        address = ipaddress.ip_address(ip)
+        value, version = int(address), address.version
+
+        with self.lock:
+            starts, ends, max_ends = self.starts[version], self.ends[version], self.maxEnds[version]
+            i = bisect.bisect_right(starts, value) - 1
+
+            #Prefixes are nested or disjoint, so the latest starting prefix that contains the IP is the most specific one
+            while i >= 0 and max_ends[i] >= value:
+                if ends[i] >= value:
+                    return self.asns[version][i]
+                i -= 1
+        return None
@@ -0,0 +1,90 @@
+import json, re
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+## Streaming node file reader ##
+class NodeFileReader:
+    """Reads a `json/<chain>.json` node file incrementally, so the `nodes` object is never loaded as a whole.
+    Nodes() yields the (ip, node_info) pairs one at a time and Header() returns the other top-level keys."""
+    def __init__(self, path: str, chunk_size: int = 1 << 16, required: tuple = ("timestamp", "collection_method", "chain_data")):
+        self.path = path
+        self.chunkSize = chunk_size
+        self.required = required #*header keys Header() needs before it can stop at the nodes object
+        self.decoder = json.JSONDecoder()
+
+    def Header(self) -> dict:
+        """Returns the top-level keys other than `nodes`. Stops at the nodes object if the required keys come before it."""
+        header = {}
+        for key, value in self.Parse(header):
+            if key is None and all(k in header for k in self.required):
+                break
+        return header
+
+    def Nodes(self):
+        """Yields the (ip, node_info) pairs of the nodes object in file order"""
+        for key, value in self.Parse({}):
+            if key is not None:
+                yield key, value
+
+    def Parse(self, header: dict):
+        """Walks the top-level object filling header. Yields (None, None) when the nodes object starts, then (ip, node_info) for every node."""
+        with open(self.path, "r") as f:
+            self.file, self.buffer, self.pos, self.eof = f, "", 0, False
+            self.Expect("{")
+            while not self.Consume("}"):
+                key = self.Decode()
+                self.Expect(":")
+
+                if key == "nodes":
+                    yield None, None
+                    self.Expect("{")
+                    while not self.Consume("}"):
+                        ip = self.Decode()
+                        self.Expect(":")
+                        yield ip, self.Decode()
+                        self.Consume(",")
+                else:
+                    header[key] = self.Decode()
+                self.Consume(",")
+
+    ## Tokenizer helpers ##
+    def Fill(self) -> bool:
+        """Reads the next chunk into the buffer, dropping the consumed part. Returns False at the end of the file."""
+        chunk = self.file.read(self.chunkSize)
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        self.eof = not chunk
+        return bool(chunk)
+
+    def Peek(self) -> str:
+        #Skip whitespace, reading more as needed
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer) or not self.Fill():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def Consume(self, char: str) -> bool:
+        if self.Peek() == char:
+            self.pos += 1
+            return True
+        return False
+
+    def Expect(self, char: str):
+        if not self.Consume(char):
+            raise ValueError("Malformed node file %s: expected '%s' near '%s'" % (self.path, char, self.buffer[self.pos:self.pos + 20]))
+
+    def Decode(self):
+        """Decodes the next JSON value, reading more of the file while the value is incomplete"""
+        self.Peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+
+                #A value that ends the buffer may be a truncated number, read on to be sure
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.Fill()
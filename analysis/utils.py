@@ -1,10 +1,11 @@
-from ipwhois.net import Net
-from ipwhois.asn import IPASN
-import ipinfo #type: ignore
-
 import config.globals
-from classes.Blockchain import Blockchain, Flow
+from classes.Blockchain import Blockchain, Flow, FLOW_ROLES
 from classes.Datacenter import Datacenter
+from classes.NodeRecord import NodeRecord
+from classes.ProviderRegistry import NormalizeAsn
+from analysis.cache import IpCache
+from analysis.instrumentation import METRICS, Log
+from analysis.ipranges import IsPublicIp
 
 #NOTE: This is a compound object. Simple assignment will pass a reference to the object defined in dict_initial_values.py
 #NOTE: To pass a net deepcopy use the .deepcopy() method.
@@ -12,45 +13,58 @@ from classes.dict_initial_values import flow_total_stake
 from copy import deepcopy
 
 ## Helper Functions ##
-def IpAsnLookup(ip: str, target_ips: dict, blockchain_obj: Blockchain) -> tuple:
-    #Nest the Network object building in a try/except
+def IpAsnLookup(ip: str, target: str, backend, ip_cache: IpCache = None) -> tuple:
+    #Return the cached ASN if there is a fresh one
+    if ip_cache:
+        asn = ip_cache.Get(ip, "asn")
+        if asn is not None:
+            return NormalizeAsn(asn), "Other"
+
+    #Nest the backend lookup in a try/except
     try:
-        #Build Network objects and set variables
-        net = Net(ip)
-        obj = IPASN(net)
-        results = obj.lookup()
-        asn = results['asn']
+        with METRICS.Latency(f"{backend.name}.asn"):
+            asn = NormalizeAsn(backend.LookupAsn(ip)) #Normalized to the ProviderConfig.json keys
         provider_name = "Other" #Set provider name as Other. Will get overwritten for relevant providers defined in the file
-        print(f"\t[INFO - {blockchain_obj.target}] Succesful ASN lookup")
+        Log("debug", f"\t[INFO - {target}] Succesful ASN lookup")
+        if ip_cache and asn is not None:
+            ip_cache.Set(ip, "asn", asn)
     except Exception as e:
-        #Capture unespecified IPs and set None asn
-        blockchain_obj.unidentifiedASNs[ip] = target_ips[ip]
-        print("\t[WARN - %s] - Undefined IP: %s for %s" % (blockchain_obj.target, e, ip), flush=True)
+        #Set None asn for unespecified IPs. They are recorded per blockchain during aggregation.
+        Log("warn", "\t[WARN - %s] - Undefined IP: %s for %s" % (target, e, ip))
+        METRICS.Count("asn_lookup_failures")
         asn = None
         provider_name = "Unidentified"
 
     return asn, provider_name
 
-def IpGeoLookup(ip: str, target_ips: dict, blockchain_obj: Blockchain, ip_handler: ipinfo.Handler) -> list:
+def IpGeoLookup(ip: str, target: str, backend, ip_cache: IpCache = None) -> list:
+    #Return the cached location if there is a fresh one
+    if ip_cache:
+        result = ip_cache.Get(ip, "geo")
+        if result is not None:
+            return result
+
     #Nest the IP geo lookup under a try/catch
     try:
-        #Set Ipinfo handler
-        ip_handler = ipinfo.getHandler(config.globals.IPINFO_TOKEN)
-        r = ip_handler.getDetails(ip).all
+        with METRICS.Latency(f"{backend.name}.geo"):
+            r = backend.LookupGeo(ip)
         country = config.globals.COUNTRY_NAME_LOOKUP[r["country"]]
         result = [country, r["country"], r["city"], r["region"], r["latitude"], r["longitude"], r["continent"]["name"]]
-        print(f"\t[INFO - {blockchain_obj.target}] Succesful GEO lookup")
+        Log("debug", f"\t[INFO - {target}] Succesful GEO lookup")
+        if ip_cache:
+            ip_cache.Set(ip, "geo", result)
     except Exception as e:
-        blockchain_obj.unidentifiedLocations[ip] = target_ips[ip]
-        print("\t[WARN - %s] Error performing IP geo lookup: %s for %s" % (blockchain_obj.target, e, ip), flush=True)
+        Log("warn", "\t[WARN - %s] Error performing IP geo lookup: %s for %s" % (target, e, ip))
+        METRICS.Count("geo_lookup_failures")
         result = ["Unidentified", "Unidentified", "Unidentified", "Unidentified", 0, 0, "Unidentified"]
 
     return result
 
-def ProviderAnalysis(providers_to_track: dict, asn:str, ip:str, node_info:dict, providers_short_to_object_map:dict, country:str, country_code:str, city:str, region:str, latitude:float, longitude:float, provider_name:str, analysisDate: str, blockchain_obj: Blockchain) -> str:
-    #If the ASN is in the ASN lookup, overwrite 'Other' provider
-    if asn in config.globals.PROVIDER_ASN_LOOKUP:
-        provider_name = config.globals.PROVIDER_ASN_LOOKUP[asn]['provider']
+def ProviderAnalysis(provider_table: dict, asn:str, record:NodeRecord, country:str, country_code:str, city:str, region:str, latitude:float, longitude:float, provider_name:str, analysisDate: str, blockchain_obj: Blockchain) -> str:
+    #If the ASN is in the provider table, overwrite 'Other' provider
+    entry = provider_table.get(asn)
+    if entry is not None:
+        provider_name, provider_obj = entry
         
         #Create entry if provider hasn't yet been seen
         if provider_name not in blockchain_obj.providersData:
@@ -62,27 +76,21 @@ def ProviderAnalysis(providers_to_track: dict, asn:str, ip:str, node_info:dict,
             }
 
         #Catch the providers_to_track nodes and save them to the object
-        if provider_name in providers_to_track.values():
-            short = list(providers_to_track.keys())[list(providers_to_track.values()).index(provider_name)]
-            provider_obj = providers_short_to_object_map[short]
-            
+        if provider_obj is not None:
             #Create Datacenter object
             datacenter_obj = Datacenter(country, country_code, city, region, latitude, longitude, provider_obj)
             
             #If object exists, overwrite datacenter object. Else add to list and count node.
-            if datacenter_obj in provider_obj.datacenters:
-                datacenter_obj = provider_obj.datacenters[provider_obj.datacenters.index(datacenter_obj)]
-            else:
-                provider_obj.datacenters.append(datacenter_obj)
+            datacenter_obj = provider_obj.GetDatacenter(datacenter_obj)
 
             #Save node to datacenter and update totals
-            datacenter_obj.SaveDatacenterNode(ip, node_info)
-            provider_obj.UpdateTotals(ip, node_info)
+            datacenter_obj.SaveDatacenterNode(record)
+            provider_obj.UpdateTotals(record)
     
     #Returns overwritten result if found
     return provider_name
 
-def CountryAnalysis(countries_to_track: dict, continent: str, country: str, country_code:str, city:str, ip:str, node_info:dict, countries_short_to_object_map:dict, analysisDate: str, blockchain_obj: Blockchain):
+def CountryAnalysis(countries_to_track: dict, continent: str, country: str, country_code:str, city:str, record:NodeRecord, countries_short_to_object_map:dict, analysisDate: str, blockchain_obj: Blockchain):
     #Create entry for country inside of the appropriave continent if it hasn't yet been seen
     if continent not in blockchain_obj.continentData:
         blockchain_obj.continentData[continent] = {
@@ -112,12 +120,13 @@ def CountryAnalysis(countries_to_track: dict, continent: str, country: str, coun
     if country_code in countries_to_track:
         country_obj = countries_short_to_object_map[country_code]
         country_obj.cities.add(city)
-        country_obj.SaveCountryNode(ip, node_info)
+        country_obj.SaveCountryNode(record)
 
-def FlowProviderAnalysis(providers_to_track: dict, asn:str, ip:str, node_info:dict, providers_short_to_object_map:dict, country:str, country_code:str, city:str, region:str, latitude:float, longitude:float, provider_name:str, analysisDate: str, blockchain_obj: Flow, role: str) -> str:
-    #If the ASN is in the ASN lookup, overwrite 'Other' provider
-    if asn in config.globals.PROVIDER_ASN_LOOKUP:
-        provider_name = config.globals.PROVIDER_ASN_LOOKUP[asn]['provider']
+def FlowProviderAnalysis(provider_table: dict, asn:str, record:NodeRecord, country:str, country_code:str, city:str, region:str, latitude:float, longitude:float, provider_name:str, analysisDate: str, blockchain_obj: Flow, role: str) -> str:
+    #If the ASN is in the provider table, overwrite 'Other' provider
+    entry = provider_table.get(asn)
+    if entry is not None:
+        provider_name, provider_obj = entry
         
         #Create entry if provider hasn't yet been seen
         if provider_name not in blockchain_obj.providersData:
@@ -133,27 +142,21 @@ def FlowProviderAnalysis(providers_to_track: dict, asn:str, ip:str, node_info:di
             }
 
         #Catch the providers_to_track nodes, update analysis, and save them to the object
-        if provider_name in providers_to_track.values():
-            short = list(providers_to_track.keys())[list(providers_to_track.values()).index(provider_name)]
-            provider_obj = providers_short_to_object_map[short]
-            
+        if provider_obj is not None:
             #Create Datacenter object
             datacenter_obj = Datacenter(country, country_code, city, region, latitude, longitude, provider_obj)
             
             #If object exists, overwrite datacenter object. Else add to list and count node.
-            if datacenter_obj in provider_obj.datacenters:
-                datacenter_obj = provider_obj.datacenters[provider_obj.datacenters.index(datacenter_obj)]
-            else:
-                provider_obj.datacenters.append(datacenter_obj)
+            datacenter_obj = provider_obj.GetDatacenter(datacenter_obj)
 
             #Save node to datacenter and update totals
-            datacenter_obj.SaveDatacenterNode(ip, node_info, role)
-            provider_obj.UpdateTotals(ip, node_info, role)
+            datacenter_obj.SaveDatacenterNode(record, role)
+            provider_obj.UpdateTotals(record, role)
 
     #Returns overwritten result if found
     return provider_name
 
-def FlowCountryAnalysis(countries_to_track: dict, continent: str, country: str, country_code:str, city:str, ip:str, node_info:dict, countries_short_to_object_map:dict, analysisDate: str, blockchain_obj: Flow, role: str):
+def FlowCountryAnalysis(countries_to_track: dict, continent: str, country: str, country_code:str, city:str, record:NodeRecord, countries_short_to_object_map:dict, analysisDate: str, blockchain_obj: Flow, role: str):
     #Create entry for country inside of the appropriave continent if it hasn't yet been seen
     if continent not in blockchain_obj.continentData:
         blockchain_obj.continentData[continent] = {
@@ -195,10 +198,97 @@ def FlowCountryAnalysis(countries_to_track: dict, continent: str, country: str,
     if country_code in countries_to_track:
         country_obj = countries_short_to_object_map[country_code]
         country_obj.cities.add(city)
-        country_obj.SaveCountryNode(ip, node_info, role)
+        country_obj.SaveCountryNode(record, role)
+
+def NodeState(record: NodeRecord, flow: bool = False) -> tuple:
+    """Returns the fields of the node that count towards the totals: (is_validator, stake), or (role, is_active, stake) for flow"""
+    if flow:
+        return record.extraInfo["role"], bool(record.extraInfo["is_active"]), 0 if not record.stake else int(float(record.stake))
+
+    #Only validators add stake
+    if record.isValidator:
+        return True, 0 if not record.stake else int(record.stake)
+    return False, 0
+
+def AddNode(blockchain_obj: Blockchain, provider_name: str, continent: str, country: str, state: tuple, sign: int = 1):
+    """Adds a node to the network, provider, continent and country totals. sign=-1 removes it."""
+    is_validator, stake = state
+    entries = [blockchain_obj.providersData[provider_name], blockchain_obj.continentData[continent], blockchain_obj.continentData[continent]["Countries"][country]]
+
+    #If it is validator (even if unidentified), sum validator and stake to provider dict and blockchain object.
+    if is_validator:
+        for entry in entries:
+            entry['Total Validators'] += sign
+            entry['Total Stake'] += sign * stake
+        blockchain_obj.totalStake += sign * stake
+        blockchain_obj.totalValidators += sign
+
+    #Else just sum RPC to provider dict and blockchain object
+    else:
+        for entry in entries:
+            entry['Total Non-Validator Nodes'] += sign
+        blockchain_obj.totalNonValidatorNodes += sign
+
+    #Add another node to the network and to the provider
+    for entry in entries:
+        entry['Total Nodes'] += sign
+    blockchain_obj.totalNodes += sign
+
+def AddShares(blockchain_obj: Blockchain, asn: str, datacenter: tuple, state: tuple):
+    """Adds a node to the ASN and datacenter shares of the decentralization metrics. Nodes without an ASN or datacenter are skipped."""
+    _, stake = state
+    for shares, key in [(blockchain_obj.asnShares, asn), (blockchain_obj.datacenterShares, datacenter)]:
+        if key is not None:
+            entry = shares.setdefault(key, [0, 0]) #*[nodes, stake]
+            entry[0] += 1
+            entry[1] += stake
+
+def AddFlowShares(blockchain_obj: Flow, asn: str, datacenter: tuple, state: tuple):
+    """Adds a flow node to the ASN and datacenter shares of the decentralization metrics, per role"""
+    role, _, stake = state
+    r = FLOW_ROLES.index(role)
+    for shares, key in [(blockchain_obj.asnShares, asn), (blockchain_obj.datacenterShares, datacenter)]:
+        if key is not None:
+            entry = shares.setdefault(key, [[0, 0] for _ in FLOW_ROLES]) #*role -> [nodes, stake]
+            entry[r][0] += 1
+            entry[r][1] += stake
+
+def DatacenterKey(asn: str, country_code: str, city: str):
+    """Datacenter of a node for the decentralization metrics, None if its ASN or city is unknown"""
+    if asn is None or city in [None, "Unidentified", "Invalid"]:
+        return None
+    return (asn, country_code, city)
+
+def AddFlowNode(blockchain_obj: Flow, provider_name: str, continent: str, country: str, state: tuple, sign: int = 1):
+    """Adds a flow node to the network, provider, continent and country totals. sign=-1 removes it."""
+    role, is_active, stake = state
+    role_param = blockchain_obj.ReturnNodeTypeQuantities(role)
+    key_name = f"{role.capitalize()} Nodes"
+    entries = [blockchain_obj.providersData[provider_name], blockchain_obj.continentData[continent], blockchain_obj.continentData[continent]["Countries"][country]]
+
+    #Check if it meets requirements and add to general and provider stake
+    if is_active:
+        role_param["active"] += sign
+        blockchain_obj.totalStake[role]["active"] += sign * stake
+        for entry in entries:
+            entry["Total Stake"][role]["active"] += sign * stake
+            entry[key_name]["active"] += sign
+
+    #Else sum inactive nodes to provider dict and blockchain object
+    else:
+        for entry in entries:
+            entry['Total Inactive Nodes'] += sign
+        blockchain_obj.totalInactiveNodes += sign
+
+    #Add to general and provider/country totals
+    role_param["total"] += sign
+    blockchain_obj.totalStake[role]["total"] += sign * stake
+    blockchain_obj.totalNodes += sign
+    for entry in entries:
+        entry[key_name]["total"] += sign
+        entry["Total Stake"][role]["total"] += sign * stake
+        entry["Total Nodes"] += sign
 
 def IsValidIp(ip) -> bool:
-    list_172 = ["172.16.", "172.17.", "172.18.", "172.19.", "172.20.", "172.21.", "172.22.", "172.23.", "172.24.", "172.25.", "172.26.", "172.27.", "172.28.", "172.29.", "172.30.", "172.31."]
-    if (ip == "") or (ip == "0.0.0.0") or (ip == "1.1.1.1") or (ip[:3] == "10.") or (ip[:8] == "192.168.") or (ip[:7] in list_172) or ("." not in ip and ":" not in ip) or (ip[:4] == "127."):
-        return False
-    return True
\ No newline at end of file
+    """False for private, loopback, reserved and other bogon addresses and for anything that isn't an IP address"""
+    return IsPublicIp(ip)
\ No newline at end of file
@@ -0,0 +1,129 @@
+import json, math
+
+#Output formats selected with --format and their file extensions. json is the pretty printed default.
+OUTPUT_FORMATS = {"json": ".json", "jsonl": ".jsonl", "parquet": ".parquet", "msgpack": ".msgpack"}
+OUTPUT_FORMAT_MODULES = {"parquet": "pyarrow", "msgpack": "msgpack"} #*optional dependencies, see requirements/output_requirements.txt
+PARQUET_BATCH_SIZE = 10000 #*rows buffered per Parquet row group
+
+#Column types of the node rows. Nested values like Validator Info are JSON encoded in Parquet.
+NODE_SCHEMA = {"IP": "string", "Address": "string", "Is Validator": "bool", "Stake": "int", "Validator Info": "json"}
+DATACENTER_NODE_SCHEMA = {"Datacenter": "int", **NODE_SCHEMA}
+
+def MissingFormatModule(output_format: str):
+    """Returns the name of the module an output format needs if it isn't installed, otherwise None"""
+    module = OUTPUT_FORMAT_MODULES.get(output_format)
+    if module is None:
+        return None
+    try:
+        __import__(module)
+    except ImportError:
+        return module
+    return None
+
+def FlattenEntry(entry: dict, prefix: str = "") -> dict:
+    """Flattens nested dicts into one level of "outer.inner" keys"""
+    flat = {}
+    for name, value in entry.items():
+        if isinstance(value, dict) and value:
+            flat.update(FlattenEntry(value, f"{prefix}{name}."))
+        else:
+            flat[f"{prefix}{name}"] = value
+    return flat
+
+## Streaming row writer ##
+class RowWriter:
+    """Writes flat rows one at a time as JSON Lines, Parquet or MessagePack. JSON Lines and MessagePack rows go straight
+    to the file, Parquet rows are buffered into row groups of PARQUET_BATCH_SIZE. schema is {column: string|int|float|bool|json},
+    columns without a type are inferred from the first row group."""
+    def __init__(self, path: str, output_format: str, schema: dict = None):
+        self.path = path
+        self.format = output_format
+        self.schema = schema or {}
+        self.rows = 0
+        self.buffer = []
+        self.parquetWriter = None
+        self.parquetSchema = None
+        if output_format == "jsonl":
+            self.file = open(path, "w")
+        elif output_format == "msgpack":
+            import msgpack #type: ignore
+            self.file = open(path, "wb")
+            self.packer = msgpack.Packer(default=str)
+        elif output_format == "parquet":
+            self.file = None
+        else:
+            raise ValueError("Unsupported output format %s" % output_format)
+
+    def Write(self, row: dict):
+        self.rows += 1
+        if self.format == "jsonl":
+            self.file.write(json.dumps(row, default=str) + "\n")
+        elif self.format == "msgpack":
+            self.file.write(self.packer.pack(row))
+        else:
+            self.buffer.append(row)
+            if len(self.buffer) >= PARQUET_BATCH_SIZE:
+                self.FlushParquet()
+
+    def WriteRows(self, rows):
+        for row in rows:
+            self.Write(row)
+
+    def FlushParquet(self):
+        import pyarrow as pa, pyarrow.parquet as pq #type: ignore
+        if self.parquetSchema is None:
+            columns = list(dict.fromkeys([*self.schema, *(name for row in self.buffer for name in row)]))
+            arrays = [self.ParquetArray(name, [row.get(name) for row in self.buffer]) for name in columns]
+            table = pa.Table.from_arrays(arrays, names=columns)
+            self.parquetSchema = table.schema
+            self.parquetWriter = pq.ParquetWriter(self.path, self.parquetSchema)
+        else:
+            table = pa.Table.from_arrays([self.ParquetArray(field.name, [row.get(field.name) for row in self.buffer], field.type) for field in self.parquetSchema], schema=self.parquetSchema)
+        self.parquetWriter.write_table(table)
+        self.buffer = []
+
+    def ParquetArray(self, name: str, values: list, arrow_type=None):
+        """Arrow array of a column, typed by the schema or inferred. Nested and mixed type values fall back to JSON strings."""
+        import pyarrow as pa #type: ignore
+        kind = self.schema.get(name)
+        if kind == "json" or any(isinstance(value, (dict, list)) for value in values):
+            values = [None if value is None else json.dumps(value, default=str) for value in values]
+        elif kind == "string":
+            values = [None if value is None else str(value) for value in values]
+        elif kind == "bool":
+            values = [None if value is None else bool(value) for value in values]
+        elif kind == "float":
+            values = [None if value is None else float(value) for value in values]
+
+        #Row groups after the first must match its schema
+        fixed = arrow_type is not None
+        if arrow_type is None and kind is not None:
+            arrow_type = {"json": pa.string(), "string": pa.string(), "int": pa.int64(), "float": pa.float64(), "bool": pa.bool_()}[kind]
+        try:
+            return pa.array(values, type=arrow_type)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+            if fixed:
+                raise
+            return pa.array([None if value is None or (isinstance(value, float) and math.isnan(value)) else str(value) for value in values], type=pa.string())
+
+    def Close(self):
+        if self.format == "parquet":
+            if self.buffer or self.parquetWriter is None:
+                self.FlushParquet()
+            self.parquetWriter.close()
+        else:
+            self.file.close()
+
+def WriteTables(base_path: str, output_format: str, aggregates: list, nodes=None, node_schema: dict = None):
+    """Writes the aggregate rows to base_path with the extension of the format. If there are node rows, they are streamed
+    to base_path and the aggregates go to base_path + "_Totals"."""
+    extension = OUTPUT_FORMATS[output_format]
+    writer = RowWriter(base_path + ("_Totals" if nodes is not None else "") + extension, output_format)
+    writer.WriteRows(aggregates)
+    writer.Close()
+    if nodes is not None:
+        writer = RowWriter(base_path + extension, output_format, node_schema)
+        try:
+            writer.WriteRows(nodes)
+        finally:
+            writer.Close()
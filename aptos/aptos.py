@@ -1,22 +1,35 @@
-import subprocess, json, socket
+import subprocess, json, os, sys
 from datetime import datetime
 
-def treatIP(ip: str) -> str:
+#Shared utilities live at the root of the repo
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from utilities.resolver import DnsResolver
+
+def treatIP(ip: str, resolved: dict) -> str:
     splitted = ip.split("/")
-    #Check if ipv4
-    if splitted[1] == "ip4":
+    #Check if ipv4 or ipv6
+    if splitted[1] in ["ip4", "ip6"]:
         return splitted[2], None
     
-    #Else resolve dns and return resolved
-    elif splitted[1] == "dns":
+    #Else return the resolved dns
+    elif splitted[1] in ["dns", "dns4", "dns6"]:
         hostname = splitted[2]
-        try:
-            result = socket.gethostbyname(hostname)
-            return result, hostname
-        except Exception as e:
-            print(f"Error processing address {splitted[2]}. Unrecognized (ip or dns) at {splitted[1]}")
-            print(f"Error {e}. Panicking!")
+        if resolved.get(hostname) is None:
+            print(f"Error processing address {splitted[2]}. Unresolved dns at {splitted[1]}")
+            print("Panicking!")
             exit(0)
+        return resolved[hostname], hostname
+
+def GetHostnames(validators: list) -> list:
+    #Collect the dns hostnames of the validator and fullnode addresses
+    hostnames = []
+    for validator in validators:
+        for key in ["validator_network_addresses", "fullnode_network_addresses"]:
+            if validator["config"][key]:
+                splitted = validator["config"][key][0].split("/")
+                if splitted[1] in ["dns", "dns4", "dns6"]:
+                    hostnames.append(splitted[2])
+    return hostnames
 
 def main():
     # Execute subprocess command
@@ -57,6 +70,9 @@ def main():
     n = len(json_result["Result"]["active_validators"])
     i = 0
 
+    #Resolve all the hostnames concurrently up front
+    resolved = DnsResolver().Resolve(GetHostnames(json_result["Result"]["active_validators"]))
+
     # Iterate over the JSON result and cast into desired format
     for validator in json_result["Result"]["active_validators"]:
         print(f"\tProcessing Validator... [{i}/{n}]", flush=True)
@@ -73,13 +89,13 @@ def main():
         #Check for fullnode IP
         if validator["config"]["fullnode_network_addresses"]:
             fullnode = validator["config"]["fullnode_network_addresses"][0]
-            fullnode = treatIP(fullnode)
+            fullnode = treatIP(fullnode, resolved)
         else:
             fullnode = ""
         pubkey = validator["config"]["consensus_public_key"]
         
         #Treat validator ip
-        ip, domain = treatIP(ip)
+        ip, domain = treatIP(ip, resolved)
 
         #Add to ip dict
         ip_dict[ip] = {
@@ -2,62 +2,154 @@ import requests
 from datetime import datetime
 import time
 import json
+import os
+import sys
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict
 
-def get_validators() -> pd.DataFrame:
+# shared utilities live at the root of the repo
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from utilities.journal import Journal
+
+API_URL = "https://api-beta.avascan.info"
+
+
+class AdaptivePager:
+    """
+    Follows the `link.next` cursors of the avascan api, fetching the next page while the current one is parsed.
+    Requests are paced by the api's rate limit headers when present, with AIMD on the request rate otherwise:
+    every 429 halves it and every success raises it by `step` requests per second, until it is unbounded again.
     """
-    Get validators from avascan api
+    def __init__(self, journal: Journal, step: float = 0.5, max_rate: float = 100, retries: int = 8):
+        self.journal = journal
+        self.session = requests.Session()
+        self.step = step
+        self.maxRate = max_rate
+        self.retries = retries
+        self.rate = None  # requests per second, None while no 429 was seen
+        self.last = 0.0  # monotonic time of the last request
+        self.waitUntil = 0.0  # monotonic time before which no request is sent
+
+    def delay(self) -> float:
+        return 1 / self.rate if self.rate else 0.0
+
+    def fetch(self, url: str) -> Dict:
+        """
+        Get a page, waiting out the rate limit
+
+        @param url: str - page url
+        @return: Dict - page items and the url of the next page
+        """
+        for _ in range(self.retries + 1):
+            time.sleep(max(0, self.waitUntil - time.monotonic()))
+            interval, self.last = time.monotonic() - self.last, time.monotonic()
+            response = self.session.get(url, timeout=60)
+
+            if response.status_code == 429:
+                # multiplicative decrease from the current rate, or whatever the api asks for
+                self.rate = (self.rate or 1 / min(max(interval, 0.01), 1)) / 2
+                retry_after = response.headers.get("Retry-After")
+                self.waitUntil = time.monotonic() + (float(retry_after) if retry_after else self.delay())
+                print(f"Rate limited, slowing down to {self.rate:.1f} requests per second")
+                continue
+
+            # additive increase
+            if self.rate:
+                self.rate = self.rate + self.step if self.rate + self.step < self.maxRate else None
+            self.pace(response.headers)
+            body = response.json()
+            if "items" not in body:
+                raise RuntimeError(f"Unexpected response getting validators: {body}. Run again to resume")
+            _next = body.get("link", {}).get("next")
+            return {"items": body["items"], "next": f"{API_URL}{_next}" if _next else None}
+        raise RuntimeError(f"Still rate limited after {self.retries} retries. Run again to resume")
+
+    def pace(self, headers):
+        """
+        Schedule the next request from the rate limit headers, no wait while there is headroom
+        """
+        remaining = headers.get("X-RateLimit-Remaining", headers.get("RateLimit-Remaining"))
+        reset = headers.get("X-RateLimit-Reset", headers.get("RateLimit-Reset"))
+        if remaining is None:
+            self.waitUntil = self.last + self.delay()
+        elif int(float(remaining)) > 0:
+            self.waitUntil = 0.0
+        elif reset is not None:
+            # reset is either seconds until the window resets or an epoch timestamp
+            reset = float(reset)
+            self.waitUntil = time.monotonic() + (reset - time.time() if reset > time.time() - 3600 else reset)
+        else:
+            self.waitUntil = time.monotonic() + max(self.delay(), 1)
+
+    def pages(self, url: str, timeout: float):
+        """
+        Yield the items of every page, prefetching the next page. Fetched pages are journaled by url.
+
+        @param url: str - first page url
+        @param timeout: float - time after which no more pages are fetched
+        """
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            pending = None
+            while url:
+                page = self.journal.Get(url)
+                if page is None:
+                    # the pages so far are kept in the journal for the next run
+                    if pending is None and time.time() > timeout:
+                        raise RuntimeError(f"Timed out getting validators at {url}. Run again to resume")
+                    page = (pending or executor.submit(self.fetch, url)).result()
+                    self.journal.Append(url, page)
+                if not page["items"]:
+                    break
+
+                # request the next page before handing this one over for parsing
+                url = page["next"]
+                pending = executor.submit(self.fetch, url) if url and url not in self.journal and time.time() <= timeout else None
+                yield page["items"]
+
+def parse_validators(items: list) -> list:
+    """
+    Unpack the validator items of a page into records
 
-    @return: pandas dataframe
+    @param items: list - page items
+    @return: list of records
     """
+    return [
+        {
+            "address": item["nodeId"],
+            "ip": item["node"].get("ip", "unknown"),
+            "stake": int(item["stake"]["total"]) // 1000000000,
+            "is_validator": True,
+            "extra_info": {"name": item.get("name"), "manager": item.get("manager")},
+        }
+        for item in items
+    ]
+
+def get_validators(journal: Journal) -> pd.DataFrame:
+    """
+    Get validators from avascan api, resuming from the pages in the journal
 
-    url = "https://api-beta.avascan.info/v2/network/mainnet/staking/validations"
-    params = {
-        "status": "active",
-    }
-    response = requests.get(url, params=params).json()
-    _next = response["link"].get("next")
-    next_url = f"https://api-beta.avascan.info{_next}"
+    @param journal: Journal - checkpoint of the fetched pages, keyed by page url
+    @return: pandas dataframe
+    """
 
-    tmp_df = pd.DataFrame(response["items"])
-    df = tmp_df.copy()
+    pager = AdaptivePager(journal)
+    records = []
 
     # NOTE: timeout is >2x the time it takes to get ~1.2k, 2.5min
     timeout = time.time() + (60 * 6)  # 6 minutes from now
 
-    while not tmp_df.empty:
+    for items in pager.pages(f"{API_URL}/v2/network/mainnet/staking/validations?status=active", timeout):
         print("running", int(timeout - time.time()))
-        if time.time() > timeout:
-            break
-
-        # Handling rate limiting
-        time.sleep(1.2)
-
-        response = requests.get(next_url).json()
-        if "link" not in response.keys():
-            break
-        _next = response["link"].get("next")
-        next_url = f"https://api-beta.avascan.info{_next}"
-        tmp_df = pd.DataFrame(response["items"])
-
-        df = pd.concat([df, tmp_df], axis=0)
-
-
-    # unpack everything
-    df["address"] = df["nodeId"]
-    df["ip"] = df["node"].apply(lambda x: x.get("ip","unknown"))
-    df["stake"] = df["stake"].apply(lambda x: int(x["total"]) // 1000000000)
-    df["is_validator"] = True
-    df["extra_info"] = df.apply(lambda x: {"name": x["name"], "manager": x["manager"]}, axis=1)
+        records.extend(parse_validators(items))
 
-    # select only relevant rows
-    df = df[["address","ip","stake","is_validator","extra_info"]]
+    # build the frame once, with only the relevant rows
+    df = pd.DataFrame(records, columns=["address","ip","stake","is_validator","extra_info"])
     return df
 
-def main() -> Dict:
+def main(journal: Journal) -> Dict:
     # Get validators
-    validators = get_validators()
+    validators = get_validators(journal)
 
     # copy the addresses to other_addresses to group all later
     validators["other_addresses"] = validators["address"]
@@ -75,7 +167,9 @@ def main() -> Dict:
 
 # save to json
 if __name__ == "__main__":
-    validators_dict = main()
+    # pages are journaled as they are fetched, so a failed run resumes where it stopped
+    journal = Journal("avalanche")
+    validators_dict = main(journal)
 
     # save to json
     today = datetime.today().strftime("%Y-%m-%d")
@@ -115,4 +209,5 @@ if __name__ == "__main__":
 
     with open(f'{OUTPUT_FOLDER}/avalanche.json', 'w') as f:
         json.dump(result, f, indent=4)
+    journal.Finish()
     print(f"Done. Check {OUTPUT_FOLDER}")
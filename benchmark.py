@@ -0,0 +1,201 @@
+#!/usr/bin/python3
+############################################
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############################################
+import contextlib, json, os, random, shutil, subprocess, sys, tempfile, time
+from datetime import datetime
+from itertools import accumulate
+
+import config.globals
+from analysis.instrumentation import METRICS, STAGES, PeakRss
+
+#Benchmark defaults, overridden by the --<name>=<value> arguments
+BENCHMARK_DEFAULTS = {
+    "sizes": "1000,10000,100000",
+    "chains": "synthetic,flow", #*"flow" gets Flow-shaped role data and runs through the Flow analysis
+    "latency": "0.0", #*seconds per synthetic ASN and geo lookup
+    "workers": str(config.globals.ENRICHMENT_WORKERS),
+    "engine": config.globals.AGGREGATION_ENGINE,
+    "format": "json",
+    "providers": "GCP,AWS,HTZ,OVH",
+    "countries": "US,DE,JP",
+    "seed": "7",
+    "baseline": "", #*previous benchmark report to compare the stage timings against
+    "tolerance": "0.2" #*slowdown over the baseline reported as a regression
+}
+FLOW_ROLES = [("access", 30, 100), ("collection", 25, 250000), ("consensus", 15, 500000), ("execution", 10, 1250000), ("verification", 20, 135000)] #*role, weight, minimum stake
+
+## Synthetic chain snapshots ##
+def GenerateSnapshot(path: str, chain: str, size: int, seed: int):
+    """Writes a json/<chain>.json file of size nodes. Nodes cluster in /24 blocks with a Zipf-like skew, so the synthetic
+    backend maps them to a few large providers and countries and a long tail. About 2% of the IPs are invalid and 3% IPv6."""
+    rng = random.Random(seed)
+    blocks = ["%d.%d.%d" % (rng.choice([3, 13, 34, 35, 52, 54, 65, 88, 95, 104, 135, 136, 144, 148, 172, 185, 192, 198]), rng.randint(0, 255), rng.randint(0, 255)) for _ in range(max(size // 20, 50))]
+    block_weights = list(accumulate(1 / (rank + 1) for rank in range(len(blocks))))
+    used = {}
+    role_weights = list(accumulate(role[1] for role in FLOW_ROLES))
+
+    nodes = {}
+    while len(nodes) < size:
+        i = len(nodes)
+        r = rng.random()
+        if r < 0.02:
+            ip = rng.choice(["10.%d.%d.%d" % (rng.randint(0, 255), rng.randint(0, 255), rng.randint(1, 254)), "192.168.%d.%d" % (rng.randint(0, 255), rng.randint(1, 254)), "node-%d.example.org" % i])
+        elif r < 0.05:
+            ip = "2a01:4f8:%x::%x" % (rng.randint(0, 255), i)
+        else:
+            block = rng.choices(blocks, cum_weights=block_weights)[0]
+            used[block] = used.get(block, 0) + 1
+            ip = "%s.%d" % (block, used[block]) if used[block] < 255 else "%d.%d.%d.%d" % (rng.randint(1, 223), rng.randint(0, 255), rng.randint(0, 255), rng.randint(1, 254))
+
+        if chain == "flow":
+            role, _, minimum = FLOW_ROLES[rng.choices(range(len(FLOW_ROLES)), cum_weights=role_weights)[0]]
+            is_active = rng.random() < 0.9
+            nodes[ip] = {"is_validator": True, "stake": "%d.0" % (minimum * rng.uniform(1, 3) if is_active else minimum * rng.uniform(0, 1)), "address": "addr%d" % i, "extra_info": {"name": "node%d" % i, "role": role, "is_active": is_active}}
+        else:
+            is_validator = rng.random() < 0.6
+            nodes[ip] = {"is_validator": is_validator, "stake": int(rng.lognormvariate(12, 2)) if is_validator else None, "address": "addr%d" % i, "extra_info": {"name": "node%d" % i}}
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"timestamp": datetime.today().strftime("%m-%d-%Y"), "collection_method": "synthetic", "chain_data": {}, "nodes": nodes}, f, indent=4)
+        f.close()
+
+## Benchmark run ##
+def RunOne(chain: str, size: int, settings: dict) -> dict:
+    """Generates a snapshot and analyzes it in a scratch folder with the synthetic backend. Runs in its own process
+    so the peak RSS belongs to this run only."""
+    import main
+    from utilities.setup import LoadConfigFilesAndGetAllowedProviders
+
+    #Keep the inputs, outputs and memory of the run out of the repo
+    work_dir = tempfile.mkdtemp(prefix="benchmark_")
+    config.globals.BASE_DIR = work_dir
+    config.globals.MEMORY_FOLDER = work_dir + "/memory/"
+    config.globals.CACHE_PATH = config.globals.MEMORY_FOLDER + "ip_cache.sqlite"
+    config.globals.HISTORY_PATH = config.globals.MEMORY_FOLDER + "history.sqlite"
+    config.globals.SYNTHETIC_LATENCY = float(settings["latency"])
+    config.globals.AGGREGATION_ENGINE = settings["engine"]
+
+    start = time.perf_counter()
+    GenerateSnapshot(f"{work_dir}/json/{chain}.json", chain, size, int(settings["seed"]))
+    generation = time.perf_counter() - start
+
+    allowed_providers = LoadConfigFilesAndGetAllowedProviders()
+    providers_to_track = {short: allowed_providers[short] for short in settings["providers"].upper().split(",") if short in allowed_providers}
+    countries_to_track = {code: config.globals.COUNTRY_NAME_LOOKUP[code] for code in settings["countries"].upper().split(",") if code in config.globals.COUNTRY_NAME_LOOKUP}
+
+    #The stages are timed by the pipeline's instrumentation. Everything else main.py runs, like the object setup, is
+    #counted in the total only.
+    METRICS.Reset()
+    start = time.perf_counter()
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            main.AnalyzeBlockchain(chain, providers_to_track, countries_to_track, False, int(settings["workers"]), "synthetic", None, False, settings["format"])
+    finally:
+        total = time.perf_counter() - start
+        shutil.rmtree(work_dir, ignore_errors=True)
+    report = METRICS.Report()
+
+    return {
+        "Chain": chain,
+        "Nodes": size,
+        "Generation Seconds": generation,
+        "Total Seconds": total,
+        "Nodes per Second": size / total if total else None,
+        "Peak RSS MB": PeakRss(),
+        "Stages": {stage: {"Seconds": entry["seconds"], "Nodes per Second": size / entry["seconds"] if entry["seconds"] else None, "Peak RSS MB": entry["peak_rss_mb"]} for stage, entry in report["Stages"].items() if stage in STAGES},
+        "Counters": report["Counters"],
+        "Latency Histograms": report["Latency Histograms"]
+    }
+
+def Compare(results: list, baseline_path: str, tolerance: float) -> list:
+    """Returns the (chain, nodes, stage, baseline seconds, seconds) that got slower than the baseline by more than tolerance"""
+    with open(baseline_path, "r") as f:
+        baseline = {(run["Chain"], run["Nodes"]): run for run in json.load(f)["Runs"]}
+        f.close()
+
+    regressions = []
+    for run in results:
+        previous = baseline.get((run["Chain"], run["Nodes"]))
+        if previous is None:
+            continue
+        for stage in STAGES + ["Total"]:
+            #Stages renamed since the baseline was saved can't be compared
+            if stage != "Total" and stage not in previous["Stages"]:
+                continue
+            before = previous["Total Seconds"] if stage == "Total" else previous["Stages"][stage]["Seconds"]
+            after = run["Total Seconds"] if stage == "Total" else run["Stages"][stage]["Seconds"]
+            #Ignore stages too short to time reliably
+            if before > 0.05 and after > before * (1 + tolerance):
+                regressions.append((run["Chain"], run["Nodes"], stage, before, after))
+    return regressions
+
+def PrintReport(results: list):
+    print("\n%-10s %8s %10s %12s %10s   %s" % ("chain", "nodes", "total s", "nodes/s", "peak MB", "  ".join("%-22s" % f"{stage} s (nodes/s)" for stage in STAGES)))
+    for run in results:
+        stages = "  ".join("%-22s" % ("%.3f (%.0f)" % (run["Stages"][stage]["Seconds"], run["Stages"][stage]["Nodes per Second"] or 0)) for stage in STAGES)
+        print("%-10s %8d %10.3f %12.0f %10.1f   %s" % (run["Chain"], run["Nodes"], run["Total Seconds"], run["Nodes per Second"] or 0, run["Peak RSS MB"], stages))
+
+def GetSettings(args: list) -> dict:
+    settings = dict(BENCHMARK_DEFAULTS)
+    for arg in args:
+        buff = arg.split("=", 1)
+        if len(buff) != 2 or buff[0][2:] not in settings and buff[0] != "--run":
+            print("ERROR: The argument %s is not supported." % arg)
+            print("\tValid arguments are:", ["--%s=<value>" % name for name in BENCHMARK_DEFAULTS])
+            exit(1)
+        settings[buff[0][2:]] = buff[1]
+    return settings
+
+## Main ##
+def main(settings: dict):
+    results = []
+    for chain in settings["chains"].split(","):
+        for size in [int(size) for size in settings["sizes"].split(",")]:
+            print("Benchmarking %s with %d nodes..." % (chain, size), flush=True)
+
+            #One process per run so each run starts from a clean heap
+            forwarded = ["--%s=%s" % (name, value) for name, value in settings.items() if name in BENCHMARK_DEFAULTS]
+            process = subprocess.run([sys.executable, os.path.realpath(__file__), "--run=%s:%d" % (chain, size)] + forwarded, stdout=subprocess.PIPE, text=True)
+            if process.returncode != 0:
+                print("ERROR: The %s run with %d nodes failed." % (chain, size))
+                exit(1)
+            results.append(json.loads(process.stdout.strip().splitlines()[-1]))
+
+    PrintReport(results)
+
+    #Save the report, it can be passed as --baseline to later runs
+    path = "{base}/{output}/benchmarks/Benchmark_{time}.json".format(base=config.globals.BASE_DIR, output=config.globals.OUTPUT_FOLDER, time=datetime.today().strftime("%m-%d-%Y_%H-%M-%S"))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"Date": datetime.today().strftime("%m-%d-%Y"), "Settings": settings, "Runs": results}, f, indent=4)
+        f.close()
+    print("\nSaved the report to %s" % path)
+
+    if settings["baseline"]:
+        regressions = Compare(results, settings["baseline"], float(settings["tolerance"]))
+        for chain, size, stage, before, after in regressions:
+            print("\t[REGRESSION] %s with %d nodes: %s took %.3fs, %.3fs in the baseline." % (chain, size, stage, after, before))
+        if regressions:
+            exit(1)
+        print("No regressions over the baseline.")
+
+## Main Caller ##
+if __name__ == "__main__":
+    settings = GetSettings(sys.argv[1:])
+    if "run" in settings:
+        chain, size = settings["run"].split(":")
+        print(json.dumps(RunOne(chain, int(size), settings)), flush=True)
+    else:
+        main(settings)
@@ -6,16 +6,28 @@ from typing import List, Dict
 import pandas as pd
 import requests
 import time
-import socket
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 import os
+import sys
+
+# shared utilities live at the root of the repo
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from utilities.resolver import DnsResolver
+from utilities.journal import Journal
 
 
 with open("config/SettingsConfig.json", "r") as f:
     buff = json.load(f)
     BLOCKFROST_PROJECT = buff["blackfrost_project"]
     OUTPUT_FOLDER = buff["output_folder"]
+    BASE_URL = buff.get("base_url", "https://cardano-mainnet.blockfrost.io/api/v0")
+    # NOTE: Blockfrost allows 10 requests per second with bursts of 500
+    RATE_LIMIT = buff.get("rate_limit", 10)
+    BURST = buff.get("burst", 10)
+    WORKERS = buff.get("workers", 8)
     f.close()
 
 if BLOCKFROST_PROJECT is None:
@@ -27,15 +39,72 @@ HEADERS = {
     "user-agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/96.0.4664.45 Safari/537.36",
     "project_id": BLOCKFROST_PROJECT,
 }
-BASE_URL = "https://cardano-mainnet.blockfrost.io/api/v0"
 LIMIT = 100
+RETRIES = 5
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket rate limiter. Allows `rate` requests per second on average, with bursts of up to `capacity`.
+    """
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Block until a token is available and take it
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# pooled connections shared by all the requests, one per worker
+SESSION = requests.Session()
+SESSION.headers.update(HEADERS)
+SESSION.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=WORKERS))
+SESSION.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=WORKERS))
+BUCKET = TokenBucket(RATE_LIMIT, BURST)
+
+
+def get(url: str, params: Dict = None):
+    """
+    Rate limited GET to the Blockfrost API, retrying with exponential backoff when rate limited or failing
+
+    @param url: str - url
+    @param params: Dict - query parameters
+    @return: decoded json response
+    """
+    for attempt in range(RETRIES + 1):
+        BUCKET.acquire()
+        try:
+            response = SESSION.get(url, params=params, timeout=30)
+            if response.status_code not in [429, 500, 502, 503, 504]:
+                return response.json()
+        except requests.exceptions.RequestException as e:
+            response = e
+        if attempt < RETRIES:
+            time.sleep(2 ** attempt)
+    raise RuntimeError(f"Request to {url} failed: {response}")
 
 # Pools
-def get_stake_pools() -> pd.DataFrame:
+def get_stake_pools(journal: Journal) -> pd.DataFrame:
     """
-    Get stake pools from Blockfrost
+    Get stake pools from Blockfrost, resuming from the pages in the journal
     ref: https://docs.blockfrost.io/#tag/Cardano-Pools/paths/~1pools/get
 
+    @param journal: Journal - checkpoint of the fetched pages
     @return: pd.DataFrame
     """
     # NOTE: using the /pools endpoint for more info
@@ -45,92 +114,101 @@ def get_stake_pools() -> pd.DataFrame:
         "count": LIMIT,
         "page": 1,
     }
-
-    response = requests.get(url, headers=HEADERS, params=parameters).json()
-    df = pd.DataFrame(response)
+    records = []
 
     # start 5 minute timer
     start = time.time()
-    while len(response) == LIMIT:
-        # check timer
-        if time.time() - start > 300:
-            print("Timed out getting stake pools")
+    while True:
+        key = f"pools/{parameters['page']}"
+        if key in journal:
+            response = journal.Get(key)
+        else:
+            # check timer, the pages so far are kept in the journal for the next run
+            if time.time() - start > 300:
+                raise RuntimeError(f"Timed out getting stake pools at page {parameters['page']}. Run again to resume")
+            print(f"Getting page {parameters['page']}")
+            response = get(url, params=parameters)
+            journal.Append(key, response)
+
+        records.extend(response)
+        if len(response) != LIMIT:
             break
         parameters["page"] += 1
-        print(f"Getting page {parameters['page']}")
-        response = requests.get(url, headers=HEADERS, params=parameters).json()
-        df = pd.concat([df, pd.DataFrame(response)])
 
-    # sort by active_stake
+    # build the frame once and sort by active_stake
+    df = pd.DataFrame(records)
     df = df.sort_values(by="active_stake", ascending=False)
     return df
 
-def dns_lookup(hostname):
+def dns_lookup(hostnames: List[str]) -> Dict:
     """
-    Lookup DNS hostname
+    Lookup DNS hostnames concurrently, with cached answers
 
-    @param hostname: str - hostname
-    @return: str
+    @param hostnames: List[str] - hostnames
+    @return: Dict[str, str] - ip address of each hostname, None if it doesn't resolve
     """
-    if hostname is None:
-        return None
-    try:
-        result = socket.gethostbyname(hostname)
-        return result
-    except socket.gaierror:
-        return None
-
-def get_pool_relays(pool_id: str) -> pd.DataFrame:
+    return DnsResolver().Resolve(hostname for hostname in hostnames if isinstance(hostname, str))
+
+def get_pool_relays(pool_id: str) -> List[Dict]:
     """
     Get pool relays
     ref: https://docs.blockfrost.io/#tag/Cardano-Pools/paths/~1pools~1%7Bpool_id%7D~1relays/get
 
     @param pool_id: str - pool id
-    @return: pd.DataFrame
+    @return: List[Dict] - relays as returned by the API
     """
-    print(f"Getting relays for pool {pool_id}")
     url = f"{BASE_URL}/pools/{pool_id}/relays"
-    response = requests.get(url, headers=HEADERS).json()
-    df = pd.DataFrame(response)
-    
-    # rebuild empty dataframes to placeholder -> this allows to account for all stake
-    if df.empty:
-        df = pd.DataFrame(columns=["ipv4", "ipv6", "dns", "dns_srv", "port"])
-        df.loc[0] = [None, None, "Unidentified", None, pd.NA]
+    return get(url)
 
-    df["pool_id"] = pool_id
-    return df
-
-def get_pools_relays(pool_ids: List[str]) -> pd.DataFrame:
+def get_pools_relays(pool_ids: List[str], journal: Journal) -> pd.DataFrame:
     """
-    Get pools relays
+    Get pools relays concurrently, rate limited by the token bucket. Pools in the journal aren't fetched again.
 
     @param pool_ids: List[str] - list of pool ids
+    @param journal: Journal - checkpoint of the fetched relays
     @return: pd.DataFrame
     """
-    df = pd.DataFrame()
-    total = len(pool_ids)
-    count = 0
+    missing = [pool_id for pool_id in pool_ids if f"relays/{pool_id}" not in journal]
+    total = len(missing)
+    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        # NOTE: out of kindness for this team & their great free API, stay within the rate limit
+        futures = {executor.submit(get_pool_relays, pool_id): pool_id for pool_id in missing}
+
+        # journal every pool that succeeds, even if another one failed
+        for count, future in enumerate(as_completed(futures), start=1):
+            pool_id = futures[future]
+            if future.exception() is None:
+                print(f"Got relays for pool {pool_id} ({count}/{total})")
+                journal.Append(f"relays/{pool_id}", future.result())
+    failed = [pool_id for pool_id in missing if f"relays/{pool_id}" not in journal]
+    if failed:
+        raise RuntimeError(f"Failed to get the relays of {len(failed)} pools. Run again to resume")
+
+    records = []
     for pool_id in pool_ids:
-        count += 1
-        print(f"Getting relays for pool {pool_id} ({count}/{total})")
-        # NOTE: out of kindness for this team & their great free API, I won't go any faster
-        time.sleep(0.1)  
-        df = pd.concat([df, get_pool_relays(pool_id)])
-    df["dns_ip"] = df["dns"].apply(dns_lookup)
+        relays = journal.Get(f"relays/{pool_id}")
+
+        # rebuild empty responses to placeholder -> this allows to account for all stake
+        if not relays:
+            relays = [{"ipv4": None, "ipv6": None, "dns": "Unidentified", "dns_srv": None, "port": pd.NA}]
+        records.extend({**relay, "pool_id": pool_id} for relay in relays)
+
+    # single frame build (object dtype keeps the missing values as None), then resolve the unique hostnames concurrently
+    df = pd.DataFrame(records, dtype=object)
+    df["dns_ip"] = df["dns"].map(dns_lookup(df["dns"].unique().tolist()))
     return df
 
-def main() -> Dict:
+def main(journal: Journal) -> Dict:
 
     # Get pools & ids
-    pools = get_stake_pools()
+    pools = get_stake_pools(journal)
     pool_ids = pools["pool_id"].unique().tolist()
 
     # NOTE: trim list to speed up testing
     #pool_ids = pool_ids[:30]
 
     # use ids to get relays
-    pool_relays = get_pools_relays(pool_ids)
+    pool_relays = get_pools_relays(pool_ids, journal)
 
     # join pools and relays on pool_id
     pools_relays = pd.merge(pools, pool_relays, on="pool_id")
@@ -255,10 +333,13 @@ def main() -> Dict:
     return validators_dict
 
 if __name__ == "__main__":
-    validators_dict = main()
+    # pages and relays are journaled as they are fetched, so a failed run resumes where it stopped
+    journal = Journal("cardano")
+    validators_dict = main(journal)
 
-    # save to json
+    # save to json, then drop the journal
     today = datetime.today().strftime("%Y-%m-%d")
     with open(f'{OUTPUT_FOLDER}/cardano.json', 'w') as f:
         json.dump(validators_dict, f, indent=4)
+    journal.Finish()
     print(f"Done. Check {OUTPUT_FOLDER}")
@@ -1,11 +1,43 @@
 import json, os
 from datetime import date, datetime
 
+import numpy as np
+
 import config.globals
 from copy import deepcopy
 
+from analysis.history import RecordHistory
+from analysis.instrumentation import METRICS
+from analysis.metrics import DistributionMetrics, AttributedEntries, UNATTRIBUTED
+from analysis.writers import WriteTables, FlattenEntry
+
 from classes.dict_initial_values import providers_init, location_init, providers_init_flow, location_init_flow, flow_total_stake
 
+#Flow role tensor axes. Roles follow flow_total_stake, the count percentages are output in FLOW_COUNT_ORDER.
+FLOW_ROLES = list(flow_total_stake)
+FLOW_STATES = ["active", "total"]
+FLOW_COUNT_ORDER = ["execution", "collection", "consensus", "verification", "access"]
+
+#Series of the decentralization metrics. Flow adds a nodes and stake series per role.
+METRIC_SERIES = ["Nodes", "Stake"]
+FLOW_METRIC_SERIES = METRIC_SERIES + [f"{role.capitalize()} {series}" for role in FLOW_ROLES for series in METRIC_SERIES]
+
+def IntArray(values) -> np.ndarray:
+    """int64 array of values, or an object array of Python ints if they don't fit"""
+    try:
+        return np.array(values, dtype=np.int64)
+    except OverflowError:
+        return np.array(values, dtype=object)
+
+def PercentageOf(numerators: np.ndarray, denominators: np.ndarray) -> np.ndarray:
+    """Broadcasted numerators * 100 / denominators, 0 where the denominator is 0. Rounds the same as Python's int true division."""
+    numerators, denominators = np.broadcast_arrays(numerators, denominators)
+
+    #Float64 division is exact while the operands fit in its 53 bit mantissa
+    if numerators.dtype != object and denominators.dtype != object and int(np.abs(numerators).max(initial=0)) * 100 < 2**53 and int(np.abs(denominators).max(initial=0)) < 2**53:
+        return np.divide(numerators * 100, denominators, out=np.zeros(numerators.shape), where=denominators != 0)
+    return np.frompyfunc(lambda n, d: n * 100 / d if d else 0.0, 2, 1)(numerators, denominators)
+
 class Blockchain:
     def __init__(self, target):
         self.target = target
@@ -18,14 +50,26 @@ class Blockchain:
         self.unidentifiedLocations = {}
         self.info = {}
 
-        #Main Data Strucutre initializers
-        self.providersData = providers_init
-        self.continentData = location_init
+        #Nodes and stake per ASN and per datacenter (ASN, country code, city) for the decentralization metrics
+        self.asnShares = {}
+        self.datacenterShares = {}
+
+        #Main Data Strucutre initializers. Deep copies so blockchains analyzed in the same run don't share counters.
+        self.providersData = deepcopy(providers_init)
+        self.continentData = deepcopy(location_init)
 
         #Set object creation date and analysis date
         self.objectCreationDate = date.today().strftime("%m-%d-%Y")
         self.analysisDate = date.today().strftime("%m-%d-%Y") # will get overwritten by the timestamp in the JSON
 
+    def Entities(self) -> list:
+        """Provider, continent and country entries, in output order"""
+        entities = list(self.providersData.values()) + list(self.continentData.values())
+        for continent in self.continentData.values():
+            entities.extend(continent["Countries"].values())
+        return entities
+
+    @METRICS.Staged("percentages")
     def CalculatePercentages(self):
         print("\n\tCalculating Provider, Continent, and Country Percentages.", flush=True)
         for dic in [self.providersData, self.continentData]:
@@ -55,7 +99,56 @@ class Blockchain:
         
         print("\tDone.", flush=True)
 
-    def SaveProviderDistribution(self):
+    def MetricEntities(self) -> dict:
+        """Provider, continent and country entries of single entities, by metrics dimension"""
+        countries = [country for continent, entry in self.continentData.items() if continent not in UNATTRIBUTED for country in AttributedEntries(entry["Countries"])]
+        return {"Provider": AttributedEntries(self.providersData), "Country": countries, "Continent": AttributedEntries(self.continentData)}
+
+    @METRICS.Staged("percentages")
+    def DecentralizationMetrics(self) -> dict:
+        """Nakamoto coefficients, HHI, Gini and entropy of the nodes and stake per provider, ASN, country, continent and datacenter"""
+        distributions = {dimension: [[entry["Total Nodes"], entry["Total Stake"]] for entry in entries] for dimension, entries in self.MetricEntities().items()}
+        distributions["ASN"] = list(self.asnShares.values())
+        distributions["Datacenter"] = list(self.datacenterShares.values())
+        return DistributionMetrics(distributions, METRIC_SERIES)
+
+    def HistoryEntries(self, to_write: dict) -> dict:
+        """Entries of the written distribution for the history store, by dimension and key"""
+        return {
+            "network": {"total": {name: value for name, value in to_write.items() if name not in ["Provider Distribution", "Geographic Distribution", "Decentralization Metrics"]}},
+            "provider": self.providersData,
+            "continent": {continent: {name: value for name, value in entry.items() if name != "Countries"} for continent, entry in self.continentData.items()},
+            "country": {country: country_entry for continent, entry in self.continentData.items() if continent not in UNATTRIBUTED for country, country_entry in entry["Countries"].items()},
+            "metrics": to_write["Decentralization Metrics"]
+        }
+
+    def AggregateRows(self, to_write: dict) -> list:
+        """The written distribution as flat rows of the columnar output formats, one per dimension and key"""
+        continents = {country: continent for continent, entry in self.continentData.items() if continent not in UNATTRIBUTED for country in entry["Countries"]}
+        rows = []
+        for dimension, entries in self.HistoryEntries(to_write).items():
+            for key, entry in entries.items():
+                row = {"Dimension": dimension, "Key": key}
+                if dimension == "country":
+                    row["Continent"] = continents[key]
+                row.update(FlattenEntry(entry))
+                rows.append(row)
+        return rows
+
+    def WriteDistribution(self, path: str, to_write: dict, output_format: str):
+        """Writes the distribution as pretty JSON or as an aggregate table of the columnar format"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if output_format == "json":
+            with open(path, "w") as f:
+                json.dump(to_write, f, indent=4, default=str)
+                f.close()
+        else:
+            WriteTables(os.path.splitext(path)[0], output_format, self.AggregateRows(to_write))
+
+        #Append the run to the history store for trend queries
+        RecordHistory(self.target, self.HistoryEntries(to_write))
+
+    def SaveProviderDistribution(self, output_format: str = "json"):
         path = "{base}/{output}/{target}/network/NetworkDistribution_{time}.json".format(base=config.globals.BASE_DIR, output=config.globals.OUTPUT_FOLDER, target=self.target, time=str(datetime.today().strftime("%m-%d-%Y")))
         to_write = {
             'Analysis Date': self.analysisDate,
@@ -65,13 +158,11 @@ class Blockchain:
             'Total Validator Nodes': self.totalValidators,
             'Total Stake': self.totalStake,
             'Provider Distribution': self.providersData,
-            'Geographic Distribution': self.continentData
+            'Geographic Distribution': self.continentData,
+            'Decentralization Metrics': self.DecentralizationMetrics()
         }
 
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-        with open(path, "w") as f:
-            json.dump(to_write, f, indent=4, default=str)
-            f.close()
+        self.WriteDistribution(path, to_write, output_format)
 
 class Flow(Blockchain):
     def __init__(self, target, analysis_date):
@@ -88,8 +179,8 @@ class Flow(Blockchain):
         self.totalInactiveNodes = 0
     
         #Main Data Strucutres
-        self.providersData = providers_init_flow
-        self.continentData = location_init_flow
+        self.providersData = deepcopy(providers_init_flow)
+        self.continentData = deepcopy(location_init_flow)
 
     def ReturnNodeTypeQuantities(self, role):
         buff = {"execution": self.executionNodes,
@@ -99,147 +190,69 @@ class Flow(Blockchain):
         "access": self.accessNodes}
         return buff[role]
 
+    def RoleTensor(self, entities: list) -> np.ndarray:
+        """entity x role x (active, total) x (count, stake) tensor of the entries"""
+        return IntArray([[[[entity[f"{role.capitalize()} Nodes"][state], entity["Total Stake"][role][state]] for state in FLOW_STATES] for role in FLOW_ROLES] for entity in entities]).reshape(len(entities), len(FLOW_ROLES), 2, 2)
+
+    @staticmethod
+    def RoleEntry(values: list) -> dict:
+        """Builds an entry from one entity of the role tensor, as nested lists. Inverse of RoleTensor()."""
+        entry = {f"{role.capitalize()} Nodes": {state: values[r][s][0] for s, state in enumerate(FLOW_STATES)} for r, role in enumerate(FLOW_ROLES)}
+        entry["Total Stake"] = {role: {state: values[r][s][1] for s, state in enumerate(FLOW_STATES)} for r, role in enumerate(FLOW_ROLES)}
+        entry["Total Nodes"] = sum(values[r][1][0] for r in range(len(FLOW_ROLES)))
+        entry["Total Inactive Nodes"] = entry["Total Nodes"] - sum(values[r][0][0] for r in range(len(FLOW_ROLES)))
+        return entry
+
     #Overwrite percentages function
-    def CalculatePercentages(self):
-        self.CalculateProviderPercentages()
-        self.CalculateLocationPercentages()
+    @METRICS.Staged("percentages")
+    def CalculatePercentages(self, tensor: np.ndarray = None):
+        """Sets the role, stake and node percentages of every provider, continent and country with one broadcasted divide.
+        tensor is the role tensor of Entities(), built from the entries if not given."""
+        print("\tCalculating Provider, Continent, and Country Percentages.", flush=True)
+        entities = self.Entities()
+        if tensor is None:
+            tensor = self.RoleTensor(entities)
+
+        #Network denominators. Stake percentages are taken over the active stake of each role.
+        network = IntArray([[[self.ReturnNodeTypeQuantities(role)[state], self.totalStake[role]["active"]] for state in FLOW_STATES] for role in FLOW_ROLES])
+
+        #Append an all roles row with the node counts, it has no stake percentage
+        all_roles = np.zeros((len(entities), 1, 2, 2), dtype=tensor.dtype)
+        all_roles[:, 0, :, 0] = tensor[:, :, :, 0].sum(axis=1)
+        network_all_roles = IntArray([[[self.totalNodes - self.totalInactiveNodes, 0], [self.totalNodes, 0]]])
+        percentages = PercentageOf(np.concatenate([tensor, all_roles], axis=1), np.concatenate([network, network_all_roles])).tolist()
+
+        #Convert back to the output keys
+        all_roles_row = len(FLOW_ROLES)
+        for entity, values in zip(entities, percentages):
+            for role in FLOW_COUNT_ORDER:
+                entity[f"Percentage of Active {role.capitalize()} Nodes"] = values[FLOW_ROLES.index(role)][0][0]
+            for role in FLOW_COUNT_ORDER:
+                entity[f"Percentage of Total {role.capitalize()} Nodes"] = values[FLOW_ROLES.index(role)][1][0]
+            for r, role in enumerate(FLOW_ROLES):
+                entity[f"Percentage of Total {role.capitalize()} Stake"] = values[r][1][1]
+            entity["Percentage of Active Nodes"] = values[all_roles_row][0][0]
+            entity["Percentage of Total Nodes"] = values[all_roles_row][1][0]
+
         print("\tDone.", flush=True)
 
-    def CalculateProviderPercentages(self):
-        print("\tCalculating Provider Percentages.", flush=True)
-        for provider in self.providersData:
-            #Stake
-            execution_stake = self.providersData[provider]["Total Stake"]["execution"]["total"]
-            consensus_stake = self.providersData[provider]["Total Stake"]["consensus"]["total"]
-            collection_stake = self.providersData[provider]["Total Stake"]["collection"]["total"]
-            verification_stake = self.providersData[provider]["Total Stake"]["verification"]["total"]
-            access_stake = self.providersData[provider]["Total Stake"]["access"]["total"]
-
-            #Counts
-            execution = self.providersData[provider]["Execution Nodes"]
-            collection = self.providersData[provider]["Collection Nodes"]
-            consensus = self.providersData[provider]["Consensus Nodes"]
-            verification = self.providersData[provider]["Verification Nodes"]
-            access = self.providersData[provider]["Access Nodes"]
-            total = self.providersData[provider]["Total Nodes"]
-            active = total - self.providersData[provider]["Total Inactive Nodes"]
-
-            #Active
-            self.providersData[provider]["Percentage of Active Execution Nodes"] = execution["active"] * 100 / self.executionNodes["active"]
-            self.providersData[provider]["Percentage of Active Collection Nodes"] = collection["active"] * 100 / self.collectionNodes["active"]
-            self.providersData[provider]["Percentage of Active Consensus Nodes"] = consensus["active"] * 100 / self.consensusNodes["active"]
-            self.providersData[provider]["Percentage of Active Verification Nodes"] = verification["active"] * 100 / self.verificationNodes["active"]
-            self.providersData[provider]["Percentage of Active Access Nodes"] = access["active"] * 100 / self.accessNodes["active"]
-            
-            #Total
-            self.providersData[provider]["Percentage of Total Execution Nodes"] = execution["total"] * 100 / self.executionNodes["total"]
-            self.providersData[provider]["Percentage of Total Collection Nodes"] = collection["total"] * 100 / self.collectionNodes["total"]
-            self.providersData[provider]["Percentage of Total Consensus Nodes"] = consensus["total"] * 100 / self.consensusNodes["total"]
-            self.providersData[provider]["Percentage of Total Verification Nodes"] = verification["total"] * 100 / self.verificationNodes["total"]
-            self.providersData[provider]["Percentage of Total Access Nodes"] = access["total"] * 100 / self.accessNodes["total"]
-
-            #Stake percentages
-            self.providersData[provider]["Percentage of Total Execution Stake"] = execution_stake * 100 / self.totalStake["execution"]["active"]
-            self.providersData[provider]["Percentage of Total Consensus Stake"] = consensus_stake * 100 / self.totalStake["consensus"]["active"]
-            self.providersData[provider]["Percentage of Total Collection Stake"] = collection_stake * 100 / self.totalStake["collection"]["active"]
-            self.providersData[provider]["Percentage of Total Verification Stake"] = verification_stake * 100 / self.totalStake["verification"]["active"]
-            self.providersData[provider]["Percentage of Total Access Stake"] = access_stake * 100 / self.totalStake["access"]["active"]
-
-            #Other percentages
-            self.providersData[provider]["Percentage of Active Nodes"] = active * 100 / (self.totalNodes - self.totalInactiveNodes)
-            self.providersData[provider]["Percentage of Total Nodes"] = total * 100 / self.totalNodes
-
-    def CalculateLocationPercentages(self):
-        print("\tCalculating Country Percentages.", flush=True)
-        for continent in self.continentData:
-            #Stake
-            execution_stake_contintnet = self.continentData[continent]["Total Stake"]["execution"]["total"]
-            consensus_stake_contintnet = self.continentData[continent]["Total Stake"]["consensus"]["total"]
-            collection_stake_contintnet = self.continentData[continent]["Total Stake"]["collection"]["total"]
-            verification_stake_contintnet = self.continentData[continent]["Total Stake"]["verification"]["total"]
-            access_stake_contintnet = self.continentData[continent]["Total Stake"]["access"]["total"]
-            
-            #Counts
-            execution_contintnet = self.continentData[continent]["Execution Nodes"]
-            collection_contintnet = self.continentData[continent]["Collection Nodes"]
-            consensus_contintnet = self.continentData[continent]["Consensus Nodes"]
-            verification_contintnet = self.continentData[continent]["Verification Nodes"]
-            access_contintnet = self.continentData[continent]["Access Nodes"]
-            total_contintnet = self.continentData[continent]["Total Nodes"]
-            active_contintnet = total_contintnet - self.continentData[continent]["Total Inactive Nodes"]
-
-            #Active
-            self.continentData[continent]["Percentage of Active Execution Nodes"] = execution_contintnet["active"] * 100 / self.executionNodes["active"]
-            self.continentData[continent]["Percentage of Active Collection Nodes"] = collection_contintnet["active"] * 100 / self.collectionNodes["active"]
-            self.continentData[continent]["Percentage of Active Consensus Nodes"] = consensus_contintnet["active"] * 100 / self.consensusNodes["active"]
-            self.continentData[continent]["Percentage of Active Verification Nodes"] = verification_contintnet["active"] * 100 / self.verificationNodes["active"]
-            self.continentData[continent]["Percentage of Active Access Nodes"] = access_contintnet["active"] * 100 / self.accessNodes["active"]
-            
-            #Total
-            self.continentData[continent]["Percentage of Total Execution Nodes"] = execution_contintnet["total"] * 100 / self.executionNodes["total"]
-            self.continentData[continent]["Percentage of Total Collection Nodes"] = collection_contintnet["total"] * 100 / self.collectionNodes["total"]
-            self.continentData[continent]["Percentage of Total Consensus Nodes"] = consensus_contintnet["total"] * 100 / self.consensusNodes["total"]
-            self.continentData[continent]["Percentage of Total Verification Nodes"] = verification_contintnet["total"] * 100 / self.verificationNodes["total"]
-            self.continentData[continent]["Percentage of Total Access Nodes"] = access_contintnet["total"] * 100 / self.accessNodes["total"]
-
-            #Stake Percentages
-            self.continentData[continent]["Percentage of Total Execution Stake"] = execution_stake_contintnet * 100 / self.totalStake["execution"]["active"]
-            self.continentData[continent]["Percentage of Total Consensus Stake"] = consensus_stake_contintnet * 100 / self.totalStake["consensus"]["active"]
-            self.continentData[continent]["Percentage of Total Collection Stake"] = collection_stake_contintnet * 100 / self.totalStake["collection"]["active"]
-            self.continentData[continent]["Percentage of Total Verification Stake"] = verification_stake_contintnet * 100 / self.totalStake["verification"]["active"]
-            self.continentData[continent]["Percentage of Total Access Stake"] = access_stake_contintnet * 100 / self.totalStake["access"]["active"]
-
-            #Other percentages
-            self.continentData[continent]["Percentage of Active Nodes"] = active_contintnet * 100 / (self.totalNodes - self.totalInactiveNodes)
-            self.continentData[continent]["Percentage of Total Nodes"] = total_contintnet * 100 / self.totalNodes
-
-            #Countries
-            for country in self.continentData[continent]["Countries"]:
-                self.CalculateCountryPercentages(country, continent)
-
-    def CalculateCountryPercentages(self, country, continent):
-        #Stake
-        execution_stake_country = self.continentData[continent]["Countries"][country]["Total Stake"]["execution"]["total"]
-        consensus_stake_country = self.continentData[continent]["Countries"][country]["Total Stake"]["consensus"]["total"]
-        collection_stake_country = self.continentData[continent]["Countries"][country]["Total Stake"]["collection"]["total"]
-        verification_stake_country = self.continentData[continent]["Countries"][country]["Total Stake"]["verification"]["total"]
-        access_stake_country = self.continentData[continent]["Countries"][country]["Total Stake"]["access"]["total"]
-        
-        #Counts
-        execution_country = self.continentData[continent]["Countries"][country]["Execution Nodes"]
-        collection_country = self.continentData[continent]["Countries"][country]["Collection Nodes"]
-        consensus_country = self.continentData[continent]["Countries"][country]["Consensus Nodes"]
-        verification_country = self.continentData[continent]["Countries"][country]["Verification Nodes"]
-        access_country = self.continentData[continent]["Countries"][country]["Access Nodes"]
-        total_country = self.continentData[continent]["Countries"][country]["Total Nodes"]
-        active_country = total_country - self.continentData[continent]["Countries"][country]["Total Inactive Nodes"]
-
-        #Active
-        self.continentData[continent]["Countries"][country]["Percentage of Active Execution Nodes"] = execution_country["active"] * 100 / self.executionNodes["active"]
-        self.continentData[continent]["Countries"][country]["Percentage of Active Collection Nodes"] = collection_country["active"] * 100 / self.collectionNodes["active"]
-        self.continentData[continent]["Countries"][country]["Percentage of Active Consensus Nodes"] = consensus_country["active"] * 100 / self.consensusNodes["active"]
-        self.continentData[continent]["Countries"][country]["Percentage of Active Verification Nodes"] = verification_country["active"] * 100 / self.verificationNodes["active"]
-        self.continentData[continent]["Countries"][country]["Percentage of Active Access Nodes"] = access_country["active"] * 100 / self.accessNodes["active"]
-        
-        #Total
-        self.continentData[continent]["Countries"][country]["Percentage of Total Execution Nodes"] = execution_country["total"] * 100 / self.executionNodes["total"]
-        self.continentData[continent]["Countries"][country]["Percentage of Total Collection Nodes"] = collection_country["total"] * 100 / self.collectionNodes["total"]
-        self.continentData[continent]["Countries"][country]["Percentage of Total Consensus Nodes"] = consensus_country["total"] * 100 / self.consensusNodes["total"]
-        self.continentData[continent]["Countries"][country]["Percentage of Total Verification Nodes"] = verification_country["total"] * 100 / self.verificationNodes["total"]
-        self.continentData[continent]["Countries"][country]["Percentage of Total Access Nodes"] = access_country["total"] * 100 / self.accessNodes["total"]
-
-        #Stake percentages
-        self.continentData[continent]["Countries"][country]["Percentage of Total Execution Stake"] = execution_stake_country * 100 / self.totalStake["execution"]["active"]
-        self.continentData[continent]["Countries"][country]["Percentage of Total Consensus Stake"] = consensus_stake_country * 100 / self.totalStake["consensus"]["active"]
-        self.continentData[continent]["Countries"][country]["Percentage of Total Collection Stake"] = collection_stake_country * 100 / self.totalStake["collection"]["active"]
-        self.continentData[continent]["Countries"][country]["Percentage of Total Verification Stake"] = verification_stake_country * 100 / self.totalStake["verification"]["active"]
-        self.continentData[continent]["Countries"][country]["Percentage of Total Access Stake"] = access_stake_country * 100 / self.totalStake["access"]["active"]
-        
-        #Other percentages
-        self.continentData[continent]["Countries"][country]["Percentage of Active Nodes"] = active_country * 100 / (self.totalNodes - self.totalInactiveNodes)
-        self.continentData[continent]["Countries"][country]["Percentage of Total Nodes"] = total_country * 100 / self.totalNodes
+    @staticmethod
+    def MetricRows(shares) -> np.ndarray:
+        """Rows of FLOW_METRIC_SERIES from an entity x role x (count, stake) array of the total nodes and stake"""
+        shares = np.asarray(shares, dtype=np.float64).reshape(-1, len(FLOW_ROLES), 2)
+        return np.concatenate([shares.sum(axis=1), shares.reshape(len(shares), -1)], axis=1)
 
-    def SaveProviderDistribution(self):
+    #Overwrite metrics function
+    @METRICS.Staged("percentages")
+    def DecentralizationMetrics(self) -> dict:
+        """Nakamoto coefficients, HHI, Gini and entropy of the nodes and stake per provider, ASN, country, continent and datacenter,
+        overall and per role"""
+        distributions = {dimension: self.MetricRows(self.RoleTensor(entries)[:, :, 1, :]) for dimension, entries in self.MetricEntities().items()}
+        distributions["ASN"] = self.MetricRows(list(self.asnShares.values()))
+        distributions["Datacenter"] = self.MetricRows(list(self.datacenterShares.values()))
+        return DistributionMetrics(distributions, FLOW_METRIC_SERIES)
+
+    def SaveProviderDistribution(self, output_format: str = "json"):
         path = "{base}/{output}/{target}/network/ProviderDistribution_{time}.json".format(base=config.globals.BASE_DIR, output=config.globals.OUTPUT_FOLDER, target=self.target, time=str(datetime.today().strftime("%m-%d-%Y")))
         to_write = {
             'Analysis Date': self.analysisDate,
@@ -248,10 +261,8 @@ class Flow(Blockchain):
             'Total Active Nodes': (self.totalNodes - self.totalInactiveNodes),
             'Total Stake': self.totalStake,
             'Provider Distribution': self.providersData,
-            'Geographic Distribution': self.continentData
+            'Geographic Distribution': self.continentData,
+            'Decentralization Metrics': self.DecentralizationMetrics()
         }
 
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-        with open(path, "w") as f:
-            json.dump(to_write, f, indent=4, default=str)
-            f.close()
\ No newline at end of file
+        self.WriteDistribution(path, to_write, output_format)
\ No newline at end of file
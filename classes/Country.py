@@ -2,10 +2,13 @@ import json, os
 from datetime import date, datetime
 
 from classes.Blockchain import Blockchain
+from classes.NodeRecord import NodeRecord
 from classes.dict_initial_values import flow_total_stake
 from copy import deepcopy
 
 import config.globals
+from analysis.history import RecordHistory
+from analysis.writers import WriteTables, FlattenEntry, NODE_SCHEMA
 
 class Country:
     def __init__(self, country_name:str, code:str, target_chain:Blockchain):
@@ -21,28 +24,25 @@ class Country:
         self.validatorCount = 0
         self.nonValidatorNodeCount = 0
         self.cumulativeStake = deepcopy(flow_total_stake) if self.target_chain.target == "flow" else 0
-        self.nodeDict = {} #*{IP:{key, extra data}}
+        self.nodeRecords = {} #*{packed IP: NodeRecord}, references to the records built by the analysis
 
         #Historic Data
         self.objectCreationDate = date.today().strftime("%m-%d-%Y")
 
-    def SaveCountryNode(self, ip: str, node_info: dict, role=None):   
+    def SaveCountryNode(self, record: NodeRecord, role=None):   
         #Save only new ndoes
-        if ip not in self.nodeDict:
+        if record.packedIp not in self.nodeRecords:
 
             #Check if the IP is a validator
-            if node_info["is_validator"]:
+            if record.isValidator:
                 self.validatorCount += 1
-                if not node_info['stake']:
-                    stake = 0
-                else:
-                    stake = int(float(node_info['stake']))              
+                stake = record.ValidatorStake()
                 
                 #Catch Flow stake
                 if not role:       
                     self.cumulativeStake += stake
                 else:
-                    if node_info["extra_info"]["is_active"]:
+                    if record.extraInfo["is_active"]:
                         self.cumulativeStake[role]["active"] += stake
                     else:
                         self.cumulativeStake[role]["total"] += stake
@@ -50,17 +50,14 @@ class Country:
             #Non validator node
             else:
                 self.nonValidatorNodeCount += 1
-                stake = None
 
-            #Save data to object
-            self.nodeDict[ip] = {
-                "Address": node_info["address"],
-                "Is Validator": node_info["is_validator"],
-                "Stake": stake,
-                "Validator Info": node_info["extra_info"]
-            }
+            #Save a reference to the record
+            self.nodeRecords[record.packedIp] = record
+
+    def GetNodes(self) -> dict:
+        return {record.ip: record.NodeEntry() for record in self.nodeRecords.values()}
 
-    def OutputJSONInfo(self, blockchain_obj):
+    def OutputJSONInfo(self, blockchain_obj, output_format: str = "json"):
         path = "{base}/{output}/{target}/countries/{country}_Nodes_{time}.json".format(base=config.globals.BASE_DIR, output=config.globals.OUTPUT_FOLDER, target=self.target_chain.target, country=self.country, time=str(datetime.today().strftime("%m-%d-%Y")))
         #Catch for flow
         if blockchain_obj.target == "flow":
@@ -84,17 +81,26 @@ class Country:
         
         to_write = {
             'Analysis Date': blockchain_obj.analysisDate,
-            'Total Nodes': len(self.nodeDict),
+            'Total Nodes': len(self.nodeRecords),
             'Validator Nodes': self.validatorCount,
             'Non-Validator Nodes': self.nonValidatorNodeCount,
             'Monitoring since date': self.objectCreationDate,
             'Analysis Date': date.today().strftime("%m-%d-%Y"),
             'Cumulative stake': self.cumulativeStake,
             'Percentage of total stake': stake_percentage, 
-            'Nodes': self.nodeDict
+            'Nodes': self.GetNodes() if output_format == "json" else {}
         }
 
         os.makedirs(os.path.dirname(path), exist_ok=True)
-        with open(path, "w") as f:
-            json.dump(to_write, f, indent=4, default=str)
-            f.close()
\ No newline at end of file
+        if output_format == "json":
+            with open(path, "w") as f:
+                json.dump(to_write, f, indent=4, default=str)
+                f.close()
+
+        #Columnar formats write the country totals as a small table and stream the nodes as rows
+        else:
+            aggregates = [{"Dimension": "country", "Key": self.country, **FlattenEntry({name: value for name, value in to_write.items() if name != "Nodes"})}]
+            WriteTables(os.path.splitext(path)[0], output_format, aggregates, ({"IP": record.ip, **record.NodeEntry()} for record in self.nodeRecords.values()), NODE_SCHEMA)
+
+        #Append the totals to the history store for trend queries
+        RecordHistory(self.target_chain.target, {"tracked country": {self.country: {name: value for name, value in to_write.items() if name != "Nodes"}}})
\ No newline at end of file
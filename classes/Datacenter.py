@@ -1,8 +1,11 @@
 from classes.Provider import Provider
+from classes.NodeRecord import NodeRecord
 from classes.dict_initial_values import flow_total_stake
 from copy import deepcopy
 
 class Datacenter:
+    coordinateTolerance = 0.2 #*Max latitude and longitude difference between nodes of the same datacenter
+
     def __init__(self, country_name:str, country_code:str, city:str, region:str, latitude:float, longitude:float, provider:Provider):
         #Info
         self.country_name = country_name
@@ -17,7 +20,7 @@ class Datacenter:
         self.validatorCount = 0
         self.nonValidatorNodeCount = 0
         self.cumulativeStake = deepcopy(flow_total_stake) if provider.target_chain.target == "flow" else 0
-        self.nodeDict = {} #*{IP:{key, extra data}}
+        self.nodeRecords = {} #*{packed IP: NodeRecord}, references to the records built by the analysis
         
     def __eq__(self, other):
             if not isinstance(other, Datacenter):
@@ -25,27 +28,24 @@ class Datacenter:
                 exit(1)
             
             #It is the same datacenter if all properties are the same and there is less than 0.2 distance from each other in latitude and longitude
-            if self.city == other.city and self.provider.provider == other.provider.provider and self.country_name == other.country_name and abs(self.latitude - other.latitude) < 0.2 and abs(self.longitude - other.longitude) < 0.2:
+            if self.city == other.city and self.provider.provider == other.provider.provider and self.country_name == other.country_name and abs(self.latitude - other.latitude) < self.coordinateTolerance and abs(self.longitude - other.longitude) < self.coordinateTolerance:
                 return True
             return False
     
-    def SaveDatacenterNode(self, ip: str, node_info: dict, role=None):   
+    def SaveDatacenterNode(self, record: NodeRecord, role=None):   
         #Save only new ndoes
-        if ip not in self.nodeDict:
+        if record.packedIp not in self.nodeRecords:
 
             #Check if the IP is a validator
-            if node_info["is_validator"]:
+            if record.isValidator:
                 self.validatorCount += 1
-                if not node_info['stake']:
-                    stake = 0
-                else:
-                    stake = int(float(node_info['stake']))              
+                stake = record.ValidatorStake()
                 
                 #Catch Flow stake
                 if not role:       
                     self.cumulativeStake += stake
                 else:
-                    if node_info["extra_info"]["is_active"]:
+                    if record.extraInfo["is_active"]:
                         self.cumulativeStake[role]["active"] += stake
                     else:
                         self.cumulativeStake[role]["total"] += stake
@@ -53,32 +53,37 @@ class Datacenter:
             #Non validator node
             else:
                 self.nonValidatorNodeCount += 1
-                stake = None
 
-            #Save data to object
-            self.nodeDict[ip] = {
-                "Address": node_info["address"],
-                "Is Validator": node_info["is_validator"],
-                "Stake": stake,
-                "Validator Info": node_info["extra_info"]
-            }
+            #Save a reference to the record
+            self.nodeRecords[record.packedIp] = record
 
-    def GetDatacenterData(self, provider_total_stake):
+    def GetNodes(self) -> dict:
+        return {record.ip: record.NodeEntry() for record in self.nodeRecords.values()}
+
+    def NodeRows(self, datacenter_id: int):
+        """Yields the nodes as flat rows of the columnar output formats, tagged with the datacenter's position in its provider"""
+        for record in self.nodeRecords.values():
+            yield {"Datacenter": datacenter_id, "IP": record.ip, **record.NodeEntry()}
+
+    def GetDatacenterData(self, provider_total_stake, nodes: bool = True):
+        """The datacenter as written to the provider output files. The columnar formats write the nodes as rows, without nodes."""
         stake_percentage = 0 if provider_total_stake == 0 else (self.cumulativeStake * 100) / provider_total_stake
-        return {
+        data = {
             "Country": self.country_name,
             "City": self.city,
             "Region": self.region,
             "Coordinates": f"{self.latitude}, {self.longitude}",
-            'Total Nodes': len(self.nodeDict),
+            'Total Nodes': len(self.nodeRecords),
             'Validator Nodes': self.validatorCount,
             'Non-Validator Nodes': self.nonValidatorNodeCount,
             'Cumulative stake': self.cumulativeStake,
-            'Percentage of provider stake': stake_percentage,
-            "Nodes": self.nodeDict
+            'Percentage of provider stake': stake_percentage
         }
+        if nodes:
+            data["Nodes"] = self.GetNodes()
+        return data
 
-    def GetFlowDatacenterData(self, provider_total_stake_dict:dict):
+    def GetFlowDatacenterData(self, provider_total_stake_dict:dict, nodes: bool = True):
         execution = 0 if provider_total_stake_dict["execution"]["total"] == 0 else (self.cumulativeStake["execution"]["total"] * 100) / provider_total_stake_dict["execution"]["total"]
         consensus = 0 if provider_total_stake_dict["consensus"]["total"] == 0 else (self.cumulativeStake["consensus"]["total"] * 100) / provider_total_stake_dict["consensus"]["total"]
         collection = 0 if provider_total_stake_dict["collection"]["total"] == 0 else (self.cumulativeStake["collection"]["total"] * 100) / provider_total_stake_dict["collection"]["total"]
@@ -93,15 +98,17 @@ class Datacenter:
             "access": access
             }
         
-        return {
+        data = {
             "Country": self.country_name,
             "City": self.city,
             "Region": self.region,
             "Coordinates": f"{self.latitude}, {self.longitude}",
-            'Total Nodes': len(self.nodeDict),
+            'Total Nodes': len(self.nodeRecords),
             'Validator Nodes': self.validatorCount,
             'Non-Validator Nodes': self.nonValidatorNodeCount,
             'Cumulative stake': self.cumulativeStake,
-            'Percentage of provider Total stake': stake_percentages,
-            "Nodes": self.nodeDict
-        }
\ No newline at end of file
+            'Percentage of provider Total stake': stake_percentages
+        }
+        if nodes:
+            data["Nodes"] = self.GetNodes()
+        return data
\ No newline at end of file
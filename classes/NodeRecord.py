@@ -0,0 +1,52 @@
+import ipaddress, sys
+
+IPV6_TAG = 1 << 128 #*Added to packed IPv6 addresses so they never collide with IPv4 ones
+
+## IP packing ##
+def PackIp(ip: str):
+    """Returns the IP as an int, IPv6 tagged with IPV6_TAG. Strings that don't round-trip exactly, like invalid
+    or non-canonical addresses, are kept as interned strings so the output keys don't change."""
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return sys.intern(ip)
+    if str(address) != ip:
+        return sys.intern(ip)
+    return int(address) + IPV6_TAG if address.version == 6 else int(address)
+
+def UnpackIp(packed) -> str:
+    if isinstance(packed, str):
+        return packed
+    return str(ipaddress.IPv6Address(packed - IPV6_TAG) if packed >= IPV6_TAG else ipaddress.IPv4Address(packed))
+
+## Compact node record ##
+class NodeRecord:
+    """A node of the IP address JSON file, with the IP packed into an int. The analysis builds one record per node and
+    the Country, Datacenter and Blockchain objects hold references to it instead of their own copies of node_info."""
+    __slots__ = ("packedIp", "address", "isValidator", "stake", "extraInfo")
+
+    def __init__(self, ip: str, node_info: dict):
+        self.packedIp = PackIp(ip)
+        self.address = sys.intern(node_info["address"]) if isinstance(node_info["address"], str) else node_info["address"]
+        self.isValidator = node_info["is_validator"]
+        self.stake = node_info["stake"]
+        self.extraInfo = node_info["extra_info"]
+
+    @property
+    def ip(self) -> str:
+        return UnpackIp(self.packedIp)
+
+    def ValidatorStake(self):
+        """Stake as counted by the tracked providers and countries, None for non-validator nodes"""
+        if not self.isValidator:
+            return None
+        return 0 if not self.stake else int(float(self.stake))
+
+    def NodeEntry(self) -> dict:
+        """The node as written to the provider and country output files"""
+        return {
+            "Address": self.address,
+            "Is Validator": self.isValidator,
+            "Stake": self.ValidatorStake(),
+            "Validator Info": self.extraInfo
+        }
@@ -1,8 +1,11 @@
-import json, os
+import json, math, os
 from datetime import date, datetime
 
 import config.globals
+from analysis.history import RecordHistory
+from analysis.writers import WriteTables, FlattenEntry, DATACENTER_NODE_SCHEMA
 from classes.Blockchain import Blockchain
+from classes.NodeRecord import NodeRecord
 from classes.dict_initial_values import flow_total_stake
 from copy import deepcopy
 
@@ -19,28 +22,26 @@ class Provider:
         self.validatorCount = 0
         self.nonValidatorNodeCount = 0
         self.cumulativeStake = deepcopy(flow_total_stake) if self.target_chain.target == "flow" else 0
-        self.seenIPs = set()
+        self.seenIPs = set() #*packed IPs
         self.datacenters = []
+        self.datacenterIndex = {} #*(country, city, latitude cell, longitude cell) -> [positions in self.datacenters]
 
         #Historic Data
         self.objectCreationDate = date.today().strftime("%m-%d-%Y")
     
-    def UpdateTotals(self, ip: str, node_info: dict, role=None):   
+    def UpdateTotals(self, record: NodeRecord, role=None):   
         #Save only new ndoes
-        if ip not in self.seenIPs:
+        if record.packedIp not in self.seenIPs:
             #Check if the IP is a validator
-            if node_info["is_validator"]:
+            if record.isValidator:
                 self.validatorCount += 1
-                if not node_info['stake']:
-                    stake = 0
-                else:
-                    stake = int(float(node_info['stake']))
+                stake = record.ValidatorStake()
 
                 #Catch Flow stake
                 if not role:       
                     self.cumulativeStake += stake
                 else:
-                    if node_info["extra_info"]["is_active"]:
+                    if record.extraInfo["is_active"]:
                         self.cumulativeStake[role]["active"] += stake
                     else:
                         self.cumulativeStake[role]["total"] += stake
@@ -48,12 +49,31 @@ class Provider:
             #Non validator node
             else:
                 self.nonValidatorNodeCount += 1
-                stake = None
 
-            #Save ip to set
-            self.seenIPs.add(ip)
+            #Save packed ip to set
+            self.seenIPs.add(record.packedIp)
+
+    def GetDatacenter(self, datacenter_obj):
+        """Returns the first tracked datacenter equal to datacenter_obj, or adds datacenter_obj if there is none."""
+        #Cells are as wide as the coordinate tolerance, so equal datacenters are at most one cell apart
+        tolerance = datacenter_obj.coordinateTolerance
+        lat_cell, long_cell = math.floor(datacenter_obj.latitude / tolerance), math.floor(datacenter_obj.longitude / tolerance)
+
+        #Keep the lowest position to match the first hit of a linear scan
+        match = None
+        for d_lat in (-1, 0, 1):
+            for d_long in (-1, 0, 1):
+                for i in self.datacenterIndex.get((datacenter_obj.country_name, datacenter_obj.city, lat_cell + d_lat, long_cell + d_long), []):
+                    if (match is None or i < match) and self.datacenters[i] == datacenter_obj:
+                        match = i
+        if match is not None:
+            return self.datacenters[match]
+
+        self.datacenterIndex.setdefault((datacenter_obj.country_name, datacenter_obj.city, lat_cell, long_cell), []).append(len(self.datacenters))
+        self.datacenters.append(datacenter_obj)
+        return datacenter_obj
 
-    def OutputJSONInfo(self, blockchain_obj):
+    def OutputJSONInfo(self, blockchain_obj, output_format: str = "json"):
         path = "{base}/{output}/{target}/providers/{provider}_Nodes_{time}.json".format(base=config.globals.BASE_DIR, output=config.globals.OUTPUT_FOLDER, target=self.target_chain.target, provider=self.provider, time=str(datetime.today().strftime("%m-%d-%Y")))
         #Catch for flow
         if blockchain_obj.target == "flow":
@@ -84,27 +104,37 @@ class Provider:
             'Cumulative stake': self.cumulativeStake,
             'Percentage of total stake': stake_percentage, 
             'Number of datacenters': len(self.datacenters),
-            'Datacenters': self.GetDataCenterNodes(self.cumulativeStake)
+            'Datacenters': self.GetDataCenterNodes(self.cumulativeStake, nodes=output_format == "json")
         }
 
         os.makedirs(os.path.dirname(path), exist_ok=True)
-        with open(path, "w") as f:
-            json.dump(to_write, f, indent=4, default=str)
-            f.close()
+        if output_format == "json":
+            with open(path, "w") as f:
+                json.dump(to_write, f, indent=4, default=str)
+                f.close()
+
+        #Columnar formats write the provider and its datacenters as a small table and stream the nodes as rows
+        else:
+            aggregates = [{"Dimension": "provider", "Key": self.provider, **FlattenEntry({name: value for name, value in to_write.items() if name != "Datacenters"})}]
+            aggregates.extend({"Dimension": "datacenter", "Key": str(i), **FlattenEntry(datacenter)} for i, datacenter in enumerate(to_write["Datacenters"]))
+            WriteTables(os.path.splitext(path)[0], output_format, aggregates, (row for i, datacenter in enumerate(self.datacenters) for row in datacenter.NodeRows(i)), DATACENTER_NODE_SCHEMA)
+
+        #Append the totals to the history store for trend queries
+        RecordHistory(self.target_chain.target, {"tracked provider": {self.provider: {name: value for name, value in to_write.items() if name != "Datacenters"}}})
 
     def GetTotalNodes(self):
         total = 0
         for datacenter in self.datacenters:
-            total += len(datacenter.nodeDict)
+            total += len(datacenter.nodeRecords)
         return total
 
-    def GetDataCenterNodes(self, provider_total_stake):
+    def GetDataCenterNodes(self, provider_total_stake, nodes: bool = True):
         results = []
         if self.target_chain.target == "flow":
             for datacenter in self.datacenters:
-                results.append(datacenter.GetFlowDatacenterData(provider_total_stake))
+                results.append(datacenter.GetFlowDatacenterData(provider_total_stake, nodes))
         else:
             for datacenter in self.datacenters:
-                results.append(datacenter.GetDatacenterData(provider_total_stake))
+                results.append(datacenter.GetDatacenterData(provider_total_stake, nodes))
         return results
 
@@ -0,0 +1,37 @@
+import re
+
+def NormalizeAsn(asn):
+    """Returns the ASN as the string key used in ProviderConfig.json, whatever type the lookup returned.
+    Ints become strings, an "AS" prefix is dropped and multi-origin ASNs keep a single space between numbers."""
+    if asn is None:
+        return None
+    return re.sub(r"(?i)\bAS(?=\d)", "", " ".join(str(asn).split()))
+
+## Provider registry ##
+class ProviderRegistry:
+    """Built once at startup from config/ProviderConfig.json. Providers get dense ids in config order, so the
+    per-node classification is a single lookup of the normalized ASN in a table built by Table()."""
+    def __init__(self, provider_lookup: dict):
+        self.providerNames = [] #*provider id -> provider name
+        self.providerIds = {} #*provider name -> provider id
+        self.asnIds = {} #*normalized ASN -> provider id
+        for asn, provider in provider_lookup.items():
+            name = provider["provider"]
+            if name not in self.providerIds:
+                self.providerIds[name] = len(self.providerNames)
+                self.providerNames.append(name)
+            self.asnIds[NormalizeAsn(asn)] = self.providerIds[name]
+
+    def ProviderName(self, asn):
+        """Returns the provider name of the ASN, None if it isn't in the config"""
+        provider_id = self.asnIds.get(NormalizeAsn(asn))
+        return None if provider_id is None else self.providerNames[provider_id]
+
+    def Table(self, providers_short_to_object_map: dict = None) -> dict:
+        """Returns {normalized ASN: (provider name, tracked provider object or None)} for the tracked provider objects of a run"""
+        tracked = [None] * len(self.providerNames) #*provider id -> tracked provider object
+        for provider_obj in (providers_short_to_object_map or {}).values():
+            provider_id = self.providerIds.get(provider_obj.provider)
+            if provider_id is not None and tracked[provider_id] is None:
+                tracked[provider_id] = provider_obj
+        return {asn: (self.providerNames[provider_id], tracked[provider_id]) for asn, provider_id in self.asnIds.items()}
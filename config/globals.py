@@ -1,6 +1,8 @@
 import os, json, IP2Location
 import __main__
 
+from classes.ProviderRegistry import ProviderRegistry
+
 def LoadFromConfig():
     #Set the provider ASN lookup from the provider config file
     with open(f"{CONFIG_PATH}/ProviderConfig.json", "r") as f:
@@ -12,10 +14,12 @@ def LoadFromConfig():
         country = json.load(f)
         f.close()
 
-    #Set the ipinfo API token
-    with open(f"{CONFIG_PATH}/keys.json", "r") as f:
-        token = json.load(f)["ipinfo"]
-        f.close()
+    #Set the ipinfo API token. Not needed when running with the local lookup backend.
+    token = None
+    if os.path.isfile(f"{CONFIG_PATH}/keys.json"):
+        with open(f"{CONFIG_PATH}/keys.json", "r") as f:
+            token = json.load(f)["ipinfo"]
+            f.close()
 
     return provider, country, token
 
@@ -23,4 +27,37 @@ def LoadFromConfig():
 BASE_DIR = os.path.dirname(os.path.realpath(__main__.__file__))
 CONFIG_PATH = BASE_DIR + "/config/"
 OUTPUT_FOLDER = "results/"
-PROVIDER_ASN_LOOKUP, COUNTRY_NAME_LOOKUP, IPINFO_TOKEN = LoadFromConfig()
\ No newline at end of file
+MEMORY_FOLDER = BASE_DIR + "/memory/"
+
+# Lookup backend settings. The local backend reads MaxMind-format (MMDB) ASN and City databases.
+LOOKUP_BACKEND = "remote"
+LOCAL_ASN_DB = BASE_DIR + "/databases/GeoLite2-ASN.mmdb"
+LOCAL_CITY_DB = BASE_DIR + "/databases/GeoLite2-City.mmdb"
+SYNTHETIC_LATENCY = 0.0 #*seconds each lookup of the synthetic benchmark backend takes
+
+# Remote geo lookup settings. The API URL can point to a local stand-in server that mirrors the ipinfo API.
+IPINFO_API_URL = "https://ipinfo.io"
+GEO_BATCH_SIZE = 1000
+GEO_BATCH_TIMEOUT = 10
+
+# IP enrichment cache settings. TTLs are in seconds per cached field.
+CACHE_PATH = MEMORY_FOLDER + "ip_cache.sqlite"
+CACHE_TTL = {"asn": 30 * 24 * 3600, "geo": 7 * 24 * 3600}
+CACHE_MAX_ENTRIES = 500000
+
+# Run logging. debug also prints every successful lookup, see analysis/instrumentation.py for the run reports.
+LOG_LEVEL = "info"
+
+# Time series of the distributions of every run, queried with analysis.history.HistoryStore
+HISTORY_PATH = MEMORY_FOLDER + "history.sqlite"
+
+# Concurrent enrichment settings. Rate limits are in requests per second per lookup provider.
+ENRICHMENT_WORKERS = 8
+ENRICHMENT_CHUNK_SIZE = 5000 #*nodes streamed from the JSON file and resolved per batch
+RATE_LIMITS = {"asn": 20, "geo": 20}
+
+# Aggregation engine. "columnar" computes the distributions with grouped NumPy reductions, "dict" is the per-node reference implementation.
+AGGREGATION_ENGINE = "columnar"
+
+PROVIDER_ASN_LOOKUP, COUNTRY_NAME_LOOKUP, IPINFO_TOKEN = LoadFromConfig()
+PROVIDER_REGISTRY = ProviderRegistry(PROVIDER_ASN_LOOKUP)
\ No newline at end of file
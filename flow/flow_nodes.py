@@ -1,12 +1,28 @@
 import base64
 import json
-import re
-import subprocess
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
 import pandas as pd
 import requests
 
+#Shared utilities live at the root of the repo
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from utilities.journal import Journal
+from utilities.resolver import DnsResolver
+
+#Node info collection settings, overridden by the "collector" key of config/FlowConfig.json
+COLLECTOR_DEFAULTS = {
+    "scripts_url": "https://rest-mainnet.onflow.org/v1/scripts",
+    "batch_size": 100,
+    "workers": 4,
+    "retries": 3,
+    "backoff": 1.0,
+}
+
 
 def string_to_base64(string: str):
     """Converts a string to base64"""
@@ -23,18 +39,34 @@ def base64_to_string(res: str):
     return json.loads(res)
 
 
-def run_script_flow(payload):
-    """Runs a script on the flow blockchain"""
-    url = "https://rest-mainnet.onflow.org/v1/scripts"
-    res = requests.post(url, json=payload)
-    if res.status_code == 200:
-        res = res.json()
-        return res
-    print(res)
-    raise
+def make_session(settings: dict):
+    """Returns a session that keeps up to one connection per worker open to the scripts endpoint"""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=settings["workers"])
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
 
+def run_script_flow(payload, session=None, settings: dict = COLLECTOR_DEFAULTS):
+    """Runs a script on the flow blockchain, retrying failed requests with exponential backoff"""
+    session = session or requests
+    for attempt in range(settings["retries"] + 1):
+        try:
+            res = session.post(settings["scripts_url"], json=payload, timeout=60)
+            if res.status_code == 200:
+                return res.json()
+            error = res
+        except requests.exceptions.RequestException as e:
+            error = e
 
-def get_id_nodes():
+        if attempt < settings["retries"]:
+            time.sleep(settings["backoff"] * 2**attempt)
+    print(error)
+    raise RuntimeError(f"Flow script request failed after {settings['retries'] + 1} attempts")
+
+
+def get_id_nodes(session=None, settings: dict = COLLECTOR_DEFAULTS):
     """Returns a list of all the node ids"""
     script = """import FlowIDTableStaking from 0x8624b52f9ddcd04a
 
@@ -51,42 +83,67 @@ def get_id_nodes():
         "script": script_message,
     }
 
-    if response := run_script_flow(payload):
+    if response := run_script_flow(payload, session, settings):
         return base64_to_string(response)
 
 
-def get_node_info(node: dict):
-    """Returns a dictionary with all the info about a node"""
+def get_nodes_info(nodes: list, session=None, settings: dict = COLLECTOR_DEFAULTS):
+    """Returns the info of a slice of nodes in a single script execution, in the order of the slice"""
     script = """import FlowIDTableStaking from 0x8624b52f9ddcd04a
 
-    // This script gets all the info about a node and returns it
-
-    pub fun main(nodeID: String): FlowIDTableStaking.NodeInfo {
+    // This script gets all the info about a list of nodes and returns it
 
-        return FlowIDTableStaking.NodeInfo(nodeID: nodeID)
+    pub fun main(nodeIDs: [String]): [FlowIDTableStaking.NodeInfo] {
+        let infos: [FlowIDTableStaking.NodeInfo] = []
+        for nodeID in nodeIDs {
+            infos.append(FlowIDTableStaking.NodeInfo(nodeID: nodeID))
+        }
+        return infos
     }
     """
 
-    dumped_node = json.dumps(node)
+    #The slice holds the JSON-Cadence String values returned by get_id_nodes
+    dumped_nodes = json.dumps({"type": "Array", "value": nodes})
 
     script_message = string_to_base64(script)
-    arguments_message = string_to_base64(dumped_node)
+    arguments_message = string_to_base64(dumped_nodes)
 
     payload = {
         "script": script_message,
         "arguments": [arguments_message],
     }
 
-    if response := run_script_flow(payload):
-        return base64_to_string(response)
+    if response := run_script_flow(payload, session, settings):
+        return [info["value"]["fields"] for info in base64_to_string(response)["value"]]
+
+
+def collect_nodes_info(nodes: list, journal: Journal, settings: dict = COLLECTOR_DEFAULTS):
+    """Returns the info fields of all the nodes. The nodes are sent in slices of batch_size,
+    with up to workers slices in flight over a shared session. Slices in the journal aren't fetched again."""
+    slices = [nodes[i:i + settings["batch_size"]] for i in range(0, len(nodes), settings["batch_size"])]
+    keys = [f"nodes/{nodes_slice[0]['value']}/{len(nodes_slice)}" for nodes_slice in slices]
+    missing = [(key, nodes_slice) for key, nodes_slice in zip(keys, slices) if key not in journal]
+    session = make_session(settings)
+
+    with ThreadPoolExecutor(max_workers=settings["workers"]) as executor:
+        futures = {executor.submit(get_nodes_info, nodes_slice, session, settings): key for key, nodes_slice in missing}
 
+        #Journal every slice that succeeds, even if another one failed
+        for count, future in enumerate(as_completed(futures), start=1):
+            if future.exception() is None:
+                journal.Append(futures[future], future.result())
+                print(f"\tGot slice {count}/{len(missing)}")
 
-def get_ip_address(address: str):
-    """Returns the ip address of a node"""
-    ping = subprocess.getoutput(f"ping -c 1 {address} ")
-    id_pattern = r"\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}"
-    address = m.group() if (m := re.search(id_pattern, ping)) is not None else "Unknown"
-    return address
+    if not all(key in journal for key in keys):
+        raise RuntimeError("Failed to get the info of some nodes. Run again to resume")
+    return [fields for key in keys for fields in journal.Get(key)]
+
+
+def get_ip_addresses(addresses: list):
+    """Returns {networking address: ip address} for a list of host:port networking addresses"""
+    hostnames = {address: address.rpartition(":")[0] or address for address in addresses}
+    resolved = DnsResolver().Resolve(hostnames.values())
+    return {address: resolved[hostname] or "Unknown" for address, hostname in hostnames.items()}
 
 
 def group_to_dict(group):
@@ -116,15 +173,23 @@ def group_to_dict(group):
 
 ## Main ##
 def main():
-    id_node_raw = get_id_nodes()
+    #Get role settings (key and minimums) and collector settings from config file
+    with open("config/FlowConfig.json", "r") as f:
+        roles_settings = json.load(f)
+        f.close()
+    settings = {**COLLECTOR_DEFAULTS, **roles_settings.get("collector", {})}
+
+    #Fetched results are journaled, so a failed run resumes where it stopped
+    journal = Journal("flow")
+    if "ids" not in journal:
+        journal.Append("ids", get_id_nodes(settings=settings))
+    id_node_raw = journal.Get("ids")
     id_node_list = id_node_raw["value"]
 
     nodes = []
 
     print(f"Analyzing {len(id_node_list)} nodes...")
-    for _ in id_node_list:
-        nodes_fields = get_node_info(_)["value"]["fields"]
-
+    for nodes_fields in collect_nodes_info(id_node_list, journal, settings):
         nodes_data = {
             "id": nodes_fields[0]["value"]["value"],
             "role": nodes_fields[1]["value"]["value"],
@@ -146,18 +211,12 @@ def main():
 
     print("\tDone.")
 
-    #Get role settings (key and minimums) from config file
-    with open("config/FlowConfig.json", "r") as f:
-        roles_settings = json.load(f)
-        f.close()
-
     nodes_df = pd.DataFrame(nodes)
 
     print("\nTransforming dataframe result. This may take several minutes...")
     nodes_df["role"] = nodes_df["role"].apply(lambda x: roles_settings["role_map"][x])
-    nodes_df["ip_address"] = nodes_df["networkingAddress"].apply(
-        lambda x: get_ip_address(x.split(":")[0])
-    )
+    ip_addresses = get_ip_addresses(nodes_df["networkingAddress"].unique().tolist())
+    nodes_df["ip_address"] = nodes_df["networkingAddress"].map(ip_addresses)
 
     print("\tDone.")
     result = nodes_df.groupby("ip_address").apply(group_to_dict).tolist()
@@ -190,6 +249,7 @@ def main():
     with open(f"{output_folder}/flow.json", "w") as f:
         json.dump(dict_result, f, indent=4, ensure_ascii=False)
         f.close()
+    journal.Finish()
 
 
 if __name__ == "__main__":
@@ -17,12 +17,33 @@ import sys
 from classes.obj_constructor import MakeCountryObjects, MakeProviderObjects, MakeTargetBlockchainObject
 from utilities.usage import PrintCountryCompletion, PrintProviderCompletion, PrintUsage
 from utilities.setup import GetArguments
-from analysis.analysis import GetNetworkProviderDistribution
+from analysis.analysis import GetNetworkProviderDistribution, ResolveBlockchainsIps
+from analysis.instrumentation import METRICS, Profile
 
 ## Main ##
-def main(target_blockchain, providers_to_track, countries_to_track, output):
+def main(target_blockchains, providers_to_track, countries_to_track, output, workers, backend, incremental, output_format, profile=False, prometheus=False):
     print("\n-----RUNTIME-----")
-    
+    METRICS.Reset()
+    if profile:
+        Profile(AnalyzeBlockchains, target_blockchains, providers_to_track, countries_to_track, output, workers, backend, incremental, output_format)
+    else:
+        AnalyzeBlockchains(target_blockchains, providers_to_track, countries_to_track, output, workers, backend, incremental, output_format)
+
+    #Stage timings, lookup latencies and cache hits of the run
+    path = METRICS.SaveReport(prometheus)
+    print("\nRun report saved to %s" % path)
+
+def AnalyzeBlockchains(target_blockchains, providers_to_track, countries_to_track, output, workers, backend, incremental, output_format):
+    #Resolve the IPs of all target blockchains once, shared IPs are only looked up a single time
+    enriched = None
+    if len(target_blockchains) > 1:
+        enriched = ResolveBlockchainsIps(target_blockchains, workers, backend)
+
+    #Aggregate each blockchain on its own objects
+    for target_blockchain in target_blockchains:
+        AnalyzeBlockchain(target_blockchain, providers_to_track, countries_to_track, output, workers, backend, enriched, incremental, output_format)
+
+def AnalyzeBlockchain(target_blockchain, providers_to_track, countries_to_track, output, workers, backend, enriched=None, incremental=False, output_format="json"):
     #Make target blockchain and provider objects if providers_to_track not empty
     blockchain_obj = MakeTargetBlockchainObject(target_blockchain)
     providers_short_to_object_map = {}
@@ -33,15 +54,16 @@ def main(target_blockchain, providers_to_track, countries_to_track, output):
         countries_short_to_object_map = MakeCountryObjects(countries_to_track, blockchain_obj)
 
     #Analyze all nodes for provided blockchain (overwrites if flow)
-    blockchain_obj = GetNetworkProviderDistribution(providers_to_track, countries_to_track, providers_short_to_object_map, countries_short_to_object_map, blockchain_obj)
-
-    #Output JSON for trackable providers and countries
-    print("\n\nOutputting information to JSON files...")
-    for obj in providers_short_to_object_map.values():
-        obj.OutputJSONInfo(blockchain_obj)
-    for obj in countries_short_to_object_map.values():
-        obj.OutputJSONInfo(blockchain_obj)
-    blockchain_obj.SaveProviderDistribution()
+    blockchain_obj = GetNetworkProviderDistribution(providers_to_track, countries_to_track, providers_short_to_object_map, countries_short_to_object_map, blockchain_obj, workers, backend, enriched, incremental)
+
+    #Output files for trackable providers and countries
+    print("\n\nOutputting information to %s files..." % output_format.upper())
+    with METRICS.Stage("output"):
+        for obj in providers_short_to_object_map.values():
+            obj.OutputJSONInfo(blockchain_obj, output_format)
+        for obj in countries_short_to_object_map.values():
+            obj.OutputJSONInfo(blockchain_obj, output_format)
+        blockchain_obj.SaveProviderDistribution(output_format)
     print("Done.", flush=True)
 
     #Output results flag passed
@@ -51,9 +73,9 @@ def main(target_blockchain, providers_to_track, countries_to_track, output):
 
 ## Main Caller ##
 if __name__ == "__main__":
-    if len(sys.argv) > 6:
+    if len(sys.argv) > 13:
         print("ERROR: Too many parameters.\n")
         PrintUsage()
     else:
-        exec_mode, providers_to_track, countries_to_track, output = GetArguments(sys.argv)
-        main(exec_mode, providers_to_track, countries_to_track, output)
\ No newline at end of file
+        exec_mode, providers_to_track, countries_to_track, output, workers, backend, incremental, output_format, profile, prometheus = GetArguments(sys.argv)
+        main(exec_mode, providers_to_track, countries_to_track, output, workers, backend, incremental, output_format, profile, prometheus)
\ No newline at end of file
@@ -14,53 +14,65 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 ############################################
-import sys, json, subprocess, requests, os
+import sys, json, subprocess, requests, os, time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime
 from ipwhois.net import Net #type: ignore
 from ipwhois.asn import IPASN #type: ignore
 
+#Shared utilities live at the root of the repo
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from utilities.journal import Journal
+
 ## Load Settings ##
 BASE_DIR = os.path.dirname(os.path.realpath(__file__))
 with open(BASE_DIR + "/config/SettingsConfig.json", "r") as f:
     loaded = json.load(f)
     SOL_CLI_PATH = loaded["sol_cli"]
     OUTPUT_FOLDER = loaded["output_folder"]
+    RPC_ENDPOINT = loaded.get("rpc_endpoint", "https://api.mainnet-beta.solana.com")
+    RPC_BATCH_SIZE = min(loaded.get("rpc_batch_size", 100), 100) #*getMultipleAccounts takes up to 100 pubkeys
+    RPC_WORKERS = loaded.get("rpc_workers", 4)
+    RPC_RETRIES = loaded.get("rpc_retries", 3)
+    RPC_BACKOFF = loaded.get("rpc_backoff", 1.0) #*seconds, doubled on every retry
     f.close()
 
 ## Classes ##
 class SolanaCLI:
-    apiEndpoint = 'https://api.mainnet-beta.solana.com'
+    apiEndpoint = RPC_ENDPOINT
     requestHeader = {'Content-Type': 'application/json'}
     
-    def __init__(self):
+    def __init__(self, journal: Journal):
         self.objectPath = BASE_DIR + "/memory/SOL_object.pickle"
         self.totalStake = 0
+        self.journal = journal #*Checkpoint of the fetched results, a failed run resumes from it
+
+        #Pooled connections to the RPC endpoint, shared by the concurrent requests
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(RPC_WORKERS, 4))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(self.requestHeader)
 
         #Placeholder Data Structures for commands/request outputs
         self.gossipLookup = {} #*Lookup optimized response of Gossip {IP->{info}}
         self.validatorInfoLookup = {} #*Lookup optimized output of Validator Info Get {pubkey->{info}}
         self.validatorsLookup = {} #*Lookup optimized output of Validators {pubkey->{info}}
         
-        #Run Gossip and Validators
-        self.SetEpoch()
-        self.GetGossip()
-        self.RunValidators()
-        self.RunValidatorInfo()
+        #Run Gossip and Validators concurrently, they don't depend on each other
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [executor.submit(task) for task in [self.SetEpoch, self.GetGossip, self.RunValidators, self.RunValidatorInfo]]
+            for future in futures:
+                future.result() #*re-raises the failure of any task
 
     #API call
     def GetGossip(self):
         print("\tGetting Solana Gossip Nodes.", flush=True)
         
         #Get gossip from API call
-        data = {"jsonrpc":"2.0", "id":1, "method":"getClusterNodes"}
-        result = requests.post(self.apiEndpoint, headers=self.requestHeader, json=data)
-
-        #Fail missed requests gracefully
-        if result.status_code != 200:
-            raise("\n\n[FATAL] Solana Gossip API Request Failed. Try again later")
+        buff = self.Checkpoint("gossip", lambda: self.CallRpc("getClusterNodes"))
         
         #Optimize the result for faster lookups
-        buff = result.json()['result'] 
         for node in buff:
             ip = node.pop('gossip').split(":")[0] #*Pops element, gets only IP portion
             self.gossipLookup[ip] = node
@@ -73,10 +85,9 @@ class SolanaCLI:
         print("\tRunning Solana Validators.", flush=True)
         
         #Run the solana gossip subprocess
-        result = subprocess.run([SOL_CLI_PATH, "validators", "--output", "json"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        buff = self.Checkpoint("validators", lambda: self.RunCli(["validators", "--output", "json"]))
 
         #Get current stake (disregard delinquent stake) and optimize the result for faster lookups
-        buff = json.loads(result.stdout)
         self.totalStake = buff['totalCurrentStake'] / 1000000000
         for val in buff['validators']:
             pubkey = val.pop('identityPubkey')
@@ -90,10 +101,9 @@ class SolanaCLI:
         print("\tRunning Solana Validator Info.", flush=True)
         
         #Run the solana gossip subprocess
-        result = subprocess.run([SOL_CLI_PATH, "validator-info", "get", "--output", "json"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        buff = self.Checkpoint("validator-info", lambda: self.RunCli(["validator-info", "get", "--output", "json"]))
 
         #Optimize the result for faster lookups
-        buff = json.loads(result.stdout)
         for val in buff:
             self.validatorInfoLookup[val['identityPubkey']] = val['info']
         
@@ -119,16 +129,76 @@ class SolanaCLI:
         return validatorInfo
 
     def SetEpoch(self):
-        #Make call
-        data = {"jsonrpc":"2.0","id":1, "method":"getEpochInfo"}
-        result = requests.post(self.apiEndpoint, headers=self.requestHeader, json=data)
+        #Make call and set epoch
+        self.epoch = self.Checkpoint("epoch", lambda: self.CallRpc("getEpochInfo"))['epoch']
 
-        #Fail missed requests gracefully
-        if result.status_code != 200:
-            raise("\n\n[FATAL] Solana getEpochInfo API Request Failed. Try again later")
+    def Checkpoint(self, key: str, fetch):
+        """Returns the journaled result for key, or fetches and journals it"""
+        if key not in self.journal:
+            self.journal.Append(key, fetch())
+        return self.journal.Get(key)
 
-        #Return epoch
-        self.epoch = result.json()['result']['epoch']
+    @classmethod
+    def RunCli(cls, args: list):
+        #Runs a solana subcommand with json output and returns the parsed output
+        result = subprocess.run([SOL_CLI_PATH] + args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        return json.loads(result.stdout)
+
+    def CallRpc(self, method: str, params: list = None):
+        """Posts a JSON-RPC request over the pooled session and returns its result.
+        Failed requests and RPC errors are retried RPC_RETRIES times with exponential backoff."""
+        data = {"jsonrpc":"2.0", "id":1, "method":method}
+        if params is not None:
+            data["params"] = params
+
+        for attempt in range(RPC_RETRIES + 1):
+            try:
+                result = self.session.post(self.apiEndpoint, json=data, timeout=30)
+                if result.status_code == 200 and 'error' not in result.json():
+                    return result.json()['result']
+                error = result.json().get('error') if result.status_code == 200 else "HTTP %d" % result.status_code
+            except (requests.exceptions.RequestException, ValueError) as e:
+                error = e
+
+            if attempt < RPC_RETRIES:
+                time.sleep(RPC_BACKOFF * 2 ** attempt)
+
+        #Fail missed requests gracefully
+        raise Exception("\n\n[FATAL] Solana %s API Request Failed (%s). Try again later" % (method, error))
+
+    def GetBalances(self, pubkeys: list) -> dict:
+        """Returns the SOL balance of every pubkey. Accounts are fetched with getMultipleAccounts in batches of
+        RPC_BATCH_SIZE, RPC_WORKERS at a time. Batches that keep failing fall back to the `solana balance` CLI."""
+        batches = [pubkeys[i:i + RPC_BATCH_SIZE] for i in range(0, len(pubkeys), RPC_BATCH_SIZE)]
+        balances = {}
+
+        with ThreadPoolExecutor(max_workers=RPC_WORKERS) as executor:
+            for batch, batch_balances in zip(batches, executor.map(self.GetBatchBalances, batches)):
+                balances.update(batch_balances)
+                print(f"\tGot {len(balances)}/{len(pubkeys)} balances", flush=True)
+
+        return balances
+
+    def GetBatchBalances(self, batch: list) -> dict:
+        #Batches journaled by a previous run are not fetched again
+        journaled = self.journal.Get(f"balances/{batch[0]}", {})
+        if all(pubkey in journaled for pubkey in batch):
+            return journaled
+
+        balances = self.FetchBatchBalances(batch)
+        self.journal.Append(f"balances/{batch[0]}", balances)
+        return balances
+
+    def FetchBatchBalances(self, batch: list) -> dict:
+        #Only the lamports are needed, skip the account data
+        try:
+            accounts = self.CallRpc("getMultipleAccounts", [batch, {"encoding": "base64", "dataSlice": {"offset": 0, "length": 0}}])['value']
+        except Exception as e:
+            print(f"\t[WARN] Batch balance request failed, falling back to the Solana CLI: {str(e).strip()}", flush=True)
+            return {pubkey: self.GetNodeBalance(pubkey) for pubkey in batch}
+
+        #Accounts that don't exist have no balance
+        return {pubkey: (account['lamports'] / 1000000000 if account else 0.0) for pubkey, account in zip(batch, accounts)} #*Transforming from lamports
 
     def SaveNodes(self, nodes):
         time = str(datetime.today().strftime("%m-%d-%Y"))
@@ -161,9 +231,10 @@ def main():
     MakeSolanaObject()
     nodes = GetIPs()
 
-    #Save the node JSON
+    #Save the node JSON, then drop the journal
     print("\n\nOutputting information to JSON files...")
     SOL_OBJ.SaveNodes(nodes)
+    SOL_OBJ.journal.Finish()
     print("Done.", flush=True)
 
     #Output results if called from CLI
@@ -174,7 +245,7 @@ def MakeSolanaObject():
     global SOL_OBJ
 
     print("Building Solana CLI object for the first time.", flush=True)
-    SOL_OBJ = SolanaCLI()
+    SOL_OBJ = SolanaCLI(Journal("solana"))
     print("Done.", flush=True)
     
     return
@@ -185,6 +256,9 @@ def GetIPs():
     n = len(SOL_OBJ.gossipLookup)
     print(f"\n\nAnalyzing {n} Nodes. This may take a few minutes...", flush=True)
 
+    #Fetch all the balances in batches up front
+    balances = SOL_OBJ.GetBalances([node['pubkey'] for node in SOL_OBJ.gossipLookup.values()])
+
     #Iterate over all gossipNodes
     for ip, node in SOL_OBJ.gossipLookup.items():
         print(f"\tAnalyzing {ip} \t\t ({i}/{n})", flush=True)
@@ -196,7 +270,7 @@ def GetIPs():
         if isValidator:
             extra_info = SOL_OBJ.GetValidatorInfo(pubkey=pubkey)
             stake = extra_info['stake']
-        extra_info['Sol Balance'] = SOL_OBJ.GetNodeBalance(pubkey)
+        extra_info['Sol Balance'] = balances[pubkey]
 
         nodes[ip] = {
             "is_validator": isValidator,
@@ -0,0 +1,52 @@
+import json, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+## Local stub HTTP server for the scraper tests ##
+class StubServer:
+    """Serves the requests of a scraper on 127.0.0.1 from a respond(method, path, body) callback that returns
+    (status, headers, body). Dict and list bodies are sent as JSON. Every request is recorded with its arrival time."""
+    def __init__(self, respond):
+        self.respond = respond
+        self.requests = [] #*(monotonic time, method, path, parsed JSON body or None)
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def Handle(self, method: str):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                body = json.loads(raw) if raw else None
+                with stub.lock:
+                    stub.requests.append((time.monotonic(), method, self.path, body))
+                status, headers, content = stub.respond(method, self.path, body)
+                if not isinstance(content, (bytes, str)):
+                    content = json.dumps(content)
+                content = content.encode() if isinstance(content, str) else content
+
+                self.send_response(status)
+                for name, value in {"Content-Type": "application/json", **headers}.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def do_GET(self):
+                self.Handle("GET")
+
+            def do_POST(self):
+                self.Handle("POST")
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:%d" % self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,104 @@
+import tempfile, time, unittest
+from unittest import mock
+
+from avalanche import avalanche
+from tests.stub_server import StubServer
+from utilities.journal import Journal
+
+FIRST_PAGE = "/v2/network/mainnet/staking/validations?status=active"
+
+class FakeAvascan:
+    """Validator pages of the avascan api linked by cursors. statuses and headers are the responses sent before the
+    pages, one per request."""
+    def __init__(self, pages: int, per_page: int, statuses: list = None, headers: list = None):
+        self.pages = pages
+        self.perPage = per_page
+        self.statuses = list(statuses or [])
+        self.headers = list(headers or [])
+
+    def __call__(self, method, path, body):
+        status = self.statuses.pop(0) if self.statuses else 200
+        headers = self.headers.pop(0) if self.headers else {}
+        if status != 200:
+            return status, headers, {"error": "Too Many Requests"}
+
+        page = int(path.rpartition("cursor=")[2]) if "cursor=" in path else 0
+        items = [{"nodeId": "NodeID-%d" % i, "node": {"ip": "10.0.%d.%d" % divmod(i, 256)}, "stake": {"total": str(i * 1000000000)}, "name": "v%d" % i} for i in range(page * self.perPage, (page + 1) * self.perPage)]
+        link = {"next": "%s&cursor=%d" % (FIRST_PAGE, page + 1)} if page + 1 < self.pages else {}
+        return 200, headers, {"items": items, "link": link}
+
+class TestAdaptivePager(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.journal = Journal("avalanche", folder=self.folder.name)
+
+    def tearDown(self):
+        self.journal.file.close()
+        self.folder.cleanup()
+
+    def Pager(self, server: StubServer, **kwargs):
+        patcher = mock.patch.object(avalanche, "API_URL", server.url)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return avalanche.AdaptivePager(self.journal, **kwargs)
+
+    def test_prefetch_yields_every_validator_once_in_order(self):
+        with StubServer(FakeAvascan(pages=6, per_page=25)) as server:
+            pager = self.Pager(server)
+            records = [record for items in pager.pages(server.url + FIRST_PAGE, time.time() + 60) for record in avalanche.parse_validators(items)]
+
+        self.assertEqual([record["address"] for record in records], ["NodeID-%d" % i for i in range(150)])
+        self.assertEqual(records[149]["stake"], 149)
+
+        #Prefetching doesn't request a page twice, and every page is journaled
+        paths = [path for _, _, path, _ in server.requests]
+        self.assertEqual(len(paths), 6)
+        self.assertEqual(len(set(paths)), 6)
+        self.assertEqual(len(self.journal), 6)
+
+    def test_journaled_pages_are_not_fetched_again(self):
+        with StubServer(FakeAvascan(pages=4, per_page=10)) as server:
+            list(self.Pager(server).pages(server.url + FIRST_PAGE, time.time() + 60))
+            items = [item for page in self.Pager(server).pages(server.url + FIRST_PAGE, time.time() + 60) for item in page]
+
+        self.assertEqual(len(server.requests), 4)
+        self.assertEqual(len(items), 40)
+
+    def test_rate_halves_on_429_and_grows_back_after_successes(self):
+        with StubServer(FakeAvascan(pages=1, per_page=1, statuses=[429], headers=[{"Retry-After": "0.2"}])) as server:
+            pager = self.Pager(server, step=5, max_rate=20)
+            pager.rate = 8
+            pager.fetch(server.url + FIRST_PAGE)
+
+            #Halved to 4 by the 429, then raised by one step on the retry that succeeded
+            self.assertEqual(pager.rate, 9)
+            rates = []
+            for _ in range(3):
+                pager.fetch(server.url + FIRST_PAGE)
+                rates.append(pager.rate)
+
+        #Unbounded again once the rate reaches max_rate
+        self.assertEqual(rates, [14, 19, None])
+
+        #The retry waited out Retry-After, the later requests were paced by the rate
+        times = [arrival for arrival, _, _, _ in server.requests]
+        self.assertGreaterEqual(times[1] - times[0], 0.2)
+        self.assertGreaterEqual(times[2] - times[1], 1 / 9 - 0.01)
+
+    def test_rate_limit_headers_pace_the_next_request(self):
+        headers = [{"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "0.3"}, {"X-RateLimit-Remaining": "5"}]
+        with StubServer(FakeAvascan(pages=1, per_page=1, headers=headers)) as server:
+            pager = self.Pager(server)
+            pager.fetch(server.url + FIRST_PAGE)
+            self.assertGreater(pager.waitUntil, time.monotonic())
+            pager.fetch(server.url + FIRST_PAGE)
+
+            #Headroom left, no wait before the next request
+            self.assertEqual(pager.waitUntil, 0.0)
+
+        times = [arrival for arrival, _, _, _ in server.requests]
+        self.assertGreaterEqual(times[1] - times[0], 0.25)
+        self.assertIsNone(pager.rate)
+
+if __name__ == "__main__":
+    unittest.main()
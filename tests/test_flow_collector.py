@@ -0,0 +1,83 @@
+import base64, json, tempfile, unittest
+
+from flow import flow_nodes
+from tests.stub_server import StubServer
+from utilities.journal import Journal
+
+NODE_INFO_FIELDS = ["id", "role", "networkingAddress", "networkingKey", "stakingKey", "tokensStaked", "tokensCommitted", "tokensUnstaking", "tokensUnstaked", "tokensRewarded", "delegators", "delegatorIDCounter", "tokensRequestedToUnstake", "initialWeight"]
+
+def NodeIds(count: int) -> list:
+    """The JSON-Cadence String values returned by get_id_nodes"""
+    return [{"type": "String", "value": "%064x" % i} for i in range(count)]
+
+class StubScripts:
+    """The /v1/scripts endpoint of the Flow REST API, running the batched NodeInfo script. failures[first node id of a
+    batch] is the list of HTTP statuses returned before the batch succeeds, or None to always fail it."""
+    def __init__(self, failures: dict = None):
+        self.failures = failures or {}
+
+    def __call__(self, method, path, body):
+        node_ids = [node["value"] for node in json.loads(base64.b64decode(body["arguments"][0]))["value"]]
+        if node_ids[0] in self.failures:
+            pending = self.failures[node_ids[0]]
+            if pending is None or pending:
+                return pending.pop(0) if pending else 500, {}, {"message": "execution failed"}
+
+        infos = [{"type": "Struct", "value": {"id": "A.8624b52f9ddcd04a.FlowIDTableStaking.NodeInfo", "fields": [{"name": name, "value": {"type": "String", "value": node_id if name == "id" else "%s-%s" % (name, node_id[-4:])}} for name in NODE_INFO_FIELDS]}} for node_id in node_ids]
+        return 200, {}, json.dumps(base64.b64encode(json.dumps({"type": "Array", "value": infos}).encode()).decode())
+
+class TestFlowCollector(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.journal = Journal("flow", folder=self.folder.name)
+
+    def tearDown(self):
+        self.journal.file.close()
+        self.folder.cleanup()
+
+    def Settings(self, server: StubServer, **kwargs) -> dict:
+        return {**flow_nodes.COLLECTOR_DEFAULTS, "scripts_url": server.url + "/v1/scripts", "backoff": 0, **kwargs}
+
+    def test_batch_returns_the_node_info_of_every_id_in_order(self):
+        nodes = NodeIds(30)
+        with StubServer(StubScripts()) as server:
+            infos = flow_nodes.get_nodes_info(nodes, settings=self.Settings(server))
+
+        self.assertEqual(len(server.requests), 1)
+        self.assertEqual(len(infos), 30)
+        self.assertEqual([fields[0]["value"]["value"] for fields in infos], [node["value"] for node in nodes])
+        self.assertEqual([field["name"] for field in infos[0]], NODE_INFO_FIELDS)
+
+    def test_nodes_are_collected_in_batches(self):
+        nodes = NodeIds(250)
+        with StubServer(StubScripts()) as server:
+            infos = flow_nodes.collect_nodes_info(nodes, self.journal, self.Settings(server))
+
+        self.assertEqual(sorted(len(json.loads(base64.b64decode(body["arguments"][0]))["value"]) for _, _, _, body in server.requests), [50, 100, 100])
+        self.assertEqual([fields[0]["value"]["value"] for fields in infos], [node["value"] for node in nodes])
+
+    def test_failed_batch_is_retried(self):
+        nodes = NodeIds(50)
+        with StubServer(StubScripts(failures={nodes[0]["value"]: [500, 503]})) as server:
+            infos = flow_nodes.collect_nodes_info(nodes, self.journal, self.Settings(server, retries=2))
+
+        self.assertEqual(len(server.requests), 3)
+        self.assertEqual(len(infos), 50)
+
+    def test_resumes_from_the_journaled_batches(self):
+        nodes = NodeIds(250)
+        with StubServer(StubScripts(failures={nodes[100]["value"]: None})) as server:
+            with self.assertRaises(RuntimeError):
+                flow_nodes.collect_nodes_info(nodes, self.journal, self.Settings(server, retries=1))
+        self.assertEqual(len(self.journal), 2)
+
+        #The next run only sends the batch that failed
+        self.journal.file.close()
+        self.journal = Journal("flow", folder=self.folder.name)
+        with StubServer(StubScripts()) as server:
+            infos = flow_nodes.collect_nodes_info(nodes, self.journal, self.Settings(server))
+        self.assertEqual([json.loads(base64.b64decode(body["arguments"][0]))["value"][0] for _, _, _, body in server.requests], [nodes[100]])
+        self.assertEqual(len(infos), 250)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+import importlib.util, json, os, tempfile, unittest
+from unittest import mock
+
+from tests.stub_server import StubServer
+from utilities.journal import Journal
+
+SCRAPER_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "solana", "solana-node-scraper.py")
+
+def LoadScraper(rpc_endpoint: str):
+    """Imports the Solana scraper with a SettingsConfig.json that points it to the stub RPC endpoint"""
+    settings = {"sol_cli": "solana", "output_folder": tempfile.gettempdir(), "rpc_endpoint": rpc_endpoint, "rpc_workers": 4, "rpc_retries": 3, "rpc_backoff": 0}
+    spec = importlib.util.spec_from_file_location("solana_node_scraper", SCRAPER_PATH)
+    module = importlib.util.module_from_spec(spec)
+    with mock.patch("builtins.open", mock.mock_open(read_data=json.dumps(settings))):
+        spec.loader.exec_module(module)
+    return module
+
+def Lamports(pubkey: str):
+    """Balance the stub RPC returns for a pubkey, None for the accounts that don't exist"""
+    index = int(pubkey[3:])
+    return None if index % 7 == 0 else index * 1000000000 + 1
+
+class MockRpc:
+    """getMultipleAccounts, getEpochInfo and getClusterNodes of a Solana RPC node. failures[first pubkey of a batch]
+    is the list of HTTP statuses returned before the batch succeeds."""
+    def __init__(self, failures: dict = None):
+        self.failures = failures or {}
+
+    def __call__(self, method, path, body):
+        params = body.get("params")
+        if body["method"] == "getEpochInfo":
+            return 200, {}, {"jsonrpc": "2.0", "id": 1, "result": {"epoch": 500}}
+        if body["method"] == "getClusterNodes":
+            return 200, {}, {"jsonrpc": "2.0", "id": 1, "result": [{"pubkey": "key1", "gossip": "1.2.3.4:8001"}]}
+
+        pending = self.failures.get(params[0][0])
+        if pending:
+            return pending.pop(0), {}, {"error": "unavailable"}
+        accounts = [None if Lamports(pubkey) is None else {"lamports": Lamports(pubkey), "owner": "11111111111111111111111111111111"} for pubkey in params[0]]
+        return 200, {}, {"jsonrpc": "2.0", "id": 1, "result": {"context": {"slot": 1}, "value": accounts}}
+
+class TestSolanaBalances(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.journal = Journal("solana", folder=self.folder.name)
+
+    def tearDown(self):
+        self.journal.file.close()
+        self.folder.cleanup()
+
+    def MakeCli(self, rpc: MockRpc, server: StubServer):
+        scraper = LoadScraper(server.url)
+        with mock.patch.object(scraper.SolanaCLI, "RunCli", side_effect=[{"totalCurrentStake": 0, "validators": []}, []]):
+            return scraper.SolanaCLI(self.journal)
+
+    def BalanceRequests(self, server: StubServer) -> list:
+        return [body for _, _, _, body in server.requests if body["method"] == "getMultipleAccounts"]
+
+    def test_batches_of_at_most_100_keys_in_input_order(self):
+        pubkeys = ["key%d" % i for i in range(1, 251)]
+        rpc = MockRpc()
+        with StubServer(rpc) as server:
+            cli = self.MakeCli(rpc, server)
+            balances = cli.GetBalances(pubkeys)
+
+        requests = self.BalanceRequests(server)
+        self.assertEqual(len(requests), 3)
+        self.assertTrue(all(len(body["params"][0]) <= 100 for body in requests))
+        self.assertEqual(sorted(pubkey for body in requests for pubkey in body["params"][0]), sorted(pubkeys))
+
+        #Every balance belongs to its own pubkey, accounts that don't exist have no balance
+        self.assertEqual(list(balances), pubkeys)
+        for pubkey in pubkeys:
+            expected = 0.0 if Lamports(pubkey) is None else Lamports(pubkey) / 1000000000
+            self.assertEqual(balances[pubkey], expected)
+        self.assertEqual(balances["key7"], 0.0)
+
+    def test_retries_after_rate_limit_and_server_errors(self):
+        pubkeys = ["key%d" % i for i in range(1, 151)]
+        rpc = MockRpc(failures={"key101": [429, 503]})
+        with StubServer(rpc) as server:
+            cli = self.MakeCli(rpc, server)
+            with mock.patch.object(cli, "GetNodeBalance", side_effect=AssertionError("fell back to the CLI")):
+                balances = cli.GetBalances(pubkeys)
+
+        #The failing batch is sent three times, the other one once
+        first_keys = [body["params"][0][0] for body in self.BalanceRequests(server)]
+        self.assertEqual(first_keys.count("key101"), 3)
+        self.assertEqual(first_keys.count("key1"), 1)
+        self.assertEqual(balances["key101"], Lamports("key101") / 1000000000)
+        self.assertEqual(len(balances), 150)
+
+    def test_journaled_batches_are_not_fetched_again(self):
+        pubkeys = ["key%d" % i for i in range(1, 151)]
+        rpc = MockRpc()
+        with StubServer(rpc) as server:
+            self.MakeCli(rpc, server).GetBalances(pubkeys)
+            requests = len(self.BalanceRequests(server))
+
+            #A new run resumes from the journal on disk
+            self.journal.file.close()
+            self.journal = Journal("solana", folder=self.folder.name)
+            balances = self.MakeCli(rpc, server).GetBalances(pubkeys)
+
+        self.assertEqual(len(self.BalanceRequests(server)), requests)
+        self.assertEqual(balances["key150"], Lamports("key150") / 1000000000)
+
+if __name__ == "__main__":
+    unittest.main()
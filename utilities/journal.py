@@ -0,0 +1,68 @@
+import json, os, threading, time
+
+#The scrapers keep their journals in the repo's memory folder
+JOURNAL_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "memory", "journals")
+JOURNAL_MAX_AGE = 24 * 3600 #*seconds, older journals belong to a previous collection and are discarded
+
+## Scraper checkpoint journal ##
+class Journal:
+    """Append-only JSONL journal of the pages and records a scraper has fetched, keyed by page, cursor or id.
+    A scraper that dies midway resumes from its journal and only fetches what is missing. Finish() removes
+    the journal once the chain's JSON file is written, so the next collection starts fresh."""
+    def __init__(self, name: str, folder: str = JOURNAL_FOLDER, max_age: int = JOURNAL_MAX_AGE):
+        self.path = os.path.join(folder, f"{name}.jsonl")
+        self.entries = {} #*key -> value, in journal order
+        self.lock = threading.Lock()
+        created = time.time()
+
+        if os.path.isfile(self.path):
+            with open(self.path, "r+") as f:
+                content = f.read()
+
+                #A run killed mid-write leaves a partial last line, drop it so that entry is fetched again
+                if not content.endswith("\n"):
+                    content = content[:content.rfind("\n") + 1]
+                    f.truncate(len(content.encode()))
+                f.close()
+            lines = content.splitlines()
+
+            try:
+                created = json.loads(lines[0])["created"]
+            except (IndexError, ValueError, KeyError, TypeError):
+                created = 0
+            if time.time() - created > max_age:
+                print(f"\tDiscarding stale journal {self.path}", flush=True)
+                os.remove(self.path)
+                created = time.time()
+            else:
+                for line in lines[1:]:
+                    entry = json.loads(line)
+                    self.entries[entry["key"]] = entry["value"]
+                print(f"\tResuming from {len(self.entries)} journaled entries in {self.path}", flush=True)
+
+        os.makedirs(folder, exist_ok=True)
+        self.file = open(self.path, "a")
+        if not self.file.tell():
+            self.file.write(json.dumps({"created": created}) + "\n")
+            self.file.flush()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def Get(self, key: str, default=None):
+        return self.entries.get(key, default)
+
+    def Append(self, key: str, value):
+        """Records the value fetched for key, flushed so it survives the process dying"""
+        with self.lock:
+            self.entries[key] = value
+            self.file.write(json.dumps({"key": key, "value": value}, default=str) + "\n")
+            self.file.flush()
+
+    def Finish(self):
+        """Closes and removes the journal after the collection was materialized"""
+        self.file.close()
+        os.remove(self.path)
@@ -0,0 +1,94 @@
+import asyncio, ipaddress, json, os, time
+
+import dns.asyncresolver, dns.exception #type: ignore
+
+#Defaults for the scrapers, which share the cache in the repo's memory folder
+DNS_CACHE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "memory", "dns_cache.json")
+DNS_CONCURRENCY = 32
+DNS_MIN_TTL = 300 #*seconds, floor for the record TTLs so short-lived records are still reused within a run
+DNS_NEGATIVE_TTL = 60 #*seconds a failed lookup is cached
+DNS_TIMEOUT = 5.0
+
+## Shared DNS resolver ##
+class DnsResolver:
+    """Resolves hostnames to IP addresses with asyncio, up to `concurrency` lookups at a time.
+    A records are preferred and AAAA records are used for IPv6-only hosts. Answers are cached per hostname
+    for the TTL of their records and persisted as JSON at cache_path between runs."""
+    def __init__(self, cache_path: str = DNS_CACHE_PATH, concurrency: int = DNS_CONCURRENCY, min_ttl: int = DNS_MIN_TTL, timeout: float = DNS_TIMEOUT, nameservers: list = None, port: int = 53):
+        self.cachePath = cache_path
+        self.concurrency = concurrency
+        self.minTtl = min_ttl
+        self.timeout = timeout
+        self.nameservers = nameservers #*None uses the system resolver configuration
+        self.port = port
+        self.hits = 0
+        self.misses = 0
+        self.cache = {} #*hostname -> {"addresses": [ip], "expires": epoch seconds}
+
+        if cache_path and os.path.isfile(cache_path):
+            try:
+                with open(cache_path, "r") as f:
+                    self.cache = json.load(f)
+                    f.close()
+            except (OSError, ValueError) as e:
+                print(f"\t[WARN] Ignoring unreadable DNS cache {cache_path}: {e}", flush=True)
+
+    def Resolve(self, hostnames) -> dict:
+        """Returns {hostname: first address or None} for the hostnames. IP literals map to themselves."""
+        return {hostname: addresses[0] if addresses else None for hostname, addresses in self.ResolveAll(hostnames).items()}
+
+    def ResolveAll(self, hostnames) -> dict:
+        """Returns {hostname: [addresses]} for the hostnames, an empty list if a hostname can't be resolved"""
+        results = asyncio.run(self.Gather(list(dict.fromkeys(hostnames))))
+        self.Save()
+        return results
+
+    async def Gather(self, hostnames: list) -> dict:
+        resolver = dns.asyncresolver.Resolver(configure=self.nameservers is None)
+        if self.nameservers is not None:
+            resolver.nameservers = self.nameservers
+            resolver.port = self.port
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        addresses = await asyncio.gather(*[self.Lookup(hostname, resolver, semaphore) for hostname in hostnames])
+        return dict(zip(hostnames, addresses))
+
+    async def Lookup(self, hostname: str, resolver, semaphore: asyncio.Semaphore) -> list:
+        #IP literals, including bracketed IPv6, need no lookup
+        try:
+            return [str(ipaddress.ip_address(hostname.strip("[]")))]
+        except ValueError:
+            pass
+
+        now = time.time()
+        cached = self.cache.get(hostname)
+        if cached is not None and cached["expires"] > now:
+            self.hits += 1
+            return cached["addresses"]
+        self.misses += 1
+
+        #Try IPv4 first, then IPv6
+        addresses, ttl = [], DNS_NEGATIVE_TTL
+        async with semaphore:
+            for record_type in ["A", "AAAA"]:
+                try:
+                    answer = await resolver.resolve(hostname, record_type, lifetime=self.timeout)
+                except dns.exception.DNSException:
+                    continue
+                addresses = [record.address for record in answer]
+                ttl = max(answer.rrset.ttl, self.minTtl)
+                break
+
+        self.cache[hostname] = {"addresses": addresses, "expires": now + ttl}
+        return addresses
+
+    def Save(self):
+        """Writes the unexpired cache entries to cache_path"""
+        if not self.cachePath:
+            return
+        now = time.time()
+        os.makedirs(os.path.dirname(self.cachePath), exist_ok=True)
+        with open(self.cachePath + ".tmp", "w") as f:
+            json.dump({hostname: entry for hostname, entry in self.cache.items() if entry["expires"] > now}, f)
+            f.close()
+        os.replace(self.cachePath + ".tmp", self.cachePath)
@@ -1,5 +1,7 @@
 import os
 import config.globals
+from analysis.instrumentation import LOG_LEVELS
+from analysis.writers import OUTPUT_FORMATS, MissingFormatModule
 from utilities.usage import PrintUsage
 
 def LoadConfigFilesAndGetAllowedProviders() -> list:
@@ -33,7 +35,7 @@ def GetArguments(args: list) -> tuple:
         print("\tValid values are:", allowed_blockchains)
         exit(1)
     
-    allowed_commands = {"--providers", "--blockchain", "--countries", "--output", "--help"}
+    allowed_commands = {"--providers", "--blockchain", "--countries", "--workers", "--backend", "--output", "--incremental", "--format", "--log-level", "--profile", "--prometheus", "--help"}
     allowed_providers = LoadConfigFilesAndGetAllowedProviders()
 
     #Set output folder and flag
@@ -41,10 +43,29 @@ def GetArguments(args: list) -> tuple:
     if "--output" in ''.join(args):
         output_message = True
         args.remove("--output")
+
+    #Set incremental flag
+    incremental = False
+    if "--incremental" in args:
+        incremental = True
+        args.remove("--incremental")
+
+    #Set profiling and Prometheus report flags
+    profile = False
+    if "--profile" in args:
+        profile = True
+        args.remove("--profile")
+    prometheus = False
+    if "--prometheus" in args:
+        prometheus = True
+        args.remove("--prometheus")
     
     #Initialize list of providers and countries to track
     providers_to_track = {} #* short -> provider_name
     countries_to_track = {} #* two letter code -> country name
+    workers = config.globals.ENRICHMENT_WORKERS
+    backend = config.globals.LOOKUP_BACKEND
+    output_format = "json"
 
     #Get commands and values
     for arg in args:
@@ -65,15 +86,20 @@ def GetArguments(args: list) -> tuple:
             print("\tValid arguments are:", allowed_commands)
             exit(1)
 
-        #Target blockchain
+        #Target blockchains
         if command == "--blockchain":
-            #Check for allowed blockchain
-            if value not in allowed_blockchains:
-                print("ERROR: There is no file named %s.json in the `json/` folder. Can't perform analysis." % value)
-                print("\tValid values are:", allowed_blockchains)
-                exit(1)
-            else:
-                target_blockchain = value
+            blockchains = sorted(allowed_blockchains) if value == "all" else value.split(",")
+
+            #Check for allowed blockchains
+            for blockchain in blockchains:
+                if blockchain not in allowed_blockchains:
+                    print("ERROR: There is no file named %s.json in the `json/` folder. Can't perform analysis." % blockchain)
+                    print("\tThe expected format is --blockchain=<val1>,<val2>,... (no spaces between values) or --blockchain=all")
+                    print("\tValid values are:", allowed_blockchains)
+                    exit(1)
+
+            #Add to list
+            target_blockchains = list(dict.fromkeys(blockchains))
 
         #Providers
         elif command == "--providers":
@@ -109,4 +135,47 @@ def GetArguments(args: list) -> tuple:
                 else:
                     countries_to_track[short] = config.globals.COUNTRY_NAME_LOOKUP[short]
 
-    return target_blockchain, providers_to_track, countries_to_track, output_message
+        #Enrichment workers
+        elif command == "--workers":
+            if not value.isdigit() or int(value) < 1:
+                print("ERROR: The number of workers %s is not a positive integer." % value)
+                print("\tThe expected format is --workers=<N>")
+                exit(1)
+            workers = int(value)
+
+        #Lookup backend
+        elif command == "--backend":
+            if value not in {"remote", "local"}:
+                print("ERROR: The lookup backend %s is not supported." % value)
+                print("\tValid values are: ['remote', 'local']")
+                exit(1)
+            backend = value
+
+        #Output format
+        elif command == "--format":
+            if value not in OUTPUT_FORMATS:
+                print("ERROR: The output format %s is not supported." % value)
+                print("\tValid values are:", list(OUTPUT_FORMATS))
+                exit(1)
+            missing = MissingFormatModule(value)
+            if missing:
+                print("ERROR: The %s output format needs the %s package." % (value, missing))
+                print("\tInstall requirements/output_requirements.txt or use --format=json.")
+                exit(1)
+            output_format = value
+
+        #Log level
+        elif command == "--log-level":
+            if value not in LOG_LEVELS:
+                print("ERROR: The log level %s is not supported." % value)
+                print("\tValid values are:", list(LOG_LEVELS))
+                exit(1)
+            config.globals.LOG_LEVEL = value
+
+    #The remote backend needs the ipinfo token
+    if backend == "remote" and not config.globals.IPINFO_TOKEN:
+        print("ERROR: Missing ipinfo token in config/keys.json. It is required by the remote lookup backend.")
+        print("\tAdd the token or use --backend=local.")
+        exit(1)
+
+    return target_blockchains, providers_to_track, countries_to_track, output_message, workers, backend, incremental, output_format, profile, prometheus
@@ -21,7 +21,7 @@ def PrintCountryCompletion(short_to_object_map, target, blockchain_obj):
             print("\n%s:" % obj.country_name)
             print("\tMonitoring since %s" % (obj.objectCreationDate))
             print("\tThere are", obj.validatorCount, "VALIDATORS running out of %s." % obj.country_name)
-            print("\tThere have been", len(obj.nodeDict), "different nodes (IPs) seen running on %s since the start of this monitoring." % obj.country_name)
+            print("\tThere have been", len(obj.nodeRecords), "different nodes (IPs) seen running on %s since the start of this monitoring." % obj.country_name)
     
     print("\n\nThere is a total of %d IPs seen on %s" % (blockchain_obj.totalNodes, target))
     print("There is a total of %d validator nodes on %s" % (blockchain_obj.totalValidators, target))
@@ -35,18 +35,31 @@ def PrintUsage():
         "of nodes of each provider specified in the PorviderLookup.json file, for a specified chain in the command line")
 
     print("\n\n-----PARAMETERS-----")
-    print("The tool takes 1 mandatory parameter and 3 optional parameters in the following format:")
-    print("\n>[MANDATORY] --blockchain=<value> -> Defines the target blockchain to analyze. Value must exist in the `json/` directory without the \".json\" extension.")
+    print("The tool takes 1 mandatory parameter and 10 optional parameters in the following format:")
+    print("\n>[MANDATORY] --blockchain=<val1>,<val2> -> Defines the target blockchains to analyze. Values must exist in the `json/` directory without the \".json\" extension.",
+        "Use \"all\" to analyze every file in the directory. The IPs of all target blockchains are looked up in a single pass.")
     print("\n> --providers=<val1>,<val2> -> Defines the providers for which to track nodes, based on the config/ProviderConfig.json and following",
         "the format defined on the README. Default is None.")
     print("\n> --countries=<val1>,<val2> -> Defines the countries for which to track nodes, based on the config/CountriesConfig.json and following",
         "ISO Alpha-2 country code convention. Default is None.")
+    print("\n> --workers=<N> -> Defines the number of concurrent ASN and geo lookups. Default is set by ENRICHMENT_WORKERS in config/globals.py.")
+    print("\n> --backend=<remote|local> -> Defines where ASN and geo data come from. \"remote\" queries ipwhois and ipinfo,",
+        "\"local\" reads the MMDB databases set in config/globals.py with no network access. Default is remote.")
+    print("\n> --incremental -> Only aggregates the nodes that were added, removed, or changed since the last incremental run of the blockchain.",
+        "The previous run is kept in the `memory/` folder, the first run analyzes all nodes.")
+    print("\n> --format=<json|jsonl|parquet|msgpack> -> Defines the format of the output files. \"json\" writes pretty printed JSON,",
+        "the other formats write the aggregates as a small table and the nodes as flat rows, with the provider and country totals in a separate \"_Totals\" file. Default is json.")
+    print("\n> --log-level=<debug|info|warn|error> -> Defines which lookup messages are printed. \"debug\" also prints every successful lookup,",
+        "\"warn\" hides the enrichment progress and \"error\" also hides the failed lookups. Default is info.")
+    print("\n> --profile -> Runs the analysis under cProfile and tracemalloc. The stats are saved to \"output/reports/\" and the top functions and allocations are added to the run report.")
+    print("\n> --prometheus -> Also writes the run report in the Prometheus text format.")
     print("\n> --output -> Prints an overview of the results upon completion.")
     print("\n> --help -> Prints this message.")
 
     print("\n\n-----OUTPUT-----")
     print("The tool will build one file: \"output/<target_chain>/network/ProviderDistribution-<date>.json\" containing the infrasturcure analysis of the chain.")
     print("If \"--providers\" is specified, the tool will build a provider-<date>.json for every provider specified under \"output/<target_chain>/providers/\", containing a list of all nodes running on that provider.")
+    print("Every run writes a report with the time and peak memory of each stage, lookup latencies and cache hits to \"output/reports/RunReport-<time>.json\".")
 
     print("\nFor a full description, see the README.md\n")
 